@@ -31,6 +31,7 @@ import datetime
 import imp
 import pkgutil
 import codecs
+import threading
 import netifaces
 from argparse import ArgumentParser
 
@@ -64,8 +65,40 @@ class Config:
         self.database_debug = False
         self.twophase_commit = False
 
+        # EvaluationService.
+        self.max_evaluation_chunks = 1
+        self.min_testcases_per_chunk = 10
+        self.worker_cache_affinity = True
+        self.compilation_cache = False
+        self.skip_failed_groups = False
+        self.job_journal = True
+        self.fair_share_queue = False
+        self.first_submission_boost = False
+        self.shortest_job_first_weight = 0.0
+        self.speculative_dispatch = False
+        self.user_test_workers = []
+        self.lane_borrowing = True
+        self.reference_hardware_class = ""
+        self.worker_speed_tolerance = 0.1
+        self.drain_deviating_workers = False
+        self.fused_jobs = False
+        self.prefetch_jobs = False
+        self.evaluation_progress = False
+        self.adaptive_worker_timeout = False
+
         # Worker.
         self.keep_sandbox = True
+        self.evaluation_cache = False
+        self.worker_slots = 1
+        self.worker_pin_cpus = False
+        self.worker_cpus = []
+        self.worker_hardware_class = ""
+        self.worker_calibration = False
+        self.worker_calibration_interval = 3600
+        self.sandbox_provisioning = "copy"
+        self.memory_cache_dir = "/dev/shm"
+        self.memory_cache_size = 0
+        self.parallel_testcases = 1
 
         # WebServers.
         self.secret_key = "8e045a51e4b102ea803c06f92841a1fb",
@@ -387,9 +420,23 @@ class Logger(object):
     def __init__(self):
         self._log_service = RemoteService(None,
                                           ServiceCoord("LogService", 0))
-        self.operation = ""
+        # The operation is kept for each thread, as a service (e.g.,
+        # a Worker with many slots) can do many at the same time.
+        self._local = threading.local()
         self._my_coord = None
 
+    @property
+    def operation(self):
+        """The high-level description of the long-term operation that
+        the current thread is doing (empty if none).
+
+        """
+        return getattr(self._local, "operation", "")
+
+    @operation.setter
+    def operation(self, operation):
+        self._local.operation = operation
+
     def redirect_stdout_stderr(self):
         """If stdout is not currently heading somewhere useful, then redirect
         it to our logfile.
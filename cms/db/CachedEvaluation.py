@@ -0,0 +1,72 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+# Programming contest management system
+# Copyright © 2010-2012 Giovanni Mascellani <mascellani@poisson.phc.unipi.it>
+# Copyright © 2010-2012 Stefano Maggiolo <s.maggiolo@gmail.com>
+# Copyright © 2010-2012 Matteo Boscariol <boscarim@hotmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""SQLAlchemy interfaces to store the outcomes of the evaluations of
+testcases, to reuse them. Not to be used directly (import from
+SQLAlchemyAll).
+
+"""
+
+from sqlalchemy import Column, Integer, String, Float
+
+from cms.db.SQLAlchemyUtils import Base
+
+
+class CachedEvaluation(Base):
+    """Class to store the outcome of the evaluation of a testcase,
+    identified by everything that can change it (see
+    EvaluationJob.get_cache_key), independently of the submission
+    that was evaluated.
+
+    """
+    __tablename__ = 'cached_evaluations'
+
+    # Auto increment primary key.
+    id = Column(
+        Integer,
+        primary_key=True)
+
+    # Key identifying the inputs of the evaluation.
+    key = Column(
+        String,
+        nullable=False,
+        unique=True)
+
+    # Text and outcome of the evaluation, as in Evaluation.
+    text = Column(
+        String,
+        nullable=True)
+    outcome = Column(
+        String,
+        nullable=True)
+
+    # Memory used by the evaluation, in bytes.
+    memory_used = Column(
+        Integer,
+        nullable=True)
+
+    # Evaluation's time and wall-clock time, in s.
+    execution_time = Column(
+        Float,
+        nullable=True)
+    execution_wall_clock_time = Column(
+        Float,
+        nullable=True)
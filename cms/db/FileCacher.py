@@ -28,6 +28,8 @@ import os
 import tempfile
 import shutil
 import hashlib
+import threading
+from collections import OrderedDict
 
 from cms import config, logger, mkdir
 from cms.db.SQLAlchemyAll import SessionGen, FSObject
@@ -301,6 +303,145 @@ class DBBackend(FileCacherBackend):
                 return _list(session)
 
 
+class MemoryTier:
+    """A copy of some files of the cache of a FileCacher in a
+    directory on a memory file system (e.g., tmpfs), up to a maximum
+    total size, evicting the least recently used files when more
+    space is needed. It can be used by many threads.
+
+    """
+    def __init__(self, path, capacity):
+        """Initialization.
+
+        path (string): the directory where to keep the files, that is
+                       emptied (it should be on a memory file system).
+        capacity (int): the maximum total size of the files, in bytes.
+
+        """
+        self.path = path
+        self.capacity = capacity
+
+        # The size of the files in the tier, by digest, from the
+        # least recently used.
+        self._files = OrderedDict()
+        # The size of those files and of the ones being copied.
+        self._size = 0
+        # An event set when the copy ends, for the files being copied
+        # (which are copied without holding the lock).
+        self._copying = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+        if not mkdir(self.path):
+            logger.error("Cannot create memory tier directory `%s'." %
+                         self.path)
+
+    def get_path(self, digest, cache_path, count=True):
+        """Return the path of a file in the tier, copying it there
+        from the cache (evicting other files) if it is not there yet.
+
+        digest (string): the digest of the file.
+        cache_path (string): the path of the file in the cache.
+        count (bool): whether to count the request in the hits and
+                      misses (not for the files we preload).
+
+        return (string): the path of the file in the tier, or None if
+                         it is larger than the tier.
+
+        """
+        path = os.path.join(self.path, digest)
+        with self._lock:
+            if digest in self._files:
+                self._files[digest] = self._files.pop(digest)
+                if count:
+                    self.hits += 1
+                return path
+
+            copying = self._copying.get(digest)
+            if copying is None:
+                if count:
+                    self.misses += 1
+                size = os.stat(cache_path).st_size
+                if size > self.capacity:
+                    return None
+                while self._size + size > self.capacity and \
+                        len(self._files) > 0:
+                    old_digest, old_size = self._files.popitem(last=False)
+                    try:
+                        os.remove(os.path.join(self.path, old_digest))
+                    except OSError:
+                        pass
+                    self._size -= old_size
+                    self.evictions += 1
+                # The rest of the space is taken by files being copied.
+                if self._size + size > self.capacity:
+                    return None
+                # We reserve the space, and copy the file afterwards.
+                self._size += size
+                self._copying[digest] = threading.Event()
+
+        # Another thread is copying the file, we wait for it.
+        if copying is not None:
+            copying.wait()
+            with self._lock:
+                if digest in self._files:
+                    self._files[digest] = self._files.pop(digest)
+                    if count:
+                        self.hits += 1
+                    return path
+            return None
+
+        success = False
+        try:
+            temp_path = path + ".tmp"
+            shutil.copyfile(cache_path, temp_path)
+            os.rename(temp_path, path)
+            success = True
+        finally:
+            with self._lock:
+                if success:
+                    self._files[digest] = size
+                else:
+                    self._size -= size
+                self._copying.pop(digest).set()
+        return path
+
+    def discard(self, digest):
+        """Remove a file from the tier, if it is there.
+
+        digest (string): the digest of the file.
+
+        """
+        with self._lock:
+            if digest in self._files:
+                self._size -= self._files.pop(digest)
+                try:
+                    os.remove(os.path.join(self.path, digest))
+                except OSError:
+                    pass
+
+    def get_status(self):
+        """Return the statistics of the tier.
+
+        return (dict): the number of hits, misses and evictions, the
+                       number of files, and the size and capacity in
+                       bytes.
+
+        """
+        with self._lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "files": len(self._files),
+                    "size": self._size,
+                    "capacity": self.capacity}
+
+
 class FileCacher:
     """This class implement a local cache for files stored as FSObject
     in the database.
@@ -322,6 +463,9 @@ class FileCacher:
 
         """
         self.service = service
+        # If not None, the MemoryTier from which sandboxes get their
+        # files (see get_cached_path).
+        self.memory_tier = None
         if path is None:
             self.backend = DBBackend(self.service)
         else:
@@ -366,29 +510,13 @@ class FileCacher:
             raise ValueError("Ask for at most one amongst content, "
                              "temp path and temp file obj.")
 
-        cache_path = os.path.join(self.obj_dir, digest)
-        cache_exists = os.path.exists(cache_path)
-
-        logger.debug("Getting file %s." % (digest))
-
-        if not cache_exists:
-            logger.debug("File %s not in cache, downloading "
-                         "from database." % digest)
-
-            # Receives the file from the database
-            temp_file, temp_filename = tempfile.mkstemp(dir=self.tmp_dir)
-            temp_file = os.fdopen(temp_file, "wb")
-            self.backend.get_file(digest, temp_filename)
-
-            # And move it in the cache. Warning: this is not atomic if
-            # the temp and the cache dir are on different filesystems.
-            shutil.move(temp_filename, cache_path)
-
-            logger.debug("File %s downloaded." % digest)
+        cache_path = self.get_cached_path(digest)
 
-        # Saving to path
+        # Saving to path (we do not copy the permissions, as the file
+        # in the cache may be shared with a sandbox, see
+        # Sandbox.provision_file).
         if path is not None:
-            shutil.copy(cache_path, path)
+            shutil.copyfile(cache_path, path)
 
         # Saving to file object
         if file_obj is not None:
@@ -404,17 +532,69 @@ class FileCacher:
         elif temp_path:
             temp_file, temp_filename = tempfile.mkstemp(dir=self.tmp_dir)
             os.close(temp_file)
-            shutil.copy(cache_path, temp_filename)
+            shutil.copyfile(cache_path, temp_filename)
             return temp_filename
 
         # Returning temporary file object?
         elif temp_file_obj:
             temp_file, temp_filename = tempfile.mkstemp(dir=self.tmp_dir)
             os.close(temp_file)
-            shutil.copy(cache_path, temp_filename)
+            shutil.copyfile(cache_path, temp_filename)
             temp_file = open(temp_filename, "rb")
             return temp_file
 
+    def get_cached_path(self, digest, memory=False):
+        """Return the path of a file in the local cache, downloading
+        it from the storage if it is not there yet. The file must not
+        be modified.
+
+        digest (string): the sha1 sum of the file.
+        memory (bool): whether to return the path of the file in the
+                       memory tier, if we have one and the file fits
+                       in it; that path may disappear when the file
+                       is evicted, so the caller must be ready to use
+                       the other one.
+
+        return (string): the path of the file in the cache.
+
+        """
+        cache_path = os.path.join(self.obj_dir, digest)
+        cache_exists = os.path.exists(cache_path)
+
+        logger.debug("Getting file %s." % (digest))
+
+        if not cache_exists:
+            logger.debug("File %s not in cache, downloading "
+                         "from database." % digest)
+
+            # Receives the file from the database
+            temp_file, temp_filename = tempfile.mkstemp(dir=self.tmp_dir)
+            temp_file = os.fdopen(temp_file, "wb")
+            self.backend.get_file(digest, temp_filename)
+
+            # And move it in the cache. Warning: this is not atomic if
+            # the temp and the cache dir are on different filesystems.
+            shutil.move(temp_filename, cache_path)
+
+            logger.debug("File %s downloaded." % digest)
+
+        if memory and self.memory_tier is not None:
+            memory_path = self.memory_tier.get_path(digest, cache_path)
+            if memory_path is not None:
+                return memory_path
+
+        return cache_path
+
+    def preload(self, digest):
+        """Put a file in the memory tier, if we have one.
+
+        digest (string): the sha1 sum of the file.
+
+        """
+        cache_path = self.get_cached_path(digest)
+        if self.memory_tier is not None:
+            self.memory_tier.get_path(digest, cache_path, count=False)
+
     def put_file(self, description="", binary_data=None,
                  file_obj=None, path=None):
         """Put a file in the storage, and keep a copy locally. The
@@ -512,6 +692,8 @@ class FileCacher:
             os.unlink(os.path.join(self.obj_dir, digest))
         except OSError:
             pass
+        if self.memory_tier is not None:
+            self.memory_tier.discard(digest)
 
     def purge_cache(self):
         """Delete all the content of the cache.
@@ -524,6 +706,22 @@ class FileCacher:
                not mkdir(self.obj_dir):
             logger.error("Cannot create necessary directories.")
 
+    def list_cache(self):
+        """List the files available in the local cache.
+
+        return (dict): the size of each file in the cache, indexed by
+                       digest.
+
+        """
+        sizes = {}
+        for digest in os.listdir(self.obj_dir):
+            try:
+                sizes[digest] = os.stat(
+                    os.path.join(self.obj_dir, digest)).st_size
+            except OSError:
+                pass  # Deleted in the meantime.
+        return sizes
+
     def list(self):
         """List the files available in the storage.
 
@@ -37,6 +37,7 @@ from cms.db.Submission import Submission, Token, Evaluation, File, Executable
 from cms.db.UserTest import UserTest, UserTestFile, UserTestExecutable, \
     UserTestManager
 from cms.db.FSObject import FSObject
+from cms.db.CachedEvaluation import CachedEvaluation
 
 import cms.db.ImportFromDict
 
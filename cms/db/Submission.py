@@ -25,7 +25,7 @@ used directly (import  from SQLAlchemyAll).
 
 """
 
-from sqlalchemy.schema import Column, ForeignKey, UniqueConstraint
+from sqlalchemy.schema import Column, ForeignKey, UniqueConstraint, Index
 from sqlalchemy.types import Integer, Float, String, DateTime
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy.ext.orderinglist import ordering_list
@@ -113,6 +113,15 @@ class Submission(Base):
         String,
         nullable=True)
 
+    # Key identifying the inputs of the compilation (see
+    # CompilationJob.get_cache_key), set when the compilation is
+    # done, so that its result can be reused for submissions with the
+    # same inputs.
+    compilation_key = Column(
+        String,
+        nullable=True,
+        index=True)
+
     # Evaluation outcome (can be None = yet to evaluate, "ok" =
     # evaluation successful). At any time, this should be equal to
     # evaluations != [].
@@ -258,6 +267,7 @@ class Submission(Base):
         self.compilation_outcome = None
         self.compilation_text = None
         self.compilation_tries = 0
+        self.compilation_key = None
         self.executables = {}
 
     def invalidate_evaluation(self):
@@ -278,6 +288,46 @@ class Submission(Base):
         self.public_score = None
         self.public_score_details = None
 
+    @staticmethod
+    def bulk_invalidate(session, submission_ids, level):
+        """Invalidate many submissions at once, with set-based UPDATE
+        and DELETE statements instead of loading them. It has the same
+        effect of calling invalidate_compilation, invalidate_evaluation
+        or invalidate_score on each of them. Note that the objects
+        already loaded in the session are not updated.
+
+        session (Session): the session to use.
+        submission_ids ([int]): the ids of the submissions.
+        level (string): 'compilation', 'evaluation' or 'score'.
+
+        """
+        if len(submission_ids) == 0:
+            return
+        values = {
+            "score": None,
+            "score_details": None,
+            "public_score": None,
+            "public_score_details": None}
+        if level in ["compilation", "evaluation"]:
+            values.update({
+                "evaluation_outcome": None,
+                "evaluation_tries": 0})
+            session.query(Evaluation)\
+                .filter(Evaluation.submission_id.in_(submission_ids))\
+                .delete(synchronize_session=False)
+        if level == "compilation":
+            values.update({
+                "compilation_outcome": None,
+                "compilation_text": None,
+                "compilation_tries": 0,
+                "compilation_key": None})
+            session.query(Executable)\
+                .filter(Executable.submission_id.in_(submission_ids))\
+                .delete(synchronize_session=False)
+        session.query(Submission)\
+            .filter(Submission.id.in_(submission_ids))\
+            .update(values, synchronize_session=False)
+
     def play_token(self, timestamp=None):
         """Tell the submission that a token has been used.
 
@@ -287,6 +337,17 @@ class Submission(Base):
         self.token = Token(timestamp=timestamp)
 
 
+# Partial indexes on the (few) submissions still to be compiled or
+# evaluated, so that ES can find them without scanning the table.
+Index("ix_submissions_to_compile",
+      Submission.__table__.c.id,
+      postgresql_where=Submission.__table__.c.compilation_outcome == None)
+Index("ix_submissions_to_evaluate",
+      Submission.__table__.c.id,
+      postgresql_where=(Submission.__table__.c.compilation_outcome == "ok") &
+      (Submission.__table__.c.evaluation_outcome == None))
+
+
 class Token(Base):
     """Class to store information about a token. Not to be used
     directly (import it from SQLAlchemyAll).
@@ -511,6 +572,12 @@ class Evaluation(Base):
         String,
         nullable=True)
 
+    # Speed index of the worker (from its calibration) when it
+    # performed the evaluation, if known.
+    worker_speed_index = Column(
+        Float,
+        nullable=True)
+
     def export_to_dict(self):
         """Return object data as a dictionary.
 
@@ -523,5 +590,6 @@ class Evaluation(Base):
             'execution_time': self.execution_time,
             'execution_wall_clock_time': self.execution_wall_clock_time,
             'evaluation_shard': self.evaluation_shard,
-            'evaluation_sandbox': self.evaluation_sandbox
+            'evaluation_sandbox': self.evaluation_sandbox,
+            'worker_speed_index': self.worker_speed_index
             }
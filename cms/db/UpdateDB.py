@@ -72,6 +72,10 @@ class ScriptsContainer(object):
             ("20121116", "rename_user_test_limits"),
             ("20121207", "rename_score_parameters"),
             ("20121208", "add_score_precision"),
+            ("20130124", "add_compilation_key"),
+            ("20130126", "add_cached_evaluations"),
+            ("20130128", "add_pending_jobs_indexes"),
+            ("20130130", "add_worker_speed_index"),
             ]
         self.list.sort()
 
@@ -980,6 +984,66 @@ RENAME COLUMN score_parameters TO score_type_parameters;""")
                                 "ALTER COLUMN score_precision SET NOT NULL;" %
                                 {"table": table})
 
+    @staticmethod
+    def add_compilation_key():
+        """Add a field to reuse compilations with the same inputs.
+
+        It is Submission.compilation_key.
+
+        """
+        with SessionGen(commit=True) as session:
+            session.execute("ALTER TABLE submissions "
+                            "ADD COLUMN compilation_key VARCHAR;")
+            session.execute("CREATE INDEX ix_submissions_compilation_key "
+                            "ON submissions (compilation_key);")
+
+    @staticmethod
+    def add_cached_evaluations():
+        """Add the table cached_evaluations.
+
+        """
+        with SessionGen(commit=True) as session:
+            session.execute("""\
+CREATE TABLE IF NOT EXISTS cached_evaluations (
+    id SERIAL NOT NULL,
+    key VARCHAR NOT NULL,
+    text VARCHAR,
+    outcome VARCHAR,
+    memory_used INTEGER,
+    execution_time FLOAT,
+    execution_wall_clock_time FLOAT,
+    PRIMARY KEY (id),
+    UNIQUE (key)
+);""")
+
+    @staticmethod
+    def add_pending_jobs_indexes():
+        """Add partial indexes on the submissions and user tests still
+        to be compiled or evaluated, used by ES to find them.
+
+        """
+        with SessionGen(commit=True) as session:
+            for table in ["submissions", "user_tests"]:
+                session.execute("CREATE INDEX ix_%s_to_compile "
+                                "ON %s (id) "
+                                "WHERE compilation_outcome IS NULL;" %
+                                (table, table))
+                session.execute("CREATE INDEX ix_%s_to_evaluate "
+                                "ON %s (id) "
+                                "WHERE compilation_outcome = 'ok' "
+                                "AND evaluation_outcome IS NULL;" %
+                                (table, table))
+
+    @staticmethod
+    def add_worker_speed_index():
+        """Store with each evaluation the speed index of the worker
+        that performed it.
+
+        """
+        with SessionGen(commit=True) as session:
+            session.execute("ALTER TABLE evaluations "
+                            "ADD COLUMN worker_speed_index FLOAT;")
+
 
 def execute_single_script(scripts_container, script):
     """Execute one script. Exit on errors.
@@ -23,7 +23,7 @@ directly (import from SQLAlchemyAll).
 
 """
 
-from sqlalchemy.schema import Column, ForeignKey, UniqueConstraint
+from sqlalchemy.schema import Column, ForeignKey, UniqueConstraint, Index
 from sqlalchemy.types import Integer, Float, String, DateTime
 from sqlalchemy.orm import relationship, backref
 
@@ -228,6 +228,17 @@ class UserTest(Base):
         return self.evaluation_outcome is not None
 
 
+# Partial indexes on the user tests still to be compiled or
+# evaluated, see the ones on submissions.
+Index("ix_user_tests_to_compile",
+      UserTest.__table__.c.id,
+      postgresql_where=UserTest.__table__.c.compilation_outcome == None)
+Index("ix_user_tests_to_evaluate",
+      UserTest.__table__.c.id,
+      postgresql_where=(UserTest.__table__.c.compilation_outcome == "ok") &
+      (UserTest.__table__.c.evaluation_outcome == None))
+
+
 class UserTestFile(Base):
     """Class to store information about one file submitted within a
     user_test. Not to be used directly (import it from SQLAlchemyAll).
@@ -0,0 +1,113 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+# Programming contest management system
+# Copyright © 2010-2012 Giovanni Mascellani <mascellani@poisson.phc.unipi.it>
+# Copyright © 2010-2012 Stefano Maggiolo <s.maggiolo@gmail.com>
+# Copyright © 2010-2012 Matteo Boscariol <boscarim@hotmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Short benchmarks run by the Worker in its sandbox, to measure
+how fast the machine executes the contestants' programs compared to
+the others.
+
+"""
+
+import math
+import sys
+
+from cms import logger
+from cms.grading.Sandbox import Sandbox
+
+
+# The benchmarks, run by the Python interpreter inside the sandbox
+# with the name of the benchmark as argument. Each one stresses a
+# different part of the machine: the CPU on integer arithmetic, the
+# memory bandwidth copying a buffer larger than the caches, and the
+# kernel with cheap syscalls.
+BENCHMARK_SOURCE = """\
+import os
+import sys
+
+kind = sys.argv[1]
+if kind == "integer":
+    x = 1
+    for i in xrange(3000000):
+        x = (x * 1103515245 + 12345) & 0x7fffffff
+elif kind == "memory":
+    buf = bytearray(64 * 1024 * 1024)
+    for i in xrange(20):
+        copy = bytes(buf)
+        del copy
+elif kind == "syscall":
+    for i in xrange(300000):
+        os.stat(".")
+"""
+
+BENCHMARK_FILENAME = "calibration.py"
+
+# The time (user plus system, in seconds) each benchmark takes on the
+# reference machine, that has a speed index of 1.0.
+REFERENCE_TIMES = {
+    "integer": 0.5,
+    "memory": 1.0,
+    "syscall": 0.5,
+    }
+
+
+def run_calibration(file_cacher=None, slot=0):
+    """Run all the benchmarks in a new sandbox.
+
+    file_cacher (FileCacher): the file cacher of the Worker.
+    slot (int): the slot of the Worker whose box to use.
+
+    return (dict): the time taken by each benchmark, or None if
+                   something went wrong.
+
+    """
+    sandbox = Sandbox(file_cacher, slot=slot)
+    try:
+        sandbox.create_file_from_string(BENCHMARK_FILENAME,
+                                        BENCHMARK_SOURCE)
+        times = {}
+        for kind in REFERENCE_TIMES:
+            sandbox.timeout = 20 * REFERENCE_TIMES[kind]
+            sandbox.wallclock_timeout = 40 * REFERENCE_TIMES[kind]
+            sandbox.address_space = 256 * 1024
+            success = sandbox.execute_without_std(
+                [sys.executable, BENCHMARK_FILENAME, kind], wait=True)
+            if not success or sandbox.get_exit_status() != Sandbox.EXIT_OK:
+                logger.error("Calibration benchmark `%s' failed in `%s'." %
+                             (kind, sandbox.path))
+                return None
+            times[kind] = sandbox.get_execution_time()
+        return times
+    finally:
+        sandbox.delete()
+
+
+def get_speed_index(times):
+    """Compute the speed index of a machine from the times of the
+    benchmarks: the geometric mean of how many times each benchmark
+    is faster than on the reference machine.
+
+    times (dict): the time taken by each benchmark.
+
+    return (float): the speed index (greater is faster).
+
+    """
+    logs = [math.log(REFERENCE_TIMES[kind] / max(times[kind], 0.001))
+            for kind in REFERENCE_TIMES]
+    return math.exp(sum(logs) / len(logs))
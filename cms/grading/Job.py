@@ -17,17 +17,59 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
+
 import simplejson as json
 
 from cms.db.SQLAlchemyAll import File, Manager, Executable, Testcase
+from cms.grading.Sandbox import Sandbox
+
+
+def describe_task(task):
+    """Return the data of a task that are the same for all the jobs of
+    its submissions, so that they can be cached instead of being sent
+    with every job.
+
+    task (Task): the task.
+
+    return (dict): the task type and its parameters, the limits, the
+                   testcases and the managers (detached from the
+                   database), and a 'version' that changes whenever
+                   any of them changes.
+
+    """
+    testcases = [testcase.export_to_dict() for testcase in task.testcases]
+    managers = [manager.export_to_dict()
+                for manager in task.managers.itervalues()]
+    description = {
+        'task_type': task.task_type,
+        'task_type_parameters': json.loads(task.task_type_parameters),
+        'time_limit': task.time_limit,
+        'memory_limit': task.memory_limit,
+        }
+    description['version'] = hashlib.sha1(json.dumps(
+        [description, testcases, sorted(managers)],
+        sort_keys=True)).hexdigest()
+    description['testcases'] = [Testcase.import_from_dict(testcase_data)
+                                for testcase_data in testcases]
+    description['managers'] = dict(
+        (manager_data['filename'], Manager.import_from_dict(manager_data))
+        for manager_data in managers)
+    return description
 
 
 class Job:
     # Input: task_type, task_type_parameters
-    # Metadata: shard, sandboxes, info
+    # Metadata: shard, sandboxes, info, task_id, task_version
+
+    # If task_version is not None, the job refers to the data of the
+    # task with that version (see describe_task) and they are not
+    # exported with the job: the receiver gets them from its cache or
+    # from the database, and fills the job with set_task_description.
 
     def __init__(self, task_type=None, task_type_parameters=None,
-                 shard=None, sandboxes=None, info=None):
+                 shard=None, sandboxes=None, info=None,
+                 task_id=None, task_version=None):
         if task_type is None:
             task_type = ""
         if task_type_parameters is None:
@@ -42,6 +84,8 @@ class Job:
         self.shard = shard
         self.sandboxes = sandboxes
         self.info = info
+        self.task_id = task_id
+        self.task_version = task_version
 
     def export_to_dict(self):
         res = {
@@ -50,9 +94,21 @@ class Job:
             'shard': self.shard,
             'sandboxes': self.sandboxes,
             'info': self.info,
+            'task_id': self.task_id,
+            'task_version': self.task_version,
             }
         return res
 
+    def set_task_description(self, description):
+        """Fill the job with the data of its task.
+
+        description (dict): the data, as returned by describe_task.
+
+        """
+        self.task_type = description['task_type']
+        self.task_type_parameters = description['task_type_parameters']
+        self.task_version = description['version']
+
     @staticmethod
     def import_from_dict_with_type(data):
         type_ = data['type']
@@ -76,6 +132,7 @@ class CompilationJob(Job):
 
     def __init__(self, task_type=None, task_type_parameters=None,
                  shard=None, sandboxes=None, info=None,
+                 task_id=None, task_version=None,
                  language=None, files=None,
                  managers=None, success=None,
                  compilation_success=None,
@@ -91,7 +148,7 @@ class CompilationJob(Job):
             executables = {}
 
         Job.__init__(self, task_type, task_type_parameters,
-                     shard, sandboxes, info)
+                     shard, sandboxes, info, task_id, task_version)
         self.language = language
         self.files = files
         self.managers = managers
@@ -102,22 +159,41 @@ class CompilationJob(Job):
         self.plus = plus
 
     @staticmethod
-    def from_submission(submission):
+    def from_submission(submission, description=None):
+        """Build the job to compile a submission.
+
+        submission (Submission): the submission.
+        description (dict): if given, the data of the task (see
+                            describe_task), that are then not
+                            exported with the job.
+
+        return (CompilationJob): the job.
+
+        """
         job = CompilationJob()
 
         # Job
-        job.task_type = submission.task.task_type
-        job.task_type_parameters = json.loads(
-            submission.task.task_type_parameters)
+        job.task_id = submission.task_id
+        if description is not None:
+            job.set_task_description(description)
+        else:
+            job.task_type = submission.task.task_type
+            job.task_type_parameters = json.loads(
+                submission.task.task_type_parameters)
+            job.managers = submission.task.managers
 
         # CompilationJob
         job.language = submission.language
         job.files = submission.files
-        job.managers = submission.task.managers
         job.info = "compile submission %d" % (submission.id)
 
         return job
 
+    def set_task_description(self, description):
+        """See Job.set_task_description."""
+        Job.set_task_description(self, description)
+        self.managers = dict(description['managers'])
+
     @staticmethod
     def from_user_test(user_test):
         job = CompilationJob()
@@ -151,6 +227,50 @@ class CompilationJob(Job):
 
         return job
 
+    def get_input_digests(self):
+        """Return the digests of the files the worker needs to
+        perform the job.
+
+        return (list): list of digests.
+
+        """
+        return [file_.digest for file_ in self.files.itervalues()] + \
+            [manager.digest for manager in self.managers.itervalues()]
+
+    def get_cache_key(self):
+        """Return a key that identifies the inputs of the compilation,
+        i.e., everything that can change its result: task type and
+        its parameters, language, source files and managers.
+
+        return (string): the key.
+
+        """
+        inputs = [self.task_type,
+                  self.task_type_parameters,
+                  self.language,
+                  sorted((file_.filename, file_.digest)
+                         for file_ in self.files.itervalues()),
+                  sorted((manager.filename, manager.digest)
+                         for manager in self.managers.itervalues())]
+        return hashlib.sha1(json.dumps(inputs)).hexdigest()
+
+    def is_cacheable(self):
+        """Tell whether the outcome of the compilation depends only on
+        its inputs, so that it can be reused for other submissions:
+        that is, it succeeded, or it failed because of the compiler
+        (and not, e.g., because of a time or memory limit, that may
+        be hit only on a loaded host).
+
+        return (bool): True if the outcome can be reused.
+
+        """
+        if not self.success or self.compilation_success is None:
+            return False
+        if self.compilation_success or self.plus is None:
+            return True
+        return self.plus.get("exit_status") in [Sandbox.EXIT_OK,
+                                                Sandbox.EXIT_NONZERO_RETURN]
+
     def export_to_dict(self):
         res = Job.export_to_dict(self)
         res.update({
@@ -158,8 +278,6 @@ class CompilationJob(Job):
                 'language': self.language,
                 'files': [file_.export_to_dict()
                           for file_ in self.files.itervalues()],
-                'managers': [manager.export_to_dict()
-                             for manager in self.managers.itervalues()],
                 'success': self.success,
                 'compilation_success': self.compilation_success,
                 'executables': [executable.export_to_dict()
@@ -168,6 +286,16 @@ class CompilationJob(Job):
                 'text': self.text,
                 'plus': self.plus,
                 })
+        # The data of the task are sent only if the receiver cannot
+        # get them by itself.
+        if self.task_version is None:
+            res.update({
+                    'managers': [manager.export_to_dict()
+                                 for manager in self.managers.itervalues()],
+                    })
+        else:
+            del res['task_type']
+            del res['task_type_parameters']
         return res
 
     @classmethod
@@ -176,10 +304,11 @@ class CompilationJob(Job):
                          for file_data in data['files']]
         data['files'] = dict([(file_.filename, file_)
                               for file_ in data['files']])
-        data['managers'] = [Manager.import_from_dict(manager_data)
-                            for manager_data in data['managers']]
-        data['managers'] = dict([(manager.filename, manager)
-                                 for manager in data['managers']])
+        if 'managers' in data:
+            data['managers'] = [Manager.import_from_dict(manager_data)
+                                for manager_data in data['managers']]
+            data['managers'] = dict([(manager.filename, manager)
+                                     for manager in data['managers']])
         data['executables'] = [Executable.import_from_dict(executable_data)
                                for executable_data in data['executables']]
         data['executables'] = dict([(executable.filename, executable)
@@ -192,18 +321,31 @@ class EvaluationJob(Job):
     # Input: executables, testcases, time_limit, memory_limit,
     # managers, files
     # Output: success, evaluations
-    # Metadata: only_execution, get_output
+    # Metadata: only_execution, get_output, testcase_subset,
+    # skippable_groups
 
     # Note that the 'evaluations' attribute isn't a list or a dict of
     # Evaluation objects but just a dict of dicts.
 
+    # If testcase_subset is not None, it is the list of the indices
+    # (in testcases) of the only testcases to evaluate: this allows
+    # ES to split the evaluation of a submission amongst many
+    # workers, each one evaluating only a chunk of the testcases.
+
+    # If skippable_groups is not None, it is a list of groups of
+    # indices of testcases (see ScoreType.get_skippable_groups): a
+    # testcase is not evaluated (and gets outcome 0.0) if all the
+    # groups it belongs to already have a testcase with outcome 0.0.
+
     def __init__(self, task_type=None, task_type_parameters=None,
                  shard=None, sandboxes=None, info=None,
+                 task_id=None, task_version=None,
                  executables=None, testcases=None,
                  time_limit=None, memory_limit=None,
                  managers=None, files=None,
                  success=None, evaluations=None,
-                 only_execution=False, get_output=False):
+                 only_execution=False, get_output=False,
+                 testcase_subset=None, skippable_groups=None):
         if executables is None:
             executables = {}
         if testcases is None:
@@ -216,7 +358,7 @@ class EvaluationJob(Job):
             evaluations = {}
 
         Job.__init__(self, task_type, task_type_parameters,
-                     shard, sandboxes, info)
+                     shard, sandboxes, info, task_id, task_version)
         self.executables = executables
         self.testcases = testcases
         self.time_limit = time_limit
@@ -227,28 +369,52 @@ class EvaluationJob(Job):
         self.evaluations = evaluations
         self.only_execution = only_execution
         self.get_output = get_output
+        self.testcase_subset = testcase_subset
+        self.skippable_groups = skippable_groups
 
     @staticmethod
-    def from_submission(submission):
+    def from_submission(submission, description=None):
+        """Build the job to evaluate a submission.
+
+        submission (Submission): the submission.
+        description (dict): if given, the data of the task (see
+                            describe_task), that are then not
+                            exported with the job.
+
+        return (EvaluationJob): the job.
+
+        """
         job = EvaluationJob()
 
         # Job
-        job.task_type = submission.task.task_type
-        job.task_type_parameters = json.loads(
-            submission.task.task_type_parameters)
+        job.task_id = submission.task_id
+        if description is not None:
+            job.set_task_description(description)
+        else:
+            job.task_type = submission.task.task_type
+            job.task_type_parameters = json.loads(
+                submission.task.task_type_parameters)
+            job.testcases = submission.task.testcases
+            job.time_limit = submission.task.time_limit
+            job.memory_limit = submission.task.memory_limit
+            job.managers = dict(submission.task.managers)
 
         # EvaluationJob; dict() is required to detach the dictionary
         # that gets added to the Job from the control of SQLAlchemy
         job.executables = dict(submission.executables)
-        job.testcases = submission.task.testcases
-        job.time_limit = submission.task.time_limit
-        job.memory_limit = submission.task.memory_limit
-        job.managers = dict(submission.task.managers)
         job.files = dict(submission.files)
         job.info = "evaluate submission %d" % (submission.id)
 
         return job
 
+    def set_task_description(self, description):
+        """See Job.set_task_description."""
+        Job.set_task_description(self, description)
+        self.testcases = description['testcases']
+        self.time_limit = description['time_limit']
+        self.memory_limit = description['memory_limit']
+        self.managers = dict(description['managers'])
+
     @staticmethod
     def from_user_test(user_test):
         job = EvaluationJob()
@@ -288,6 +454,53 @@ class EvaluationJob(Job):
 
         return job
 
+    def get_input_digests(self):
+        """Return the digests of the files the worker needs to
+        perform the job.
+
+        return (list): list of digests.
+
+        """
+        if self.testcase_subset is not None:
+            testcases = [self.testcases[test_number]
+                         for test_number in self.testcase_subset]
+        else:
+            testcases = self.testcases
+        digests = [executable.digest
+                   for executable in self.executables.itervalues()] + \
+            [manager.digest for manager in self.managers.itervalues()] + \
+            [file_.digest for file_ in self.files.itervalues()]
+        for testcase in testcases:
+            digests += [digest for digest in [testcase.input, testcase.output]
+                        if digest is not None]
+        return digests
+
+    def get_cache_key(self, test_number):
+        """Return a key that identifies the inputs of the evaluation
+        of a testcase, i.e., everything that can change its outcome:
+        task type and its parameters, limits, executables, managers,
+        submitted files and the testcase itself.
+
+        test_number (int): the index of the testcase in testcases.
+
+        return (string): the key.
+
+        """
+        testcase = self.testcases[test_number]
+        inputs = [self.task_type,
+                  self.task_type_parameters,
+                  self.time_limit,
+                  self.memory_limit,
+                  sorted((executable.filename, executable.digest)
+                         for executable in self.executables.itervalues()),
+                  sorted((manager.filename, manager.digest)
+                         for manager in self.managers.itervalues()),
+                  sorted((file_.filename, file_.digest)
+                         for file_ in self.files.itervalues()),
+                  testcase.input,
+                  testcase.output]
+        return hashlib.sha1(json.dumps(inputs)).hexdigest()
+
     def export_to_dict(self):
         res = Job.export_to_dict(self)
         res.update({
@@ -295,12 +508,6 @@ class EvaluationJob(Job):
                 'executables': [executable.export_to_dict()
                                 for executable
                                 in self.executables.itervalues()],
-                'testcases': [testcase.export_to_dict()
-                              for testcase in self.testcases],
-                'time_limit': self.time_limit,
-                'memory_limit': self.memory_limit,
-                'managers': [manager.export_to_dict()
-                             for manager in self.managers.itervalues()],
                 'files': [file_.export_to_dict()
                           for file_ in self.files.itervalues()],
                 'success': self.success,
@@ -310,7 +517,23 @@ class EvaluationJob(Job):
                                     in self.evaluations.iteritems()),
                 'only_execution': self.only_execution,
                 'get_output': self.get_output,
+                'testcase_subset': self.testcase_subset,
+                'skippable_groups': self.skippable_groups,
                 })
+        # The data of the task are sent only if the receiver cannot
+        # get them by itself.
+        if self.task_version is None:
+            res.update({
+                    'testcases': [testcase.export_to_dict()
+                                  for testcase in self.testcases],
+                    'time_limit': self.time_limit,
+                    'memory_limit': self.memory_limit,
+                    'managers': [manager.export_to_dict()
+                                 for manager in self.managers.itervalues()],
+                    })
+        else:
+            del res['task_type']
+            del res['task_type_parameters']
         return res
 
     @classmethod
@@ -319,12 +542,14 @@ class EvaluationJob(Job):
                                for executable_data in data['executables']]
         data['executables'] = dict([(executable.filename, executable)
                                     for executable in data['executables']])
-        data['testcases'] = [Testcase.import_from_dict(testcase_data)
-                             for testcase_data in data['testcases']]
-        data['managers'] = [Manager.import_from_dict(manager_data)
-                            for manager_data in data['managers']]
-        data['managers'] = dict([(manager.filename, manager)
-                                 for manager in data['managers']])
+        if 'testcases' in data:
+            data['testcases'] = [Testcase.import_from_dict(testcase_data)
+                                 for testcase_data in data['testcases']]
+        if 'managers' in data:
+            data['managers'] = [Manager.import_from_dict(manager_data)
+                                for manager_data in data['managers']]
+            data['managers'] = dict([(manager.filename, manager)
+                                     for manager in data['managers']])
         data['files'] = [File.import_from_dict(file_data)
                          for file_data in data['files']]
         data['files'] = dict([(file_.filename, file_)
@@ -19,6 +19,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import fcntl
 import os
 import shutil
 import subprocess
@@ -26,9 +27,13 @@ import tempfile
 import stat
 import select
 import re
+import multiprocessing
+import threading
+import traceback
 from functools import wraps
 
 from cms import config, logger
+from cms.async import ServiceCoord, get_service_address, get_service_shards
 
 
 class SandboxInterfaceException(Exception):
@@ -131,6 +136,190 @@ def my_truncate(ff, size):
     ff.seek(0, os.SEEK_SET)
 
 
+# The ioctl asking the file system to make a file share the blocks
+# of another one, copying them only when written (from linux/fs.h).
+FICLONE = 0x40049409
+
+PROVISIONING_METHODS = ["copy", "reflink", "hardlink"]
+
+
+def provision_file(source, dest, method="copy", executable=False):
+    """Make the content of a file available at another path, with one
+    of the following methods.
+
+    - "copy": copy the content;
+    - "reflink": create a new file sharing the blocks of the source,
+      that are copied only when written (on btrfs, xfs, ...);
+    - "hardlink": link the same file, whose permissions are changed
+      so that nobody (but root) can write it, as the programs in the
+      sandbox run as another user.
+
+    If the method is not possible (for example, because the paths are
+    on different file systems), the content is copied.
+
+    source (string): the path of the file to provision, that must not
+                     be modified afterwards.
+    dest (string): the path of the new file, that must not exist.
+    method (string): one of PROVISIONING_METHODS.
+    executable (bool): to set permissions.
+
+    return (string): the method actually used.
+
+    """
+    mode = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+    if executable:
+        mode |= stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH
+
+    if method == "hardlink":
+        try:
+            # We keep the execute permissions the file may already
+            # have, as it may be linked elsewhere as an executable.
+            os.chmod(source, mode | (stat.S_IMODE(os.stat(source).st_mode) &
+                                     (stat.S_IXUSR | stat.S_IXGRP |
+                                      stat.S_IXOTH)))
+            os.link(source, dest)
+            return method
+        except OSError as error:
+            logger.debug("Cannot hardlink `%s' to `%s': %r." %
+                         (source, dest, error))
+
+    elif method == "reflink":
+        try:
+            with open(source, "rb") as source_file:
+                with open(dest, "wb") as dest_file:
+                    fcntl.ioctl(dest_file.fileno(), FICLONE,
+                                source_file.fileno())
+            os.chmod(dest, mode | stat.S_IWUSR)
+            return method
+        except (IOError, OSError) as error:
+            logger.debug("Cannot reflink `%s' to `%s': %r." %
+                         (source, dest, error))
+            if os.path.lexists(dest):
+                os.remove(dest)
+
+    with open(source, "rb") as source_file:
+        with open(dest, "wb") as dest_file:
+            shutil.copyfileobj(source_file, dest_file)
+    os.chmod(dest, mode | stat.S_IWUSR)
+    return "copy"
+
+
+def get_box_id(file_cacher=None, slot=0, lane=0):
+    """Return the isolate box to use for a sandbox, unique for each
+    lane of each slot of each Worker on this machine.
+
+    file_cacher (FileCacher): the file cacher of the service that is
+                              going to use the sandbox.
+    slot (int): the slot of the Worker that is using the sandbox.
+    lane (int): the lane of the slot, when it evaluates many
+                testcases at the same time (see
+                config.parallel_testcases).
+
+    return (int): the box id.
+
+    """
+    # Get our shard number and slot, to use as a unique identifier
+    # for the sandbox on this machine.
+    if file_cacher is not None and file_cacher.service is not None:
+        slot += file_cacher.service._my_coord.shard * config.worker_slots
+    return slot * max(config.parallel_testcases, 1) + lane
+
+
+def get_host_position(service_coord):
+    """Return the position of a service among the shards of the same
+    service that run on the same machine, according to the
+    configuration.
+
+    service_coord (ServiceCoord): the service.
+
+    return (int, int): the position of the service and the number of
+                       shards on its machine.
+
+    """
+    try:
+        ip = get_service_address(service_coord).ip
+    except KeyError:
+        return 0, 1
+    local_shards = [
+        shard for shard in xrange(get_service_shards(service_coord.name))
+        if get_service_address(
+            ServiceCoord(service_coord.name, shard)).ip == ip]
+    if service_coord.shard not in local_shards:
+        return 0, 1
+    return local_shards.index(service_coord.shard), len(local_shards)
+
+
+def get_box_cpus():
+    """Return the CPUs to which the boxes can be bound.
+
+    return (list): config.worker_cpus, or all the CPUs of the machine
+                   if it is empty.
+
+    """
+    if config.worker_cpus != []:
+        return list(config.worker_cpus)
+    return range(multiprocessing.cpu_count())
+
+
+def check_box_cpus(service_coord):
+    """Check that, if the boxes are bound to CPUs (see get_box_cpu),
+    every box of every shard of a service on its machine has its own
+    CPU.
+
+    service_coord (ServiceCoord): the service that is going to use
+                                  the sandboxes.
+
+    raise: ValueError if there are not enough CPUs.
+
+    """
+    if not config.worker_pin_cpus and config.parallel_testcases <= 1:
+        return
+    unused_position, shards = get_host_position(service_coord)
+    boxes = shards * max(config.worker_slots, 1) * \
+        max(config.parallel_testcases, 1)
+    cpus = len(get_box_cpus())
+    if boxes > cpus:
+        err_msg = "Cannot bind %d boxes (%d shards on this machine, " \
+                  "%d slots each, %d testcases at the same time) to " \
+                  "different CPUs, there are only %d." % \
+                  (boxes, shards, max(config.worker_slots, 1),
+                   max(config.parallel_testcases, 1), cpus)
+        logger.critical(err_msg)
+        raise ValueError(err_msg)
+
+
+def get_box_cpu(file_cacher=None, slot=0, lane=0):
+    """Return the CPU to which to bind a box, if so configured: the
+    boxes of all the shards on this machine get different CPUs, as
+    testcases evaluated at the same time must not share a CPU, or
+    their times would be meaningless.
+
+    file_cacher (FileCacher): the file cacher of the service that is
+                              going to use the sandbox.
+    slot (int): the slot of the Worker that is using the sandbox.
+    lane (int): the lane of the slot (see get_box_id).
+
+    return (int): the CPU, or None if the box is not to be bound.
+
+    """
+    if not config.worker_pin_cpus and config.parallel_testcases <= 1:
+        return None
+    lanes = max(config.parallel_testcases, 1)
+    index = slot * lanes + lane
+    if file_cacher is not None and file_cacher.service is not None:
+        position, unused_shards = get_host_position(
+            file_cacher.service._my_coord)
+        index += position * max(config.worker_slots, 1) * lanes
+    cpus = get_box_cpus()
+    # Checked by check_box_cpus for the Workers, but not for the
+    # other users of sandboxes.
+    if index >= len(cpus):
+        logger.warning("No CPU left for the box of slot %d, lane %d; "
+                       "it is not bound to any." % (slot, lane))
+        return None
+    return cpus[index]
+
+
 class Sandbox:
     """This class creates, deletes and manages the interaction with a
     sandbox. The sandbox doesn't support concurrent operation, not
@@ -147,23 +336,31 @@ class Sandbox:
        command number N.
 
     """
-    def __init__(self, file_cacher=None, temp_dir=None):
+    # Number of times each box has been initialized or cleaned up by
+    # any sandbox of this process, used to detect when a sandbox is
+    # not the owner of its box anymore.
+    box_generations = {}
+    box_generations_lock = threading.Lock()
+
+    def __init__(self, file_cacher=None, temp_dir=None, slot=0, lane=0):
         """Initialization.
 
         file_cacher (FileCacher): an instance of the FileCacher class
                                   (to interact with FS).
         temp_dir (string): the directory where to put the sandbox
                            (which is itself a directory).
+        slot (int): the slot of the Worker that is using the sandbox.
+        lane (int): the lane of the slot (see get_box_id).
 
         """
         self.file_cacher = file_cacher
+        box_id = get_box_id(file_cacher, slot, lane)
 
-        # Get our shard number, to use as a unique identifier for the sandbox
-        # on this machine.
-        if file_cacher is not None and file_cacher.service is not None:
-            box_id = file_cacher.service._my_coord.shard
-        else:
-            box_id = 0
+        # If required, we bind every box to a different CPU.
+        self.taskset = []
+        cpu = get_box_cpu(file_cacher, slot, lane)
+        if cpu is not None:
+            self.taskset = ["taskset", "-c", str(cpu)]
 
         # We create a directory "tmp" inside the outer temporary directory,
         # because the sandbox will bind-mount the inner one. The sandbox also
@@ -190,8 +387,35 @@ class Sandbox:
         logger.debug("Sandbox in `%s' created, using box `%s'." %
                      (self.path, self.box_exec))
 
-        # Default parameters for isolate
         self.box_id = box_id           # -b
+        self.reset_parameters()
+
+        # Tell isolate to get the sandbox ready.
+        box_cmd = [self.box_exec, "--cg", "-b", str(self.box_id)]
+        ret = subprocess.call(box_cmd + ["--init"])
+        if ret != 0:
+            raise SandboxInterfaceException(
+                "Failed to initialize sandbox (error %d)" % ret)
+        self.generation = Sandbox.new_box_generation(self.box_id)
+
+    @staticmethod
+    def new_box_generation(box_id):
+        """Record that the box has been initialized or cleaned up.
+
+        box_id (int): the isolate box.
+
+        return (int): the new generation of the box.
+
+        """
+        with Sandbox.box_generations_lock:
+            generation = Sandbox.box_generations.get(box_id, 0) + 1
+            Sandbox.box_generations[box_id] = generation
+        return generation
+
+    def reset_parameters(self):
+        """Set the parameters for isolate to their default values.
+
+        """
         self.cgroup = True             # --cg
         self.chdir = self.inner_temp_dir # -c
         self.dirs = []                 # -d
@@ -210,12 +434,36 @@ class Sandbox:
         self.wallclock_timeout = None  # -w
         self.extra_timeout = None      # -x
 
-        # Tell isolate to get the sandbox ready.
-        box_cmd = [self.box_exec, "--cg", "-b", str(self.box_id)]
-        ret = subprocess.call(box_cmd + ["--init"])
-        if ret != 0:
-            raise SandboxInterfaceException(
-                "Failed to initialize sandbox (error %d)" % ret)
+    def is_clean(self):
+        """Tell if the sandbox can be used again: its directory must
+        still exist, and no other sandbox must have initialized or
+        cleaned up its box in the meantime.
+
+        return (bool): True if the sandbox is clean.
+
+        """
+        with Sandbox.box_generations_lock:
+            generation = Sandbox.box_generations.get(self.box_id)
+        return generation == self.generation and os.path.isdir(self.path)
+
+    def reset(self):
+        """Bring the sandbox back to the state it had just after its
+        creation, removing all files and restoring the default
+        parameters, without asking isolate to initialize the box
+        again.
+
+        raise: OSError if some file cannot be removed.
+
+        """
+        for filename in os.listdir(self.path):
+            path = os.path.join(self.path, filename)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        self.reset_parameters()
+        self.log = None
+        self.exec_num = -1
 
     def detect_box_executable(self):
         """Try to find an isolate executable. It first looks in ./isolate/,
@@ -534,6 +782,10 @@ class Sandbox:
         else:
             logger.debug("Creating plain file %s in sandbox." % path)
         real_path = self.relative_path(path)
+        # The file may be a hardlink to the cache (see
+        # create_file_from_storage), that we must not overwrite.
+        if os.path.lexists(real_path):
+            os.remove(real_path)
         file_ = open(real_path, "wb")
         mod = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH | stat.S_IWUSR
         if executable:
@@ -549,9 +801,21 @@ class Sandbox:
         executable (bool): to set permissions.
 
         """
-        file_ = self.create_file(path, executable)
-        self.file_cacher.get_file(digest, file_obj=file_)
-        file_.close()
+        real_path = self.relative_path(path)
+        if os.path.lexists(real_path):
+            os.remove(real_path)
+        try:
+            method = provision_file(
+                self.file_cacher.get_cached_path(digest, memory=True),
+                real_path, config.sandbox_provisioning, executable)
+        except (IOError, OSError):
+            # The file may have been evicted from the memory tier of
+            # the cache in the meantime.
+            method = provision_file(
+                self.file_cacher.get_cached_path(digest),
+                real_path, config.sandbox_provisioning, executable)
+        logger.debug("Created file %s in sandbox from storage (%s)." %
+                     (path, method))
 
     def create_file_from_string(self, path, content, executable=False):
         """Write some data to a file in the sandbox.
@@ -592,6 +856,12 @@ class Sandbox:
         logger.debug("Retrieving file %s from sandbox" % (path))
         real_path = self.relative_path(path)
         if trunc_len is not None:
+            # We do not truncate a file linked elsewhere (e.g., to the
+            # cache, see provision_file), but a copy of it.
+            if os.stat(real_path).st_nlink > 1:
+                copy_path = real_path + ".copy"
+                shutil.copyfile(real_path, copy_path)
+                os.rename(copy_path, real_path)
             file_ = open(real_path, "ab")
             my_truncate(file_, trunc_len)
             file_.close()
@@ -674,7 +944,8 @@ class Sandbox:
         """
         self.exec_num += 1
         self.log = None
-        args = [self.box_exec] + self.build_box_options() + ["--"] + command
+        args = self.taskset + [self.box_exec] + \
+            self.build_box_options() + ["--"] + command
         logger.debug("Executing program in sandbox with command: %s" %
                      " ".join(args))
         with open(self.relative_path(self.cmd_file), 'a') as commands:
@@ -699,7 +970,8 @@ class Sandbox:
         """
         self.exec_num += 1
         self.log = None
-        args = [self.box_exec] + self.build_box_options() + ["--"] + command
+        args = self.taskset + [self.box_exec] + \
+            self.build_box_options() + ["--"] + command
         logger.debug("Executing program in sandbox with command: %s" %
                      " ".join(args))
         with open(self.relative_path(self.cmd_file), 'a') as commands:
@@ -752,6 +1024,85 @@ class Sandbox:
         # Tell isolate to cleanup the sandbox.
         box_cmd = [self.box_exec, "--cg", "-b", str(self.box_id)]
         subprocess.call(box_cmd + ["--cleanup"])
+        Sandbox.new_box_generation(self.box_id)
 
         # Delete the working directory.
         shutil.rmtree(self.outer_temp_dir)
+
+
+class SandboxPool:
+    """Keep initialized sandboxes (at most one for each box) when they
+    are not needed anymore, to lend them again instead of creating new
+    ones. This saves the creation of the directories and the calls to
+    isolate to initialize and clean up the box for every testcase.
+
+    """
+    def __init__(self):
+        self._sandboxes = {}
+        self._lock = threading.Lock()
+
+    def borrow(self, file_cacher=None, slot=0, lane=0):
+        """Return a sandbox ready to be used: a clean one from the
+        pool if there is one for the box, a new one otherwise.
+
+        file_cacher (FileCacher): an instance of the FileCacher class
+                                  (to interact with FS).
+        slot (int): the slot of the Worker that is using the sandbox.
+        lane (int): the lane of the slot (see get_box_id).
+
+        return (Sandbox): a sandbox.
+
+        """
+        box_id = get_box_id(file_cacher, slot, lane)
+        with self._lock:
+            sandbox = self._sandboxes.pop(box_id, None)
+        if sandbox is not None:
+            if sandbox.is_clean():
+                sandbox.file_cacher = file_cacher
+                logger.debug("Sandbox in `%s' reused." % sandbox.path)
+                return sandbox
+            logger.info("Sandbox in `%s' is dirty, creating a new one." %
+                        sandbox.path)
+            try:
+                self.discard(sandbox)
+            except (IOError, OSError):
+                logger.warning("Couldn't delete sandbox.\n%s",
+                               traceback.format_exc())
+        return Sandbox(file_cacher, slot=slot, lane=lane)
+
+    def give_back(self, sandbox):
+        """Put a sandbox that is not needed anymore in the pool, or
+        delete it if it cannot be reused.
+
+        sandbox (Sandbox): the sandbox.
+
+        """
+        if sandbox.is_clean():
+            try:
+                sandbox.reset()
+            except (IOError, OSError):
+                logger.info("Couldn't reset sandbox in `%s', "
+                            "deleting it." % sandbox.path)
+            else:
+                with self._lock:
+                    if sandbox.box_id not in self._sandboxes:
+                        self._sandboxes[sandbox.box_id] = sandbox
+                        return
+        self.discard(sandbox)
+
+    def discard(self, sandbox):
+        """Delete a sandbox, cleaning up its box only if no other
+        sandbox is using it.
+
+        sandbox (Sandbox): the sandbox.
+
+        """
+        if sandbox.is_clean():
+            sandbox.delete()
+        else:
+            logger.debug("Deleting sandbox in %s" % sandbox.path)
+            shutil.rmtree(sandbox.outer_temp_dir)
+
+
+# The pool used by the task types.
+sandbox_pool = SandboxPool()
@@ -79,6 +79,19 @@ class ScoreType:
         """
         pass
 
+    def get_skippable_groups(self):
+        """Return the groups of testcases whose score is zero as soon
+        as any of their testcases has outcome zero, so that the
+        evaluation of the remaining testcases of the group can be
+        skipped (giving them outcome zero) without changing the
+        score. Intended to be overwritten by subclasses.
+
+        return (list): list of groups, each being a list of testcases'
+                       nums; None if no group can be skipped.
+
+        """
+        return None
+
     def add_submission(self, submission_id, timestamp, username, evaluated,
                        evaluations, tokened):
         """To call in order to add a submission to the computation of
@@ -417,6 +430,22 @@ class ScoreTypeGroup(ScoreTypeAlone):
                public_score, json.dumps(public_subtasks), \
                ranking_details
 
+    def get_groups(self):
+        """Return the testcases comprising each group.
+
+        return (list): list of groups, each being a list of testcases'
+                       nums.
+
+        """
+        indices = sorted(self.public_testcases.keys())
+        groups = []
+        current = 0
+        for parameter in self.parameters:
+            next_ = current + parameter[1]
+            groups.append(indices[current:next_])
+            current = next_
+        return groups
+
     def get_public_outcome(self, outcome, parameter):
         """Return a public outcome from an outcome.
 
@@ -31,18 +31,26 @@ compilation and the evaluation are contained in the task type class.
 """
 
 import re
+import sys
+import threading
 import traceback
+from collections import deque
+
+from sqlalchemy.exc import IntegrityError
 
 from cms import config, logger
+from cms.db.SQLAlchemyAll import SessionGen, CachedEvaluation
 from cms.grading import JobException
-from cms.grading.Sandbox import Sandbox
+from cms.grading.Sandbox import Sandbox, sandbox_pool
 from cms.grading.Job import CompilationJob, EvaluationJob
 
 
 ## Sandbox lifecycle. ##
 
 def create_sandbox(task_type):
-    """Create a sandbox, and return it.
+    """Create a sandbox, and return it. If sandboxes are not kept,
+    borrow it from the pool of sandboxes, so that a clean one can be
+    reused.
 
     task_type (TaskType): a task type instance.
 
@@ -52,7 +60,14 @@ def create_sandbox(task_type):
 
     """
     try:
-        sandbox = Sandbox(task_type.file_cacher)
+        if config.keep_sandbox:
+            sandbox = Sandbox(task_type.file_cacher,
+                              slot=task_type.worker_slot,
+                              lane=task_type.worker_lane)
+        else:
+            sandbox = sandbox_pool.borrow(task_type.file_cacher,
+                                          slot=task_type.worker_slot,
+                                          lane=task_type.worker_lane)
     except (OSError, IOError):
         err_msg = "Couldn't create sandbox."
         logger.error("%s\n%s" % (err_msg, traceback.format_exc()))
@@ -62,14 +77,14 @@ def create_sandbox(task_type):
 
 def delete_sandbox(sandbox):
     """Delete the sandbox, if the configuration allows it to be
-    deleted.
+    deleted, giving it back to the pool of sandboxes.
 
     sandbox (Sandbox): the sandbox to delete.
 
     """
     if not config.keep_sandbox:
         try:
-            sandbox.delete()
+            sandbox_pool.give_back(sandbox)
         except (IOError, OSError):
             logger.warning("Couldn't delete sandbox.\n%s",
                            traceback.format_exc())
@@ -100,6 +115,12 @@ class TaskType:
     # Each item is an instance of TaskTypeParameter.
     ACCEPTED_PARAMETERS = []
 
+    # If PARALLEL_TESTCASES is True, the default evaluate() can
+    # evaluate many testcases at the same time (see
+    # config.parallel_testcases); it must be False for task types that
+    # use many processes (or many sandboxes) for each testcase.
+    PARALLEL_TESTCASES = True
+
     @classmethod
     def parse_handler(cls, handler, prefix):
         """Ensure that the parameters list template agrees with the
@@ -137,11 +158,32 @@ class TaskType:
         self.result = {}
 
         self.worker_shard = None
+        self.worker_slot = 0
         self.sandbox_paths = ""
 
+        # The lane (see worker_lane) of each thread evaluating
+        # testcases.
+        self._lanes = threading.local()
+
         # If ignore_job is True, we conclude as soon as possible.
         self.ignore_job = False
 
+        # If not None, called with the index of each testcase as soon
+        # as its evaluation is in job.evaluations.
+        self.testcase_callback = None
+
+    @property
+    def worker_lane(self):
+        """Return the lane of the current thread: when testcases are
+        evaluated in parallel, each one has its own lane, and so its
+        own sandboxes.
+
+        return (int): the lane, 0 if testcases are evaluated one at a
+                      time.
+
+        """
+        return getattr(self._lanes, "number", 0)
+
     @property
     def name(self):
         """Returns the name of the TaskType.
@@ -229,18 +271,229 @@ class TaskType:
         should lead to returning True).
 
         A default implementation which should suit most task types is
-        provided.
+        provided. It evaluates config.parallel_testcases testcases at
+        the same time (each in its own lane), if PARALLEL_TESTCASES
+        is True.
 
         return (bool): success of operation.
 
         """
-        for test_number in xrange(len(self.job.testcases)):
-            success = self.evaluate_testcase(test_number)
-            if not success or self.ignore_job:
-                self.job.success = False
-                return
+        if self.job.testcase_subset is not None:
+            test_numbers = self.job.testcase_subset
+        else:
+            test_numbers = xrange(len(self.job.testcases))
+
+        # The outcomes can be reused only for submissions, because
+        # for user tests we need the output.
+        use_cache = config.evaluation_cache and \
+            not self.job.only_execution and not self.job.get_output
+        cached = {}
+        if use_cache:
+            cached = self.get_cached_evaluations(test_numbers)
+
+        # The groups each testcase belongs to, and the groups that
+        # already have a testcase with outcome zero.
+        groups_of = {}
+        if self.job.skippable_groups is not None:
+            for group_idx, group in enumerate(self.job.skippable_groups):
+                for test_number in group:
+                    groups_of.setdefault(test_number, []).append(group_idx)
+        failed_groups = set()
+
+        # The testcases still to consider, the ones we evaluated, the
+        # ones whose evaluation failed and the exceptions raised,
+        # shared by the lanes.
+        pending = deque(test_numbers)
+        evaluated = []
+        failed = []
+        errors = []
+        lock = threading.Lock()
+        # The operation logged is kept for each thread.
+        operation = logger.operation
+
+        def next_testcase():
+            """Return the next testcase to evaluate (filling the
+            outcomes of the ones that need no evaluation), or None
+            when there are no more or we have to stop.
+
+            """
+            with lock:
+                while pending and failed == [] and errors == [] and \
+                        not self.ignore_job:
+                    test_number = pending.popleft()
+                    if test_number in groups_of and \
+                            all(group_idx in failed_groups
+                                for group_idx in groups_of[test_number]):
+                        # Outcomes are strings, as the task types
+                        # store them.
+                        self.job.evaluations[test_number] = {
+                            'sandboxes': [],
+                            'text': "Not evaluated, because another "
+                            "testcase of the same group failed",
+                            'outcome': "0.0",
+                            'plus': {}}
+                    elif test_number in cached:
+                        self.job.evaluations[test_number] = \
+                            cached[test_number]
+                        if float(cached[test_number]['outcome']) <= 0.0:
+                            failed_groups.update(
+                                groups_of.get(test_number, []))
+                    else:
+                        return test_number
+                    self.testcase_ended(test_number)
+                return None
+
+        def run_lane(lane):
+            """Evaluate testcases until there are no more.
+
+            lane (int): the lane of this thread.
+
+            """
+            try:
+                self._lanes.number = lane
+                logger.operation = operation
+                test_number = next_testcase()
+                while test_number is not None:
+                    success = self.evaluate_testcase(test_number)
+                    with lock:
+                        if not success or self.ignore_job:
+                            failed.append(test_number)
+                            return
+                        evaluated.append(test_number)
+                        if float(self.job.evaluations[test_number]
+                                 ['outcome']) <= 0.0:
+                            failed_groups.update(
+                                groups_of.get(test_number, []))
+                    self.testcase_ended(test_number)
+                    test_number = next_testcase()
+            except:
+                errors.append(sys.exc_info())
+
+        lanes = 1
+        if self.PARALLEL_TESTCASES:
+            lanes = max(1, min(config.parallel_testcases,
+                               len(test_numbers)))
+        if lanes == 1:
+            run_lane(0)
+        else:
+            threads = [threading.Thread(target=run_lane, args=(lane,))
+                       for lane in xrange(lanes)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        if errors != []:
+            raise errors[0][0], errors[0][1], errors[0][2]
+        if failed != [] or self.ignore_job:
+            self.job.success = False
+            return
+
+        if use_cache:
+            self.store_cached_evaluations(sorted(evaluated))
         self.job.success = True
 
+    def testcase_ended(self, test_number):
+        """Notify testcase_callback, if any, that the evaluation of a
+        testcase is in job.evaluations.
+
+        test_number (int): the index of the testcase.
+
+        """
+        if self.testcase_callback is not None:
+            try:
+                self.testcase_callback(test_number)
+            except Exception as error:
+                logger.warning("Couldn't notify the end of testcase %d: "
+                               "%r." % (test_number, error))
+
+    def get_cached_evaluations(self, test_numbers):
+        """Look in the database for the outcomes of testcases already
+        evaluated with the same inputs.
+
+        test_numbers (list): the testcases to look for.
+
+        return (dict): the evaluations found (in the format of
+                       EvaluationJob.evaluations), indexed by testcase.
+
+        """
+        keys = dict((self.job.get_cache_key(test_number), test_number)
+                    for test_number in test_numbers)
+        evaluations = {}
+        try:
+            with SessionGen(commit=False) as session:
+                for cached in session.query(CachedEvaluation).\
+                        filter(CachedEvaluation.key.in_(keys.keys())):
+                    evaluations[keys[cached.key]] = {
+                        'sandboxes': [],
+                        'text': cached.text,
+                        'outcome': cached.outcome,
+                        'plus': {
+                            'memory_used': cached.memory_used,
+                            'execution_time': cached.execution_time,
+                            'execution_wall_clock_time':
+                            cached.execution_wall_clock_time,
+                            }
+                        }
+        except Exception:
+            logger.warning("Couldn't read cached evaluations.\n%s" %
+                           traceback.format_exc())
+            return {}
+        # Testcases with the same key (i.e., identical) all get the
+        # same outcome.
+        for test_number in test_numbers:
+            key = self.job.get_cache_key(test_number)
+            if keys[key] in evaluations:
+                evaluations[test_number] = evaluations[keys[key]]
+        if len(evaluations) > 0:
+            logger.info("Reusing the outcomes of %d testcases." %
+                        len(evaluations))
+        return evaluations
+
+    def store_cached_evaluations(self, test_numbers):
+        """Store in the database the outcomes of the evaluated
+        testcases, to reuse them later. Outcomes already stored (for
+        example, by another worker in the meantime) are skipped.
+
+        test_numbers (list): the testcases to store.
+
+        """
+        keys = dict((self.job.get_cache_key(test_number), test_number)
+                    for test_number in test_numbers)
+        if len(keys) == 0:
+            return
+        try:
+            with SessionGen(commit=False) as session:
+                for key, in session.query(CachedEvaluation.key)\
+                        .filter(CachedEvaluation.key.in_(keys.keys())):
+                    del keys[key]
+        except Exception:
+            logger.warning("Couldn't look for cached evaluations.\n%s" %
+                           traceback.format_exc())
+            return
+
+        # Each row is stored on its own, so that a conflict does not
+        # discard the others.
+        for key, test_number in keys.iteritems():
+            evaluation = self.job.evaluations[test_number]
+            plus = evaluation['plus']
+            try:
+                with SessionGen(commit=False) as session:
+                    session.add(CachedEvaluation(
+                        key=key,
+                        text=evaluation['text'],
+                        outcome=evaluation['outcome'],
+                        memory_used=plus.get('memory_used', None),
+                        execution_time=plus.get('execution_time', None),
+                        execution_wall_clock_time=plus.get(
+                            'execution_wall_clock_time', None)))
+                    session.commit()
+            except IntegrityError:
+                logger.debug("Evaluation %s already cached." % key)
+            except Exception:
+                logger.warning("Couldn't store cached evaluation %s.\n%s" %
+                               (key, traceback.format_exc()))
+
     def execute_job(self):
         """Call compile() or execute() depending on the job passed
         when constructing the TaskType.
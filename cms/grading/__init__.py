@@ -21,6 +21,7 @@
 
 import os
 import codecs
+import mmap
 
 from cms import logger
 from cms.db.SQLAlchemyAll import SessionGen, Submission
@@ -484,6 +485,69 @@ def white_diff_canonicalize(string):
     return string
 
 
+# Size of the pieces in which white_diff canonicalizes the files.
+WHITE_DIFF_CHUNK_SIZE = 2 ** 22
+
+# Translation that turns all the whitespaces but "\n" into " ".
+_WHITE_DIFF_TABLE = "".join(WHITES[0] if chr(i) in WHITES and chr(i) != "\n"
+                            else chr(i) for i in xrange(256))
+
+
+def _map_file(file_obj):
+    """Return the content of a file, as a memory map if possible.
+
+    file_obj (file): the file.
+
+    return (object): a string or a memory map, to be closed by the
+                     caller if it has a close method.
+
+    """
+    try:
+        fileno = file_obj.fileno()
+        size = os.fstat(fileno).st_size
+    except (AttributeError, IOError, OSError):
+        return file_obj.read()
+    if size == 0:
+        return ""
+    return mmap.mmap(fileno, size, access=mmap.ACCESS_READ)
+
+
+def _white_diff_canonical_pieces(data):
+    """Yield, in non-empty pieces, the canonical form of the content
+    of a file for white_diff: the lines canonicalized as in
+    white_diff_canonicalize and joined by "\n", without the trailing
+    empty lines.
+
+    data (string or mmap): the content of the file.
+
+    """
+    newlines = ""
+    start = 0
+    while start < len(data):
+        # Each piece is made of whole lines, so that the runs of
+        # whitespaces are not split.
+        end = data.find("\n", start + WHITE_DIFF_CHUNK_SIZE)
+        end = len(data) if end == -1 else end + 1
+        piece = data[start:end].translate(_WHITE_DIFF_TABLE)
+        start = end
+
+        # Each pass halves the runs of spaces: we use str.replace, as
+        # it is much faster than a regular expression, because usually
+        # runs are short and most of the spaces are alone.
+        while "  " in piece:
+            piece = piece.replace("  ", " ")
+        piece = piece.replace(" \n", "\n").replace("\n ", "\n").lstrip(" ")
+
+        # We keep the last newlines for the next piece, as they are
+        # dropped if only empty lines follow them.
+        content = piece.rstrip(" \n")
+        if content != "":
+            yield newlines + content
+            newlines = piece[len(content):]
+        else:
+            newlines += piece
+
+
 def white_diff(output, res):
     """Compare the two output files. Two files are equal if for every
     integer i, line i of first file is equal to line i of second
@@ -495,63 +559,98 @@ def white_diff(output, res):
     'sequence of characters ending with \n or EOF and beginning right
     after BOF or \n'. In particular, every line has *at most* one \n.
 
+    The files are memory mapped and compared byte by byte first, as
+    they are often identical; otherwise, their canonical forms are
+    built and compared a piece at a time, with string methods working
+    on whole pieces instead of Python loops on lines.
+
     output (file): the first file to compare.
     res (file): the second file to compare.
     return (bool): True if the two file are equal as explained above.
 
     """
+    out_data = _map_file(output)
+    try:
+        res_data = _map_file(res)
+        try:
+            if len(out_data) == len(res_data):
+                for start in xrange(0, len(out_data),
+                                    WHITE_DIFF_CHUNK_SIZE):
+                    end = start + WHITE_DIFF_CHUNK_SIZE
+                    if out_data[start:end] != res_data[start:end]:
+                        break
+                else:
+                    return True
+
+            out_pieces = _white_diff_canonical_pieces(out_data)
+            res_pieces = _white_diff_canonical_pieces(res_data)
+            out_piece = res_piece = ""
+            while True:
+                if out_piece == "":
+                    out_piece = next(out_pieces, "")
+                if res_piece == "":
+                    res_piece = next(res_pieces, "")
+                if out_piece == "" or res_piece == "":
+                    return out_piece == res_piece
+                length = min(len(out_piece), len(res_piece))
+                if out_piece[:length] != res_piece[:length]:
+                    return False
+                out_piece = out_piece[length:]
+                res_piece = res_piece[length:]
+        finally:
+            if hasattr(res_data, "close"):
+                res_data.close()
+    finally:
+        if hasattr(out_data, "close"):
+            out_data.close()
+
+
+def white_diff_outcome(output, res):
+    """Assess the correctedness of an output by doing a simple white
+    diff against the reference solution.
+
+    output (file): the output to assess.
+    res (file): the reference output.
+
+    return (float, string): the outcome (1.0 if the output and the
+                            reference output are identical or differ
+                            just by white spaces, 0.0 if they don't)
+                            and a description text.
 
-    while True:
-        lout = output.readline()
-        lres = res.readline()
-
-        # Both files finished: comparison succeded
-        if lres == '' and lout == '':
-            return True
-
-        # Only one file finished: ok if the other contains only blanks
-        elif lres == '' or lout == '':
-            lout = lout.strip(WHITES)
-            lres = lres.strip(WHITES)
-            if lout != '' or lres != '':
-                return False
-
-        # Both file still have lines to go: ok if they agree except
-        # for the number of whitespaces
-        else:
-            lout = white_diff_canonicalize(lout)
-            lres = white_diff_canonicalize(lres)
-            if lout != lres:
-                return False
+    """
+    if white_diff(output, res):
+        return 1.0, "Output is correct"
+    else:
+        return 0.0, "Output isn't correct"
 
 
 def white_diff_step(sandbox, output_filename,
-                    correct_output_filename):
+                    correct_output_digest):
         """Assess the correctedness of a solution by doing a simple
         white diff against the reference solution. It gives an outcome
         1.0 if the output and the reference output are identical (or
         differ just by white spaces) and 0.0 if they don't (or if the
         output doesn't exist).
 
+        The reference output is read from the cache of the file
+        cacher of the sandbox, without copying it in the sandbox.
+
         sandbox (Sandbox): the sandbox we consider.
         output_filename (string): the filename of user's output in the
                                   sandbox.
-        correct_output_filename (string): the same with reference
-                                          output.
+        correct_output_digest (string): the digest of the reference
+                                        output.
 
         return (float, string): the outcome as above and a description
                                 text.
 
         """
         if sandbox.file_exists(output_filename):
-            out_file = sandbox.get_file(output_filename)
-            res_file = sandbox.get_file("res.txt")
-            if white_diff(out_file, res_file):
-                outcome = 1.0
-                text = "Output is correct"
-            else:
-                outcome = 0.0
-                text = "Output isn't correct"
+            res_path = sandbox.file_cacher.get_cached_path(
+                correct_output_digest)
+            with sandbox.get_file(output_filename) as out_file:
+                with open(res_path, "rb") as res_file:
+                    outcome, text = white_diff_outcome(out_file, res_file)
         else:
             outcome = 0.0
             text = "Evaluation didn't produce file %s" % (output_filename)
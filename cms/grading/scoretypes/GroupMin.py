@@ -39,6 +39,10 @@ class GroupMin(ScoreTypeGroup):
         else:
             return "Partially correct"
 
+    def get_skippable_groups(self):
+        """See ScoreType."""
+        return self.get_groups()
+
     def reduce(self, outcomes, parameter):
         """See ScoreTypeGroup."""
         return min(outcomes)
@@ -39,6 +39,10 @@ class GroupMul(ScoreTypeGroup):
         else:
             return "Partially correct"
 
+    def get_skippable_groups(self):
+        """See ScoreType."""
+        return self.get_groups()
+
     def reduce(self, outcomes, parameter):
         """See ScoreTypeGroup."""
         return reduce(lambda x, y: x * y, outcomes)
@@ -122,6 +122,12 @@ class JoiGroupMin(ScoreTypeAlone):
                 public_score += group['score']
         return score, public_score
 
+    def get_skippable_groups(self):
+        """See ScoreType."""
+        indices = sorted(self.public_testcases.keys())
+        return [[indices[i] for i in group['files']]
+                for group in self.parameters['testgroups']]
+
     def compute_score(self, submission_id):
         """Compute the score of a submission.
 
@@ -272,18 +272,20 @@ class Batch(TaskType):
                 # If not asked otherwise, evaluate the output file
                 if not self.job.only_execution:
 
-                    # Put the reference solution into the sandbox
-                    sandbox.create_file_from_storage(
-                        "res.txt",
-                        self.job.testcases[test_number].output)
-
-                    # Check the solution with white_diff
+                    # Check the solution with white_diff (that reads
+                    # the reference solution from the cache)
                     if self.job.task_type_parameters[2] == "diff":
                         outcome, text = white_diff_step(
-                            sandbox, output_filename, "res.txt")
+                            sandbox, output_filename,
+                            self.job.testcases[test_number].output)
 
                     # Check the solution with a comparator
                     elif self.job.task_type_parameters[2] == "comparator":
+                        # Put the reference solution into the sandbox
+                        sandbox.create_file_from_storage(
+                            "res.txt",
+                            self.job.testcases[test_number].output)
+
                         manager_filename = "checker"
 
                         if not manager_filename in self.job.managers:
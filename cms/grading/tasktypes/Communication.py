@@ -58,6 +58,9 @@ class Communication(TaskType):
     """
     ALLOW_PARTIAL_SUBMISSION = False
 
+    # Each testcase already uses many processes at the same time.
+    PARALLEL_TESTCASES = False
+
     name = "Communication"
 
     def get_compilation_commands(self, submission_format):
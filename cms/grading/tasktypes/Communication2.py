@@ -57,6 +57,9 @@ class Communication2(TaskType):
     """
     ALLOW_PARTIAL_SUBMISSION = False
 
+    # Each testcase already uses many processes at the same time.
+    PARALLEL_TESTCASES = False
+
     name = "Communication2"
 
     def get_compilation_commands(self, submission_format):
@@ -28,7 +28,7 @@ from cms import logger
 from cms.grading.TaskType import TaskType, \
      create_sandbox, delete_sandbox
 from cms.grading.ParameterTypes import ParameterTypeChoice
-from cms.grading import white_diff_step, evaluation_step, \
+from cms.grading import white_diff_outcome, evaluation_step, \
     extract_outcome_and_text
 
 
@@ -82,11 +82,8 @@ class OutputOnly(TaskType):
 
     def evaluate_testcase(self, test_number):
         """See TaskType.evaluate_testcase."""
-        sandbox = create_sandbox(self)
-        self.job.sandboxes.append(sandbox.path)
-
         # Immediately prepare the skeleton to return
-        self.job.evaluations[test_number] = {'sandboxes': [sandbox.path],
+        self.job.evaluations[test_number] = {'sandboxes': [],
                                              'plus': {}}
         evaluation = self.job.evaluations[test_number]
         outcome = None
@@ -103,21 +100,18 @@ class OutputOnly(TaskType):
         # First and only one step: diffing (manual or with manager).
         output_digest = self.job.files["output_%03d.txt" %
                                        test_number].digest
-
-        # Put the files into the sandbox
-        sandbox.create_file_from_storage(
-            "res.txt",
-            self.job.testcases[test_number].output)
-        sandbox.create_file_from_storage(
-            "output.txt",
-            output_digest)
+        res_digest = self.job.testcases[test_number].output
 
         if self.job.task_type_parameters[0] == "diff":
             # No manager: I'll do a white_diff between the submission
-            # file and the correct output res.txt.
+            # file and the correct output, straight from the cache, as
+            # no untrusted code runs and we need no sandbox.
             success = True
-            outcome, text = white_diff_step(
-                sandbox, "output.txt", "res.txt")
+            with open(self.file_cacher.get_cached_path(output_digest),
+                      "rb") as out_file:
+                with open(self.file_cacher.get_cached_path(res_digest),
+                          "rb") as res_file:
+                    outcome, text = white_diff_outcome(out_file, res_file)
 
         elif self.job.task_type_parameters[0] == "comparator":
             # Manager present: wonderful, he'll do all the job.
@@ -128,6 +122,17 @@ class OutputOnly(TaskType):
                              "named `checker')")
                 success = False
             else:
+                sandbox = create_sandbox(self)
+                self.job.sandboxes.append(sandbox.path)
+                evaluation['sandboxes'].append(sandbox.path)
+
+                # Put the files into the sandbox
+                sandbox.create_file_from_storage(
+                    "res.txt",
+                    res_digest)
+                sandbox.create_file_from_storage(
+                    "output.txt",
+                    output_digest)
                 sandbox.create_file_from_storage(
                     manager_filename,
                     self.job.managers[manager_filename].digest,
@@ -142,6 +147,7 @@ class OutputOnly(TaskType):
                      "input.txt", "res.txt", "output.txt"])
                 if success:
                     outcome, text = extract_outcome_and_text(sandbox)
+                delete_sandbox(sandbox)
 
         else:
             raise ValueError("Unrecognized first parameter "
@@ -153,5 +159,4 @@ class OutputOnly(TaskType):
         evaluation['success'] = success
         evaluation['outcome'] = str(outcome) if outcome is not None else None
         evaluation['text'] = text
-        delete_sandbox(sandbox)
         return success
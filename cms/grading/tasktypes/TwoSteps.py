@@ -57,6 +57,9 @@ class TwoSteps(TaskType):
     """
     ALLOW_PARTIAL_SUBMISSION = False
 
+    # Each testcase already uses many processes at the same time.
+    PARALLEL_TESTCASES = False
+
     name = "Two steps"
 
     def get_compilation_commands(self, submission_format):
@@ -280,13 +283,9 @@ class TwoSteps(TaskType):
 
                 # If not asked otherwise, evaluate the output file
                 if not self.job.only_execution:
-                    # Put the reference solution into the sandbox
-                    second_sandbox.create_file_from_storage(
-                        "res.txt",
-                        self.job.testcases[test_number].output)
-
                     outcome, text = white_diff_step(
-                        second_sandbox, "output.txt", "res.txt")
+                        second_sandbox, "output.txt",
+                        self.job.testcases[test_number].output)
 
         # Whatever happened, we conclude.
         evaluation['success'] = success
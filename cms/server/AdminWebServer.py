@@ -287,6 +287,8 @@ class AdminWebServer(WebService):
         if service == ServiceCoord("EvaluationService", 0):
             return method in ["submissions_status",
                               "queue_status",
+                              "rejudge_status",
+                              "lanes_status",
                               "workers_status",
                               "invalidate_submission"]
 
@@ -769,6 +771,8 @@ class AddManagerHandler(BaseHandler):
         task = self.safe_get_item(Task, task_id)
         self.sql_session.add(Manager(manager["filename"], digest, task=task))
         self.sql_session.commit()
+        self.application.service.evaluation_service.task_changed(
+            task_id=task.id)
         self.redirect("/task/%s" % task_id)
 
 
@@ -782,6 +786,8 @@ class DeleteManagerHandler(BaseHandler):
         self.contest = task.contest
         self.sql_session.delete(manager)
         self.sql_session.commit()
+        self.application.service.evaluation_service.task_changed(
+            task_id=task.id)
         self.redirect("/task/%s" % task.id)
 
 
@@ -855,6 +861,8 @@ class AddTestcaseHandler(BaseHandler):
             self.redirect("/add_testcase/%s" % task_id)
             return
 
+        self.application.service.evaluation_service.task_changed(
+            task_id=task.id)
         self.redirect("/task/%s" % task_id)
 
 
@@ -868,6 +876,8 @@ class DeleteTestcaseHandler(BaseHandler):
         self.contest = task.contest
         self.sql_session.delete(testcase)
         self.sql_session.commit()
+        self.application.service.evaluation_service.task_changed(
+            task_id=task.id)
         self.redirect("/task/%s" % task.id)
 
 
@@ -1173,6 +1183,8 @@ class TaskHandler(BaseHandler):
 
         if try_commit(self.sql_session, self):
             self.application.service.scoring_service.reinitialize()
+            self.application.service.evaluation_service.task_changed(
+                task_id=task.id)
         self.redirect("/task/%s" % task_id)
 
 
@@ -1216,6 +1216,14 @@ class SubmissionStatusHandler(BaseHandler):
         elif not submission.evaluated():
             data["status"] = 3
             data["status_text"] = self._("Evaluating...")
+            # The testcases evaluated so far, if the workers report
+            # them (see config.evaluation_progress).
+            if submission.evaluations != []:
+                data["status_text"] = \
+                    self._("Evaluating... (%(evaluated)d/%(total)d "
+                           "testcases)") % {
+                        "evaluated": len(submission.evaluations),
+                        "total": len(task.testcases)}
         elif not submission.scored():
             data["status"] = 4
             data["status_text"] = self._("Scoring...")
@@ -27,18 +27,26 @@ current ranking.
 
 """
 
+import os
+from collections import deque
 from datetime import timedelta
+import heapq
 import random
 
-from cms import default_argument_parser, logger
+import simplejson as json
+from sqlalchemy import func
+
+from cms import config, default_argument_parser, logger, mkdir
 from cms.async.AsyncLibrary import Service, rpc_method, rpc_callback
 from cms.async import ServiceCoord, get_service_shards
 from cms.db import ask_for_contest
-from cms.db.SQLAlchemyAll import Contest, Evaluation, \
-     Submission, SessionGen, UserTest, UserTestExecutable
+from cms.db.SQLAlchemyAll import Evaluation, Executable, \
+     Submission, SessionGen, Task, User, UserTest, UserTestExecutable
 from cms.service import get_submissions
 from cmscommon.DateTime import make_datetime, make_timestamp
-from cms.grading.Job import Job, CompilationJob, EvaluationJob
+from cms.grading.Job import Job, CompilationJob, EvaluationJob, \
+     describe_task
+from cms.grading.scoretypes import get_score_type
 
 
 def to_compile(submission):
@@ -66,6 +74,35 @@ def to_evaluate(submission):
         submission.evaluation_tries < EvaluationService.MAX_EVALUATION_TRIES
 
 
+def filter_to_compile(query):
+    """Restrict a query on submissions to the ones that ES is
+    interested in compiling (see to_compile).
+
+    query (Query): a query on submissions.
+
+    return (Query): the restricted query.
+
+    """
+    return query.filter(Submission.compilation_outcome == None)\
+        .filter(Submission.compilation_tries <
+                EvaluationService.MAX_COMPILATION_TRIES)
+
+
+def filter_to_evaluate(query):
+    """Restrict a query on submissions to the ones that ES is
+    interested in evaluating (see to_evaluate).
+
+    query (Query): a query on submissions.
+
+    return (Query): the restricted query.
+
+    """
+    return query.filter(Submission.compilation_outcome == "ok")\
+        .filter(Submission.evaluation_outcome == None)\
+        .filter(Submission.evaluation_tries <
+                EvaluationService.MAX_EVALUATION_TRIES)
+
+
 def user_test_to_compile(user_test):
     """Return whether ES is interested in compiling the user test.
 
@@ -103,17 +140,49 @@ class JobQueue:
 
     The queue is implemented as a custom min-heap.
 
+    In fair-share mode, jobs with the same priority are not served
+    in order of timestamp, but round-robin among the users they
+    belong to: each job is tagged with the round in which it is
+    served, that is, the first round after the ones of the jobs of
+    the same user pushed before (still in the queue, or already
+    popped but not yet reached by the rounds served). Hence a user
+    pushing many jobs together does not delay the others.
+
+    If cost_weight is positive, jobs with the same priority (and
+    round) are served shortest first: each job is ordered as if its
+    timestamp was cost_weight seconds later for each second of its
+    expected cost. Since the order only depends on the timestamp and
+    the cost, a long job waiting in the queue eventually goes before
+    the short jobs that arrive later (aging).
+
     """
 
-    def __init__(self):
+    def __init__(self, fair_share=False, cost_weight=0.0):
+        """fair_share (bool): whether to interleave the jobs of
+                              different users.
+        cost_weight (float): how much to delay the jobs for each
+                             second of their expected cost, or 0 to
+                             serve them in order of timestamp.
+
+        """
+        self.fair_share = fair_share
+        self.cost_weight = cost_weight
+
         # The queue: a min-heap whose elements are of the form
-        # (priority, timestamp, job), where job is the actual data.
+        # (priority, round, key, timestamp, job), where job is the
+        # actual data, round is always 0 if not in fair-share mode,
+        # and key is the timestamp, delayed according to the cost.
         self._queue = []
 
         # Reverse lookup for the jobs in the queue: a dictionary
         # associating the index in the queue to each job.
         self._reverse = {}
 
+        # For fair-share: the round being served for each priority,
+        # and the first round free for each pair (priority, user).
+        self._current_round = {}
+        self._next_round = {}
+
     def __contains__(self, job):
         """Implement the 'in' operator for a job in the queue.
 
@@ -134,8 +203,8 @@ class JobQueue:
         """
         self._queue[idx1], self._queue[idx2] = \
                            self._queue[idx2], self._queue[idx1]
-        self._reverse[self._queue[idx1][2]] = idx1
-        self._reverse[self._queue[idx2][2]] = idx2
+        self._reverse[self._queue[idx1][4]] = idx1
+        self._reverse[self._queue[idx2][4]] = idx2
 
     def _up_heap(self, idx):
         """Take the element in position idx up in the heap until its
@@ -189,18 +258,34 @@ class JobQueue:
         idx = self._up_heap(idx)
         return self._down_heap(idx)
 
-    def push(self, job, priority, timestamp=None):
+    def push(self, job, priority, timestamp=None, user=None, cost=None):
         """Push a job in the queue. If timestamp is not specified,
         uses the current time.
 
         job (job): a couple (job_type, submission_id)
         priority (int): the priority of the job
         timestamp (int): the time of the submission
+        user (int): the id of the user the job belongs to, or None
+                    if unknown (in which case the job is served in
+                    the current round).
+        cost (float): the expected cost of the job in seconds, or
+                      None if unknown (in which case it is not
+                      delayed).
 
         """
         if timestamp is None:
             timestamp = make_datetime()
-        self._queue.append((priority, timestamp, job))
+        round_ = 0
+        if self.fair_share:
+            round_ = self._current_round.get(priority, 0)
+            if user is not None:
+                round_ = max(round_,
+                             self._next_round.get((priority, user), 0))
+                self._next_round[(priority, user)] = round_ + 1
+        key = timestamp
+        if self.cost_weight > 0 and cost is not None:
+            key = timestamp + timedelta(seconds=self.cost_weight * cost)
+        self._queue.append((priority, round_, key, timestamp, job))
         last = len(self._queue) - 1
         self._reverse[job] = last
         self._up_heap(last)
@@ -215,7 +300,8 @@ class JobQueue:
 
         """
         if len(self._queue) > 0:
-            return self._queue[0]
+            priority, _, _, timestamp, job = self._queue[0]
+            return priority, timestamp, job
         else:
             raise LookupError("Empty queue.")
 
@@ -227,15 +313,27 @@ class JobQueue:
         raise: LookupError on empty queue.
 
         """
-        top = self.top()
-        last = len(self._queue) - 1
-        self._swap(0, last)
+        return self.extract(self.top()[2])
 
-        del self._reverse[top[2]]
-        del self._queue[last]
-        if last > 0:
-            self._down_heap(0)
-        return top
+    def extract(self, job):
+        """Extracts (and returns) a job that is going to be served,
+        wherever it is in the queue: unlike remove, in fair-share mode
+        the round of the job becomes the one being served, as if it
+        were the first element.
+
+        job (job): the job to extract.
+
+        returns (int, datetime, job): priority, timestamp, and job.
+
+        raise: KeyError if job not present.
+
+        """
+        priority, round_, _, timestamp, _ = self._queue[self._reverse[job]]
+        if self.fair_share:
+            self._current_round[priority] = max(
+                round_, self._current_round.get(priority, 0))
+        self.remove(job)
+        return priority, timestamp, job
 
     def remove(self, job):
         """Remove a job from the queue. Raise a KeyError if not present.
@@ -267,11 +365,45 @@ class JobQueue:
 
         """
         pos = self._reverse[job]
-        self._queue[pos] = (priority,
-                            self._queue[pos][1],
-                            self._queue[pos][2])
+        self._queue[pos] = (priority,) + self._queue[pos][1:]
         self._updown_heap(pos)
 
+    def count_priority(self, priority):
+        """Returns the number of elements in the queue with the given
+        priority.
+
+        priority (int): the priority to look for.
+
+        returns (int): number of elements with that priority.
+
+        """
+        return len([data for data in self._queue if data[0] == priority])
+
+    def peek(self, n):
+        """Returns the first elements in the queue without extracting
+        them.
+
+        n (int): how many elements to return at most.
+
+        returns (list): list of tuples (priority, timestamp, job), in
+                        order.
+
+        """
+        return [(data[0], data[3], data[4])
+                for data in heapq.nsmallest(n, self._queue)]
+
+    def oldest_timestamp(self):
+        """Returns the smallest timestamp of the elements in the
+        queue.
+
+        returns (datetime): the oldest timestamp, or None if the
+                            queue is empty.
+
+        """
+        if len(self._queue) == 0:
+            return None
+        return min(data[3] for data in self._queue)
+
     def length(self):
         """Returns the number of elements in the queue.
 
@@ -296,16 +428,355 @@ class JobQueue:
         """
         ret = []
         for data in self._queue:
-            ret.append({'job': data[2],
+            ret.append({'job': data[4],
                         'priority': data[0],
-                        'timestamp': make_timestamp(data[1])})
+                        'timestamp': make_timestamp(data[3])})
         return ret
 
 
+class JobJournal:
+    """An instance of this class keeps on disk the jobs that the ES
+    has to do, both queued and assigned to a worker, so that they can
+    be recovered quickly if the ES is restarted.
+
+    The jobs are written to an append-only file, one JSON object per
+    line, recording that a job has been added (with its priority and
+    timestamp) or removed. When the file becomes much longer than the
+    number of jobs, it is rewritten from scratch.
+
+    The lines are flushed but not synced to disk, to keep adding jobs
+    cheap: they survive a crash of the ES, but the last ones may be
+    lost if the whole machine crashes (those jobs are found later
+    anyway by the search for the jobs not done).
+
+    """
+
+    # Minimum number of lines to write before rewriting the file.
+    MIN_LINES_TO_COMPACT = 1000
+
+    def __init__(self, path):
+        """path (string): the file where to store the jobs, or None
+                          not to store them.
+
+        """
+        self.path = path
+        self._jobs = {}
+        self._file = None
+        self._lines = 0
+
+    def load(self):
+        """Read the jobs stored in the file, and start recording the
+        new ones.
+
+        return (list): list of tuples (priority, timestamp, job) of
+                       the jobs found in the file.
+
+        """
+        self._jobs = {}
+        if self.path is None:
+            return []
+        try:
+            with open(self.path, "r") as journal:
+                for line in journal:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A partially written line, if we crashed in
+                        # the middle of a write.
+                        logger.warning("Ignoring invalid line in job "
+                                       "journal.")
+                        continue
+                    job = tuple(entry["job"])
+                    if entry["op"] == "add":
+                        self._jobs[job] = (entry["priority"],
+                                           make_datetime(entry["timestamp"]))
+                    else:
+                        self._jobs.pop(job, None)
+        except IOError:
+            pass  # No journal yet.
+
+        self.compact()
+        return [(priority, timestamp, journal_job)
+                for journal_job, (priority, timestamp)
+                in self._jobs.iteritems()]
+
+    def _write(self, entry):
+        """Append an entry to the file, compacting it if needed.
+
+        entry (dict): the entry to write.
+
+        """
+        if self._file is None:
+            return
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+        self._lines += 1
+        if self._lines > max(JobJournal.MIN_LINES_TO_COMPACT,
+                             2 * len(self._jobs)):
+            self.compact()
+
+    def add(self, job, priority, timestamp):
+        """Record that the ES has to do a job.
+
+        job (job): the job.
+        priority (int): the priority of the job.
+        timestamp (datetime): the timestamp of the job.
+
+        """
+        self._jobs[job] = (priority, timestamp)
+        self._write({"op": "add",
+                     "job": job,
+                     "priority": priority,
+                     "timestamp": make_timestamp(timestamp)})
+
+    def remove(self, job):
+        """Record that the ES does not have to do a job anymore.
+
+        job (job): the job.
+
+        """
+        if job in self._jobs:
+            del self._jobs[job]
+            self._write({"op": "remove", "job": job})
+
+    def compact(self):
+        """Rewrite the file with only the jobs currently recorded. The
+        new file is written aside and then renamed, so that a crash
+        never leaves us without a valid journal.
+
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.path is None:
+            return
+        try:
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "w") as journal:
+                for job, (priority, timestamp) in self._jobs.iteritems():
+                    journal.write(json.dumps({
+                        "op": "add",
+                        "job": job,
+                        "priority": priority,
+                        "timestamp": make_timestamp(timestamp)}) + "\n")
+                journal.flush()
+                os.fsync(journal.fileno())
+            os.rename(temp_path, self.path)
+            self._file = open(self.path, "a")
+            self._lines = len(self._jobs)
+        except (IOError, OSError) as error:
+            logger.error("Cannot write job journal %s, jobs will not be "
+                         "recovered after a restart: %r." %
+                         (self.path, error))
+
+
+class JobCostEstimator:
+    """An instance of this class keeps the expected cost (in seconds)
+    of the jobs, learned from the ones already done: the total
+    wall-clock time of the testcases for evaluations, and the time of
+    the compilation for compilations. Costs are kept for each pair
+    (job type, task), and for each job type alone, to be used when
+    the task has no history yet.
+
+    """
+
+    # Weight of a new sample in the exponential moving average.
+    SMOOTHING = 0.1
+
+    # Number of recent costs kept for each key, to compute percentiles.
+    SAMPLES = 100
+
+    def __init__(self):
+        # Expected costs, indexed by (job_type, task_id), where
+        # task_id may be None to mean any task.
+        self._costs = {}
+        # Recent costs, with the same indices.
+        self._samples = {}
+
+    def load(self, contest_id):
+        """Initialize the costs of the evaluations with the average
+        total time of the evaluations of each task already stored in
+        the database.
+
+        contest_id (int): the contest whose tasks to consider.
+
+        """
+        with SessionGen(commit=False) as session:
+            totals = session.query(
+                Submission.task_id,
+                func.sum(Evaluation.execution_wall_clock_time),
+                func.count(func.distinct(Evaluation.submission_id)))\
+                .join(Evaluation.submission)\
+                .join(Submission.task)\
+                .filter(Task.contest_id == contest_id)\
+                .filter(Evaluation.execution_wall_clock_time != None)\
+                .group_by(Submission.task_id)
+            for task_id, total, count in totals:
+                if count > 0:
+                    self._update((EvaluationService.JOB_TYPE_EVALUATION,
+                                  task_id),
+                                 float(total) / count, first=True)
+
+    def _update(self, key, cost, first=False):
+        """Add a sample to the moving average of a key.
+
+        key (tuple): the key (job_type, task_id).
+        cost (float): the cost of the sample.
+        first (bool): whether to replace the current average.
+
+        """
+        if first or key not in self._costs:
+            self._costs[key] = cost
+        else:
+            self._costs[key] += JobCostEstimator.SMOOTHING * \
+                (cost - self._costs[key])
+
+    def record(self, job_type, task_id, job):
+        """Learn from the result of a successful job.
+
+        job_type (string): the type of the job.
+        task_id (int): the task of the job.
+        job (Job): the job, as returned by the worker.
+
+        """
+        if isinstance(job, CompilationJob):
+            if job.plus is None:
+                return
+            cost = job.plus.get("execution_wall_clock_time")
+            if cost is None:
+                return
+        else:
+            cost = 0.0
+            for info in job.evaluations.itervalues():
+                cost += info["plus"].get("execution_wall_clock_time",
+                                         None) or 0.0
+        for key in [(job_type, task_id), (job_type, None)]:
+            self._update(key, cost)
+            self._samples.setdefault(
+                key, deque(maxlen=JobCostEstimator.SAMPLES)).append(cost)
+
+    def estimate(self, job_type, task_id=None):
+        """Return the expected cost of a job.
+
+        job_type (string): the type of the job.
+        task_id (int): the task of the job, or None if unknown.
+
+        return (float): the expected cost in seconds, or None if we
+                        know nothing about such jobs.
+
+        """
+        if (job_type, task_id) in self._costs:
+            return self._costs[(job_type, task_id)]
+        return self._costs.get((job_type, None), None)
+
+    def percentile(self, job_type, task_id, fraction):
+        """Return a percentile of the recent costs of similar jobs (or
+        the expected cost, if we have no recent costs).
+
+        job_type (string): the type of the job.
+        task_id (int): the task of the job, or None if unknown.
+        fraction (float): the percentile, between 0.0 and 1.0.
+
+        return (float): the cost in seconds, or None if we know
+                        nothing about such jobs.
+
+        """
+        samples = self._samples.get((job_type, task_id),
+                                    self._samples.get((job_type, None)))
+        if not samples:
+            return self.estimate(job_type, task_id)
+        samples = sorted(samples)
+        return samples[min(int(fraction * len(samples)), len(samples) - 1)]
+
+    def get_straggler_time(self, job_type, task_id, job):
+        """Return the time after which a job assigned to a worker is
+        considered a straggler, i.e., much slower than similar jobs.
+
+        job_type (string): the type of the job.
+        task_id (int): the task of the job.
+        job (Job): the job that is sent to the worker.
+
+        return (timedelta): the time, or None if we know nothing about
+                            such jobs.
+
+        """
+        cost = self.percentile(job_type, task_id,
+                               EvaluationService.STRAGGLER_PERCENTILE)
+        if cost is None:
+            return None
+        if isinstance(job, EvaluationJob) and \
+                job.testcase_subset is not None and len(job.testcases) > 0:
+            cost *= float(len(job.testcase_subset)) / len(job.testcases)
+        return max(timedelta(seconds=EvaluationService.STRAGGLER_FACTOR *
+                             cost),
+                   EvaluationService.STRAGGLER_MIN_TIME)
+
+    def get_timeout(self, job_type, task_id, job):
+        """Return the time after which we declare lost a job assigned
+        to a worker. If config.adaptive_worker_timeout is set, this is
+        a multiple of its expected cost, but never less than its worst
+        case duration allowed by the limits (for evaluations), plus a
+        margin for the overhead; in any case, it is never less than
+        WORKER_TIMEOUT.
+
+        job_type (string): the type of the job.
+        task_id (int): the task of the job.
+        job (Job): the job that is sent to the worker.
+
+        return (timedelta): the timeout.
+
+        """
+        if not config.adaptive_worker_timeout:
+            return EvaluationService.WORKER_TIMEOUT
+        expected = self.estimate(job_type, task_id)
+        worst = None
+        if isinstance(job, EvaluationJob):
+            testcases = len(job.testcases)
+            if job.testcase_subset is not None:
+                if expected is not None and testcases > 0:
+                    expected *= float(len(job.testcase_subset)) / testcases
+                testcases = len(job.testcase_subset)
+            if job.time_limit is not None:
+                # See the wall clock limit in evaluation_step_before_run.
+                worst = testcases * (2 * job.time_limit + 1)
+        if expected is None and worst is None:
+            return EvaluationService.WORKER_TIMEOUT
+        seconds = max(EvaluationService.WORKER_TIMEOUT_FACTOR *
+                      (expected or 0.0), worst or 0.0)
+        return max(timedelta(seconds=seconds) +
+                   EvaluationService.WORKER_TIMEOUT_MARGIN,
+                   EvaluationService.WORKER_TIMEOUT)
+
+    def get_testcase_timeout(self, job):
+        """Return the time after which we declare lost an evaluation
+        whose worker stopped reporting the testcases it evaluates
+        (see config.evaluation_progress): the worst case duration of
+        a testcase allowed by the limits, plus a margin, but never
+        less than WORKER_TIMEOUT.
+
+        job (Job): the job that is sent to the worker.
+
+        return (timedelta): the timeout, or None if the job is not an
+                            evaluation with a time limit.
+
+        """
+        if not isinstance(job, EvaluationJob) or job.time_limit is None:
+            return None
+        # See the wall clock limit in evaluation_step_before_run.
+        return max(timedelta(seconds=2 * job.time_limit + 1) +
+                   EvaluationService.WORKER_TIMEOUT_MARGIN,
+                   EvaluationService.WORKER_TIMEOUT)
+
+
 class WorkerPool:
     """This class keeps the state of the workers attached to ES, and
     allow the ES to get a usable worker when it needs it.
 
+    Each worker can execute some jobs at the same time (as many as
+    the slots it reports in its capabilities, one until we know); a
+    slot is identified by the pair (shard, number of the slot in the
+    worker), and it is the unit to which jobs are assigned.
+
     """
 
     WORKER_INACTIVE = None
@@ -318,23 +789,57 @@ class WorkerPool:
         """
         self._service = service
         self._worker = {}
-        # These dictionary stores data about the workers (identified
-        # by their shard number). Side data is anything one want to
-        # attach to the worker. Schedule disabling to True means that
-        # we are going to disable the worker as soon as possible (when
-        # it finishes the current job). The current job is also
-        # discarded because we already re-assigned it. Ignore is true
-        # if the next result coming from the worker should be
-        # discarded.
+        # These dictionary stores data about the slots of the workers
+        # (identified by the pairs (shard, slot)). Side data is
+        # anything one want to attach to the slot. Schedule disabling
+        # to True means that we are going to disable the slot as soon
+        # as possible (when it finishes the current job). The current
+        # job is also discarded because we already re-assigned
+        # it. Ignore is true if the next result coming from the slot
+        # should be discarded.
         self._job = {}
         self._start_time = {}
         self._side_data = {}
         self._schedule_disabling = {}
         self._ignore = {}
+        # The time after which the job of each slot is declared lost,
+        # and the one after which it is considered a straggler.
+        self._timeout = {}
+        self._straggler_time = {}
+        # The number of testcases evaluated and to evaluate in the
+        # job of each slot, the last time the worker reported one, and
+        # the time after which we declare the job lost if it does not
+        # report another one (see config.evaluation_progress).
+        self._progress = {}
+        self._last_progress = {}
+        self._testcase_timeout = {}
+
+        # The digests of the files in the cache of each worker (by
+        # shard), and the sizes of the files, when known.
+        self._cached_files = {}
+        self._file_sizes = {}
+
+        # The capabilities of each worker (by shard), as reported by
+        # the worker itself, or None if not known yet.
+        self._capabilities = {}
+
+        # The workers whose speed index deviates too much from the
+        # others, and the ones we do not assign jobs to because of it.
+        self._deviating = set()
+        self._drained = set()
+
+        # The queued job each busy slot is reserved for: its worker
+        # has been asked to download the files of the job, that is
+        # assigned to the slot when it is free, if possible.
+        self._reserved = {}
+        # The input digests and the requirements of the queued jobs
+        # we tried to reserve a slot for, so that we read them from
+        # the database only once for each job.
+        self._reservation_data = {}
 
     def __contains__(self, job):
-        for shard in self._worker:
-            if job == self._job[shard] and not self._ignore[shard]:
+        for slot in self._job:
+            if job == self._job[slot] and not self._ignore[slot]:
                 return True
         return False
 
@@ -351,13 +856,62 @@ class WorkerPool:
             on_connect=self.on_worker_connected)
 
         # And we fill all data.
-        self._job[shard] = WorkerPool.WORKER_INACTIVE
-        self._start_time[shard] = None
-        self._side_data[shard] = None
-        self._schedule_disabling[shard] = False
-        self._ignore[shard] = False
+        self.add_slot((shard, 0))
+        self._cached_files[shard] = set()
+        self._capabilities[shard] = None
         logger.debug("Worker %s added." % shard)
 
+    def add_slot(self, slot):
+        """Add a slot of a worker, not doing anything.
+
+        slot (tuple): the slot (shard, slot) to add.
+
+        """
+        self._job[slot] = WorkerPool.WORKER_INACTIVE
+        self._start_time[slot] = None
+        self._side_data[slot] = None
+        self._schedule_disabling[slot] = False
+        self._ignore[slot] = False
+        self._timeout[slot] = None
+        self._straggler_time[slot] = None
+        self._progress[slot] = None
+        self._last_progress[slot] = None
+        self._testcase_timeout[slot] = None
+
+    def set_slots(self, shard, slots):
+        """Make the pool have as many slots for a worker as the ones
+        it reports. Slots in excess are removed when they are not
+        doing anything, and disabled as soon as they finish their job
+        otherwise (and removed the next time the worker reports its
+        slots).
+
+        shard (int): the worker.
+        slots (int): the number of slots of the worker.
+
+        """
+        slots = max(slots, 1)
+        for i in xrange(slots):
+            slot = (shard, i)
+            if slot not in self._job:
+                self.add_slot(slot)
+            elif self._job[slot] == WorkerPool.WORKER_DISABLED:
+                self._job[slot] = WorkerPool.WORKER_INACTIVE
+            else:
+                self._schedule_disabling[slot] = False
+        for slot in self._job.keys():
+            if slot[0] != shard or slot[1] < slots:
+                continue
+            if self._job[slot] in [WorkerPool.WORKER_INACTIVE,
+                                   WorkerPool.WORKER_DISABLED]:
+                for data in [self._job, self._start_time, self._side_data,
+                             self._schedule_disabling, self._ignore,
+                             self._timeout, self._straggler_time,
+                             self._progress, self._last_progress,
+                             self._testcase_timeout, self._reserved]:
+                    data.pop(slot, None)
+            else:
+                self._schedule_disabling[slot] = True
+
     def on_worker_connected(self, worker_coord):
         """To be called when a worker comes alive after being
         offline. We use this callback to instruct the worker to
@@ -369,148 +923,726 @@ class WorkerPool:
         """
         shard = worker_coord.shard
         logger.info("Worker %s online again." % shard)
-        self._worker[shard].precache_files(contest_id=self._service.contest_id)
+        # We don't know anymore what is in its cache, and what it can
+        # do, until it tells us.
+        self._cached_files[shard] = set()
+        self._capabilities[shard] = None
+        self._worker[shard].get_capabilities(
+            callback=self._service.capabilities_received.im_func,
+            plus=shard)
+        self._worker[shard].precache_files(
+            contest_id=self._service.contest_id,
+            callback=self._service.precache_finished.im_func,
+            plus=shard)
         # We don't requeue the job, because a connection lost does not
         # invalidate a potential result given by the worker (as the
         # problem was the connection and not the machine on which the
         # worker is).
 
-    def acquire_worker(self, job, side_data=None):
-        """Tries to assign a job to an available worker. If no workers
-        are available then this returns None, otherwise this returns
-        the chosen worker.
+    def acquire_worker(self, job, side_data=None, testcase_subset=None,
+                       exclude_shards=()):
+        """Tries to assign a job to an available slot of a worker. If
+        no slots are available then this returns None, otherwise this
+        returns the chosen slot.
 
         job (job): the job to assign to a worker
-        side_data (object): object to attach to the worker for later
+        side_data (object): object to attach to the slot for later
                             use
+        testcase_subset (list): for an evaluation, the indices of the
+                                only testcases the worker has to
+                                evaluate, or None for all of them.
+        exclude_shards (list): workers not to use.
 
-        returns (int): None if no workers are available, the worker
-                       assigned to the job otherwise
+        returns (tuple): None if no slots are available, the slot
+                         (shard, slot) assigned to the job otherwise
         """
-        # We look for an available worker
-        try:
-            shard = self.find_worker(WorkerPool.WORKER_INACTIVE,
-                                     require_connection=True,
-                                     random_worker=True)
-        except LookupError:
+        # We check that there is an available slot (we check the
+        # requirements of the job later, as we need its data).
+        if self.count_available_workers(exclude_shards) == 0:
             return None
 
-        # Then we fill the info for future memory
-        self._job[shard] = job
-        self._start_time[shard] = make_datetime()
-        self._side_data[shard] = side_data
-        logger.debug("Worker %s acquired." % shard)
-
-        # And finally we ask the worker to do the job
         action, object_id = job
-        timestamp = side_data[1]
-        queue_time = self._start_time[shard] - timestamp
-        logger.info("Asking worker %s to %s submission/user test %d "
-                    " (%s after submission)." %
-                    (shard, action, object_id, queue_time))
-
         with SessionGen(commit=False) as session:
-            if action == EvaluationService.JOB_TYPE_COMPILATION:
-                submission = Submission.get_from_id(object_id,
-                                                    session)
-                job_ = CompilationJob.from_submission(submission)
-            elif action == EvaluationService.JOB_TYPE_EVALUATION:
-                submission = Submission.get_from_id(object_id,
-                                                    session)
-                job_ = EvaluationJob.from_submission(submission)
-            elif action == EvaluationService.JOB_TYPE_TEST_COMPILATION:
-                user_test = UserTest.get_from_id(object_id,
-                                                 session)
-                job_ = CompilationJob.from_user_test(user_test)
-            elif action == EvaluationService.JOB_TYPE_TEST_EVALUATION:
-                user_test = UserTest.get_from_id(object_id,
-                                                 session)
-                job_ = EvaluationJob.from_user_test(user_test)
-                job_.get_output = True
-                job_.only_execution = True
-
-            self._worker[shard].execute_job(
-                job_dict=job_.export_to_dict(),
-                callback=self._service.action_finished.im_func,
-                plus=(action, object_id, side_data, shard))
-
-        return shard
-
-    def release_worker(self, shard):
+            job_, task_id, requirements, evaluation_action, \
+                evaluation_job = self.build_job(job, session,
+                                                testcase_subset)
+
+            # We choose the slot reserved for the job, if available,
+            # or else one amongst the workers able to do the job,
+            # preferring the ones that already have the files the job
+            # needs
+            slot = self.get_reserved_slot(job, exclude_shards)
+            if slot is None:
+                digests = job_.get_input_digests()
+                if evaluation_job is not None:
+                    digests += evaluation_job.get_input_digests()
+                try:
+                    slot = self.find_available_worker(digests,
+                                                      exclude_shards,
+                                                      requirements)
+                except LookupError:
+                    return None
+            shard = slot[0]
+            self.cancel_reservations(job)
+
+            # Then we fill the info for future memory
+            costs = self._service.costs
+            self._job[slot] = job
+            self._start_time[slot] = make_datetime()
+            self._side_data[slot] = side_data
+            self._timeout[slot] = costs.get_timeout(action, task_id, job_)
+            self._straggler_time[slot] = \
+                costs.get_straggler_time(action, task_id, job_)
+            self._testcase_timeout[slot] = costs.get_testcase_timeout(
+                job_ if evaluation_job is None else evaluation_job)
+            if evaluation_job is not None:
+                self._timeout[slot] += costs.get_timeout(
+                    evaluation_action, task_id, evaluation_job)
+                evaluation_straggler_time = costs.get_straggler_time(
+                    evaluation_action, task_id, evaluation_job)
+                if self._straggler_time[slot] is not None and \
+                        evaluation_straggler_time is not None:
+                    self._straggler_time[slot] += evaluation_straggler_time
+                else:
+                    self._straggler_time[slot] = None
+            logger.debug("Worker %s slot %s acquired." % slot)
+
+            # And finally we ask the worker to do the job
+            timestamp = side_data[1]
+            queue_time = self._start_time[slot] - timestamp
+            logger.info("Asking worker %s (slot %s) to %s submission/user "
+                        "test %d (%s after submission)." %
+                        (shard, slot[1],
+                         action if evaluation_job is None else
+                         "%s and %s" % (action, evaluation_action),
+                         object_id, queue_time))
+
+            if evaluation_job is None:
+                self._worker[shard].execute_job(
+                    job_dict=job_.export_to_dict(),
+                    slot=slot[1],
+                    job_key=list(job),
+                    callback=self._service.action_finished.im_func,
+                    plus=(action, object_id, side_data, slot))
+            else:
+                self._worker[shard].execute_fused_job(
+                    compilation_job_dict=job_.export_to_dict(),
+                    evaluation_job_dict=evaluation_job.export_to_dict(),
+                    slot=slot[1],
+                    job_key=list(job),
+                    callback=self._service.action_finished.im_func,
+                    plus=(action, object_id, side_data, slot))
+
+        return slot
+
+    def build_job(self, job, session, testcase_subset=None):
+        """Build what a worker needs to do a job.
+
+        job (job): the job.
+        session (Session): the session to use.
+        testcase_subset (list): for an evaluation, the indices of the
+                                only testcases the worker has to
+                                evaluate, or None for all of them.
+
+        return (tuple): the Job to send to the worker, the id of the
+                        task, the requirements of the job (see
+                        get_requirements), and, if config.fused_jobs
+                        is true and the job is a compilation, the type
+                        of the evaluation job the worker does right
+                        after it and its Job (otherwise both None).
+
+        """
+        action, object_id = job
+        evaluation_job = None
+        evaluation_action = None
+        if action == EvaluationService.JOB_TYPE_COMPILATION:
+            submission = Submission.get_from_id(object_id,
+                                                session)
+            task_id = submission.task_id
+            description = self._service.get_task_description(
+                task_id, session)
+            requirements = self.get_requirements(
+                action, submission.language,
+                description['memory_limit'])
+            job_ = CompilationJob.from_submission(submission,
+                                                  description)
+            if config.fused_jobs:
+                evaluation_action = \
+                    EvaluationService.JOB_TYPE_EVALUATION
+                requirements.update(self.get_requirements(
+                    evaluation_action, submission.language,
+                    description['memory_limit']))
+                evaluation_job = EvaluationJob.from_submission(
+                    submission, description)
+                if config.skip_failed_groups:
+                    evaluation_job.skippable_groups = get_score_type(
+                        submission=submission).get_skippable_groups()
+        elif action == EvaluationService.JOB_TYPE_EVALUATION:
+            submission = Submission.get_from_id(object_id,
+                                                session)
+            task_id = submission.task_id
+            description = self._service.get_task_description(
+                task_id, session)
+            requirements = self.get_requirements(
+                action, submission.language,
+                description['memory_limit'])
+            job_ = EvaluationJob.from_submission(submission,
+                                                 description)
+            job_.testcase_subset = testcase_subset
+            # The testcases whose results have been stored while a
+            # previous try was running need not be evaluated again.
+            if config.evaluation_progress and submission.evaluations:
+                evaluated = set(evaluation.num
+                                for evaluation in submission.evaluations)
+                if testcase_subset is None:
+                    testcase_subset = xrange(len(job_.testcases))
+                job_.testcase_subset = [test_number
+                                        for test_number in testcase_subset
+                                        if test_number not in evaluated]
+            if config.skip_failed_groups:
+                job_.skippable_groups = get_score_type(
+                    submission=submission).get_skippable_groups()
+        elif action == EvaluationService.JOB_TYPE_TEST_COMPILATION:
+            user_test = UserTest.get_from_id(object_id,
+                                             session)
+            task_id = user_test.task_id
+            requirements = self.get_requirements(
+                action, user_test.language,
+                user_test.task.memory_limit)
+            job_ = CompilationJob.from_user_test(user_test)
+            if config.fused_jobs:
+                evaluation_action = \
+                    EvaluationService.JOB_TYPE_TEST_EVALUATION
+                requirements.update(self.get_requirements(
+                    evaluation_action, user_test.language,
+                    user_test.task.memory_limit))
+                evaluation_job = EvaluationJob.from_user_test(user_test)
+                evaluation_job.get_output = True
+                evaluation_job.only_execution = True
+        elif action == EvaluationService.JOB_TYPE_TEST_EVALUATION:
+            user_test = UserTest.get_from_id(object_id,
+                                             session)
+            task_id = user_test.task_id
+            requirements = self.get_requirements(
+                action, user_test.language,
+                user_test.task.memory_limit)
+            job_ = EvaluationJob.from_user_test(user_test)
+            job_.get_output = True
+            job_.only_execution = True
+
+        return job_, task_id, requirements, evaluation_action, \
+            evaluation_job
+
+    def release_worker(self, slot):
         """To be called by ES when it receives a notification that a
         job finished.
 
-        Note: if the worker is scheduled to be disabled, then we
-        disable it, and notify the ES to discard the outcome obtained
-        by the worker.
+        Note: if the slot is scheduled to be disabled, then we disable
+        it, and notify the ES to discard the outcome obtained by the
+        worker.
 
-        shard (int): the worker to release.
+        slot (tuple): the slot (shard, slot) to release.
 
         returns (bool): if the result is to be ignored.
 
         """
-        if self._job[shard] == WorkerPool.WORKER_INACTIVE:
+        if self._job[slot] == WorkerPool.WORKER_INACTIVE:
             err_msg = "Trying to release worker while it's inactive."
             logger.error(err_msg)
             raise ValueError(err_msg)
-        ret = self._ignore[shard]
-        self._start_time[shard] = None
-        self._side_data[shard] = None
-        self._ignore[shard] = False
-        if self._schedule_disabling[shard]:
-            self._job[shard] = WorkerPool.WORKER_DISABLED
-            self._schedule_disabling[shard] = False
-            logger.info("Worker %s released and disabled." % shard)
+        # The slot has already been released and disabled (e.g.,
+        # because it timed out), so this is a late result.
+        if self._job[slot] == WorkerPool.WORKER_DISABLED:
+            return True
+        ret = self._ignore[slot]
+        self._start_time[slot] = None
+        self._side_data[slot] = None
+        self._ignore[slot] = False
+        self._timeout[slot] = None
+        self._straggler_time[slot] = None
+        self._progress[slot] = None
+        self._last_progress[slot] = None
+        self._testcase_timeout[slot] = None
+        if self._schedule_disabling[slot]:
+            self._job[slot] = WorkerPool.WORKER_DISABLED
+            self._schedule_disabling[slot] = False
+            logger.info("Worker %s slot %s released and disabled." % slot)
         else:
-            self._job[shard] = WorkerPool.WORKER_INACTIVE
-            logger.debug("Worker %s released." % shard)
+            self._job[slot] = WorkerPool.WORKER_INACTIVE
+            logger.debug("Worker %s slot %s released." % slot)
         return ret
 
+    def record_progress(self, slot, job, evaluated, total):
+        """Take note that a worker evaluated a testcase of a job.
+
+        slot (tuple): the slot (shard, slot) doing the job.
+        job (job): the job, as the worker reports it.
+        evaluated (int): the number of testcases evaluated so far.
+        total (int): the number of testcases to evaluate.
+
+        return (bool): False if the slot is not doing the job (e.g.,
+                       because the report arrived late) or the job is
+                       to be ignored, True otherwise.
+
+        """
+        if slot not in self._job or self._job[slot] != job or \
+                self._ignore[slot]:
+            return False
+        self._progress[slot] = (evaluated, total)
+        self._last_progress[slot] = make_datetime()
+        return True
+
+    def disable_worker(self, shard):
+        """Disable all the slots of a worker: the ones that are not
+        doing anything immediately, the others as soon as they finish
+        their current job.
+
+        shard (int): the worker to disable.
+
+        """
+        for slot in self._job:
+            if slot[0] != shard:
+                continue
+            if self._job[slot] == WorkerPool.WORKER_INACTIVE:
+                self._job[slot] = WorkerPool.WORKER_DISABLED
+            elif self._job[slot] != WorkerPool.WORKER_DISABLED:
+                self._schedule_disabling[slot] = True
+
+    def count_available_workers(self, exclude_shards=(),
+                                requirements=None):
+        """Return the number of slots that are connected and not
+        doing anything, i.e., that acquire_worker could use right now.
+
+        exclude_shards (list): workers not to count.
+        requirements (dict): if given, count only the slots of the
+                             workers satisfying them (see
+                             get_requirements).
+
+        return (int): the number of available slots.
+
+        """
+        requirements = self.effective_requirements(requirements)
+        return len([slot for slot, worker_job in self._job.iteritems()
+                    if worker_job == WorkerPool.WORKER_INACTIVE
+                    and self._worker[slot[0]].connected
+                    and slot[0] not in exclude_shards
+                    and slot[0] not in self._drained
+                    and self.satisfies(slot[0], requirements)])
+
+    def set_capabilities(self, shard, capabilities):
+        """Record the capabilities of a worker, as reported by the
+        worker itself.
+
+        shard (int): the worker.
+        capabilities (dict): the capabilities (see
+                             Worker.get_capabilities).
+
+        """
+        if self._capabilities[shard] is None:
+            logger.info("Worker %s can compile %s, has %s MiB of memory "
+                        "and hardware class `%s'." %
+                        (shard, ", ".join(capabilities["languages"]),
+                         capabilities["memory"],
+                         capabilities["hardware_class"]))
+        self._capabilities[shard] = capabilities
+        self.set_slots(shard, capabilities.get("slots", 1))
+        self.check_speeds()
+
+    def refresh_capabilities(self):
+        """Ask all connected workers their capabilities again, as
+        some of them (like the speed index) can change.
+
+        """
+        for shard in self._worker:
+            if self._worker[shard].connected:
+                self._worker[shard].get_capabilities(
+                    callback=self._service.capabilities_received.im_func,
+                    plus=shard)
+
+    def check_speeds(self):
+        """Flag the workers whose speed index differs from the median
+        one by more than config.worker_speed_tolerance, and, if
+        config.drain_deviating_workers is true, stop assigning them
+        jobs until they are back within the tolerance.
+
+        """
+        # A speed index that is not positive is meaningless (e.g., the
+        # calibration measured no time), so we ignore it.
+        speeds = dict((shard, capabilities["speed"])
+                      for shard, capabilities in self._capabilities.iteritems()
+                      if capabilities is not None
+                      and capabilities.get("speed") is not None
+                      and capabilities["speed"] > 0.0)
+        if len(speeds) == 0:
+            return
+        median = sorted(speeds.values())[len(speeds) // 2]
+        for shard, speed in speeds.iteritems():
+            deviation = abs(speed / median - 1.0)
+            if deviation > config.worker_speed_tolerance:
+                if shard not in self._deviating:
+                    logger.warning("Worker %s has speed index %.3f, while "
+                                   "the median is %.3f." %
+                                   (shard, speed, median))
+                    self._deviating.add(shard)
+                if config.drain_deviating_workers:
+                    self._drained.add(shard)
+            elif shard in self._deviating:
+                logger.info("Worker %s has speed index %.3f again, in "
+                            "line with the median %.3f." %
+                            (shard, speed, median))
+                self._deviating.discard(shard)
+                self._drained.discard(shard)
+
+    def get_requirements(self, action, language, memory_limit):
+        """Return what a worker needs to be able to do a job.
+
+        action (string): the type of the job.
+        language (string): the language of the submission or user
+                           test.
+        memory_limit (int): the memory limit of the task, in MiB.
+
+        return (dict): the requirements: a language to compile
+                       ('language'), the memory for each slot in MiB
+                       ('memory') and the hardware class
+                       ('hardware_class'), each one only if needed.
+
+        """
+        requirements = {}
+        if action in [EvaluationService.JOB_TYPE_COMPILATION,
+                      EvaluationService.JOB_TYPE_TEST_COMPILATION]:
+            if language is not None:
+                requirements["language"] = language
+        else:
+            if memory_limit is not None:
+                requirements["memory"] = memory_limit
+            # User tests are not scored, so any hardware is fine.
+            if action == EvaluationService.JOB_TYPE_EVALUATION and \
+                    config.reference_hardware_class != "":
+                requirements["hardware_class"] = \
+                    config.reference_hardware_class
+        return requirements
+
+    def satisfies(self, shard, requirements):
+        """Return whether a worker satisfies some requirements. A
+        worker whose capabilities are not known (yet) satisfies
+        everything, as it happened before workers reported them.
+
+        shard (int): the worker.
+        requirements (dict): the requirements (see get_requirements).
+
+        return (bool): True if the worker can do the job.
+
+        """
+        capabilities = self._capabilities.get(shard)
+        if not requirements or capabilities is None:
+            return True
+        if "language" in requirements and \
+                requirements["language"] not in capabilities["languages"]:
+            return False
+        if "memory" in requirements and capabilities["memory"] is not None \
+                and capabilities["memory"] // max(capabilities["slots"], 1) \
+                < requirements["memory"]:
+            return False
+        if "hardware_class" in requirements and \
+                requirements["hardware_class"] != \
+                capabilities["hardware_class"]:
+            return False
+        return True
+
+    def effective_requirements(self, requirements):
+        """Return the requirements to apply to a job: the given ones,
+        or none if no connected worker satisfies them, as it is better
+        to try the job anywhere than to keep it in the queue forever.
+
+        requirements (dict): the requirements (see get_requirements).
+
+        return (dict): the requirements to apply.
+
+        """
+        if not requirements:
+            return requirements
+        for shard in self._worker:
+            if self._worker[shard].connected and \
+                    self.satisfies(shard, requirements):
+                return requirements
+        logger.warning("No connected worker satisfies the requirements "
+                       "%s, ignoring them." % requirements)
+        return None
+
+    def count_slots(self, job):
+        """Return the number of slots doing a job (and whose result
+        is not to be ignored): more than one if the job is an
+        evaluation split in chunks, or if it has been dispatched again
+        because it was too slow.
+
+        job (job): the job.
+
+        return (int): the number of slots.
+
+        """
+        return len([slot for slot in self._job
+                    if self._job[slot] == job and not self._ignore[slot]])
+
+    def get_stragglers(self):
+        """Return the slots doing a job for more than the time after
+        which it is considered a straggler, if it is not assigned to
+        other slots.
+
+        return (list): list of tuples (slot, job, side_data, time the
+                       job has been running for).
+
+        """
+        now = make_datetime()
+        stragglers = []
+        for slot in self._job:
+            if self._start_time[slot] is None or self._ignore[slot] or \
+                    self._straggler_time[slot] is None:
+                continue
+            active_for = now - self._start_time[slot]
+            if active_for > self._straggler_time[slot] and \
+                    self.count_slots(self._job[slot]) == 1:
+                stragglers.append((slot, self._job[slot],
+                                   self._side_data[slot], active_for))
+        return stragglers
+
+    def reserve_worker(self, job, exclude_shards=()):
+        """Reserve for a queued job the busy slot that has been
+        working for the longest time (and so probably will be free
+        first), and ask its worker to download the files the job
+        needs in the meantime.
+
+        job (job): the job.
+        exclude_shards (list): workers not to use.
+
+        return (bool): True if a slot has been reserved.
+
+        """
+        pool = [slot for slot, worker_job in self._job.iteritems()
+                if worker_job not in [WorkerPool.WORKER_INACTIVE,
+                                      WorkerPool.WORKER_DISABLED]
+                and self._worker[slot[0]].connected
+                and not self._ignore[slot]
+                and not self._schedule_disabling[slot]
+                and slot[0] not in exclude_shards
+                and slot[0] not in self._drained
+                and slot not in self._reserved]
+        if pool == []:
+            return False
+
+        if job not in self._reservation_data:
+            with SessionGen(commit=False) as session:
+                job_, task_id, requirements, evaluation_action, \
+                    evaluation_job = self.build_job(job, session)
+                digests = job_.get_input_digests()
+                if evaluation_job is not None:
+                    digests += evaluation_job.get_input_digests()
+            self._reservation_data[job] = (digests, requirements)
+        digests, requirements = self._reservation_data[job]
+        requirements = self.effective_requirements(requirements)
+        pool = [slot for slot in pool if self.satisfies(slot[0],
+                                                        requirements)]
+        if pool == []:
+            return False
+
+        slot = min(pool, key=lambda slot: self._start_time[slot])
+        shard = slot[0]
+        self._reserved[slot] = job
+        digests = [digest for digest in set(digests)
+                   if digest not in self._cached_files[shard]]
+        logger.debug("Worker %s slot %s reserved for %s %s, prefetching "
+                     "%d files." % (shard, slot[1], job[0], job[1],
+                                    len(digests)))
+        if digests != []:
+            self._worker[shard].prefetch_files(
+                digests=digests,
+                callback=self._service.prefetch_finished.im_func,
+                plus=shard)
+        return True
+
+    def get_reserved_slot(self, job, exclude_shards=()):
+        """Return a slot reserved for a job that is now available.
+
+        job (job): the job.
+        exclude_shards (list): workers not to use.
+
+        return (tuple): the slot (shard, slot), or None.
+
+        """
+        for slot, reserved_job in self._reserved.iteritems():
+            if reserved_job == job \
+                    and self._job[slot] == WorkerPool.WORKER_INACTIVE \
+                    and self._worker[slot[0]].connected \
+                    and slot[0] not in exclude_shards \
+                    and slot[0] not in self._drained:
+                return slot
+        return None
+
+    def is_reserved(self, slot):
+        """Return whether a slot is reserved for a job.
+
+        slot (tuple): the slot (shard, slot).
+
+        return (bool): True if reserved.
+
+        """
+        return slot in self._reserved
+
+    def is_job_reserved(self, job):
+        """Return whether some slot is reserved for a job.
+
+        job (job): the job.
+
+        return (bool): True if reserved.
+
+        """
+        return job in self._reserved.itervalues()
+
+    def cancel_reservations(self, job):
+        """Forget the reservations of slots for a job.
+
+        job (job): the job.
+
+        """
+        for slot in [slot for slot, reserved_job
+                     in self._reserved.iteritems() if reserved_job == job]:
+            del self._reserved[slot]
+        self._reservation_data.pop(job, None)
+
+    def clean_reservations(self, is_queued):
+        """Forget the reservations (and the data read to make them) for
+        jobs not queued anymore, and of slots that are available or
+        disconnected (as their job has already had its chance to be
+        assigned to them).
+
+        is_queued (function): tells if a job is still queued.
+
+        """
+        for job in self._reservation_data.keys():
+            if not is_queued(job):
+                del self._reservation_data[job]
+        for slot in self._reserved.keys():
+            if not is_queued(self._reserved[slot]) \
+                    or self._job[slot] in [WorkerPool.WORKER_INACTIVE,
+                                           WorkerPool.WORKER_DISABLED] \
+                    or not self._worker[slot[0]].connected:
+                del self._reserved[slot]
+
+    def set_cached_files(self, shard, sizes):
+        """Record the content of the cache of a worker, as reported
+        by the worker itself.
+
+        shard (int): the worker.
+        sizes (dict): the size of each file in the cache, indexed by
+                      digest.
+
+        """
+        self._cached_files[shard] = set(sizes.iterkeys())
+        self._file_sizes.update(sizes)
+
+    def add_cached_files(self, shard, digests):
+        """Record that a worker has some files in its cache, because
+        it used them for a job.
+
+        shard (int): the worker.
+        digests (list): the digests of the files.
+
+        """
+        self._cached_files[shard].update(digests)
+
+    def find_available_worker(self, digests, exclude_shards=(),
+                              requirements=None):
+        """Return a slot that is available (not doing anything and
+        connected). If config.worker_cache_affinity is true, we choose
+        amongst the slots of the workers with the most bytes of the
+        given files already in their cache (files whose size is not
+        known count as one byte), otherwise we choose uniformly.
+
+        digests (list): the digests of the files the job needs.
+        exclude_shards (list): workers not to use.
+        requirements (dict): if given, use only the workers satisfying
+                             them (see get_requirements).
+
+        returns (tuple): the slot (shard, slot).
+
+        raise: LookupError if no slot is available.
+
+        """
+        requirements = self.effective_requirements(requirements)
+        pool = [slot for slot, worker_job in self._job.iteritems()
+                if worker_job == WorkerPool.WORKER_INACTIVE
+                and self._worker[slot[0]].connected
+                and slot[0] not in exclude_shards
+                and slot[0] not in self._drained
+                and self.satisfies(slot[0], requirements)]
+        if pool == []:
+            raise LookupError("No available worker.")
+
+        if config.worker_cache_affinity:
+            digests = set(digests)
+            scores = {}
+            for shard in set(slot[0] for slot in pool):
+                scores[shard] = sum(self._file_sizes.get(digest, 1)
+                                    for digest in digests
+                                    & self._cached_files[shard])
+            best_score = max(scores.itervalues())
+            pool = [slot for slot in pool if scores[slot[0]] == best_score]
+
+        return random.choice(pool)
+
     def find_worker(self, job, require_connection=False, random_worker=False):
-        """Return a worker whose assigned job is job. Remember that
-        there is a placeholder job to signal that the worker is not
+        """Return a slot whose assigned job is job. Remember that
+        there is a placeholder job to signal that the slot is not
         doing anything (or disabled).
 
         job (job): the job we are looking for, or WorkerPool.WORKER_*.
-        require_connection (bool): True if we want to find a worker
-                                   doing the job and that is actually
-                                   connected to us (i.e., did not
-                                   die).
+        require_connection (bool): True if we want to find a slot
+                                   doing the job and whose worker is
+                                   actually connected to us (i.e.,
+                                   did not die).
         random_worker (bool): if True, choose uniformly amongst all
-                       workers doing the job.
+                       slots doing the job.
 
-        returns (int): the shard of the worker working on job.
+        returns (tuple): the slot (shard, slot) working on job.
 
         raise: LookupError if nothing has been found.
 
         """
         pool = []
-        for shard, worker_job in self._job.iteritems():
+        for slot, worker_job in self._job.iteritems():
             if worker_job == job:
-                if not require_connection or self._worker[shard].connected:
-                    pool.append(shard)
+                if not require_connection or \
+                        self._worker[slot[0]].connected:
+                    pool.append(slot)
                     if not random_worker:
-                        return shard
+                        return slot
         if pool == []:
             raise LookupError("No such job.")
         else:
             return random.choice(pool)
 
     def ignore_job(self, job):
-        """Mark the job to be ignored, and try to inform the worker.
+        """Mark the job to be ignored, and try to inform the
+        worker. If the job is assigned to more than one slot (as it
+        happens for evaluations split in chunks), all of them are
+        informed.
 
         job (job): the job to ignore.
 
         raise: LookupError if job is not found.
 
         """
-        shard = self.find_worker(job)
-        self._ignore[shard] = True
-        self._worker[shard].ignore_job()
+        slots = [slot for slot in self._job
+                 if self._job[slot] == job and not self._ignore[slot]]
+        if slots == []:
+            raise LookupError("No such job.")
+        for slot in slots:
+            self._ignore[slot] = True
+            self._worker[slot[0]].ignore_job(slot=slot[1])
 
     def get_status(self):
         """Returns a dict with info about the current status of all
-        workers.
+        workers (or of all slots, as "shard/slot", if workers have
+        more than one).
 
         return (dict): dict of info: current job, starting time,
                        number of errors, and additional data specified
@@ -518,58 +1650,84 @@ class WorkerPool:
 
         """
         result = dict()
-        for shard in self._worker.keys():
-            s_time = self._start_time[shard]
+        for slot in self._job.keys():
+            s_time = self._start_time[slot]
             s_time = make_timestamp(s_time) if s_time is not None else None
-            s_data = self._side_data[shard]
+            s_data = self._side_data[slot]
             s_data = (s_data[0], make_timestamp(s_data[1])) \
                 if s_data is not None else None
 
-            result[str(shard)] = {
-                'connected': self._worker[shard].connected,
-                'job': self._job[shard],
+            if len(self._job) > len(self._worker):
+                name = "%s/%s" % slot
+            else:
+                name = str(slot[0])
+            result[name] = {
+                'connected': self._worker[slot[0]].connected,
+                'job': self._job[slot],
                 'start_time': s_time,
-                'side_data': s_data}
+                'side_data': s_data,
+                'progress': self._progress[slot],
+                'capabilities': self._capabilities[slot[0]],
+                'deviating': slot[0] in self._deviating,
+                'drained': slot[0] in self._drained}
         return result
 
     def check_timeouts(self):
-        """Check if some worker is not responding in too much time. If
-        this is the case, the worker is scheduled for disabling, and
-        we send him a message trying to shut it down.
+        """Check if some slot is not responding in too much time. If
+        this is the case, the whole worker is scheduled for disabling,
+        and we send him a message trying to shut it down.
 
         return (list): list of tuples (priority, timestamp, job) of
-                       jobs assigned to worker that timeout.
+                       jobs assigned to slots that timeout.
 
         """
         now = make_datetime()
         lost_jobs = []
-        for shard in self._worker:
-            if self._start_time[shard] is not None:
-                active_for = now - self._start_time[shard]
+        for slot in self._job.keys():
+            # Ignored jobs are not ours anymore (e.g., the other copy
+            # of a straggler already ended), we only wait for the slot
+            # to be released.
+            if self._start_time[slot] is not None and \
+                    not self._ignore[slot]:
+                active_for = now - self._start_time[slot]
+
+                # A job whose worker reports the testcases it
+                # evaluates is alive as long as the reports come.
+                if self._last_progress[slot] is not None and \
+                        self._testcase_timeout[slot] is not None:
+                    timed_out = now - self._last_progress[slot] > \
+                        self._testcase_timeout[slot]
+                else:
+                    timed_out = active_for > self._timeout[slot]
 
-                if active_for > EvaluationService.WORKER_TIMEOUT:
-                    # Here shard is a working worker with no sign of
+                if timed_out:
+                    # Here slot is a working slot with no sign of
                     # intelligent life for too much time.
                     logger.error("Disabling and shutting down "
                                  "worker %d because of no reponse "
-                                 "in %s." %
-                                 (shard, active_for))
-                    assert self._job[shard] != WorkerPool.WORKER_INACTIVE \
-                        and self._job[shard] != WorkerPool.WORKER_DISABLED
-
-                    # We return the job so ES can do what it needs.
-                    if not self._ignore[shard]:
-                        job = self._job[shard]
-                        priority, timestamp = self._side_data[shard]
+                                 "in %s (slot %d)." %
+                                 (slot[0], active_for, slot[1]))
+                    assert self._job[slot] != WorkerPool.WORKER_INACTIVE \
+                        and self._job[slot] != WorkerPool.WORKER_DISABLED
+
+                    # We return the job so ES can do what it needs
+                    # (once, even if more chunks of a split evaluation
+                    # time out).
+                    job = self._job[slot]
+                    priority, timestamp = self._side_data[slot]
+                    if job not in [lost[2] for lost in lost_jobs]:
                         lost_jobs.append((priority, timestamp, job))
 
                     # Also, we are not trusting it, so we are not
                     # assigning him new jobs even if it comes back to
-                    # life.
-                    self._schedule_disabling[shard] = True
-                    self._ignore[shard] = True
-                    self.release_worker(shard)
-                    self._worker[shard].quit("No response in %s." % active_for)
+                    # life. The jobs of the other slots are requeued
+                    # when the worker disconnects.
+                    self._schedule_disabling[slot] = True
+                    self._ignore[slot] = True
+                    self.release_worker(slot)
+                    self.disable_worker(slot[0])
+                    self._worker[slot[0]].quit(
+                        "No response in %s." % active_for)
 
         return lost_jobs
 
@@ -578,19 +1736,21 @@ class WorkerPool:
         case, requeue the job.
 
         return (list): list of tuples (priority, timestamp, job) of
-                       jobs assigned to worker that disconnected.
+                       jobs assigned to slots of workers that
+                       disconnected.
 
         """
         lost_jobs = []
-        for shard in self._worker:
-            if not self._worker[shard].connected and \
-                   self._job[shard] not in [WorkerPool.WORKER_DISABLED,
-                                            WorkerPool.WORKER_INACTIVE]:
-                if not self._ignore[shard]:
-                    job = self._job[shard]
-                    priority, timestamp = self._side_data[shard]
+        for slot in self._job.keys():
+            if not self._worker[slot[0]].connected and \
+                   self._job[slot] not in [WorkerPool.WORKER_DISABLED,
+                                           WorkerPool.WORKER_INACTIVE]:
+                job = self._job[slot]
+                if not self._ignore[slot] and \
+                        job not in [lost[2] for lost in lost_jobs]:
+                    priority, timestamp = self._side_data[slot]
                     lost_jobs.append((priority, timestamp, job))
-                self.release_worker(shard)
+                self.release_worker(slot)
 
         return lost_jobs
 
@@ -605,6 +1765,9 @@ class EvaluationService(Service):
     JOB_PRIORITY_MEDIUM = 2
     JOB_PRIORITY_LOW = 3
     JOB_PRIORITY_EXTRA_LOW = 4
+    # Priority of the jobs of a rejudge of many submissions, lower
+    # than the others so that they do not delay live submissions.
+    JOB_PRIORITY_REJUDGE = 5
 
     JOB_TYPE_COMPILATION = "compile"
     JOB_TYPE_EVALUATION = "evaluate"
@@ -619,19 +1782,58 @@ class EvaluationService(Service):
     INVALIDATE_COMPILATION = 0
     INVALIDATE_EVALUATION = 1
 
-    # Seconds after which we declare a worker stale.
+    LANE_SUBMISSIONS = "submissions"
+    LANE_USER_TESTS = "user_tests"
+
+    # Seconds after which we declare a job of a worker stale; with
+    # config.adaptive_worker_timeout, the longer between this and
+    # WORKER_TIMEOUT_FACTOR times its expected duration (or its worst
+    # case duration), plus WORKER_TIMEOUT_MARGIN (see
+    # JobCostEstimator.get_timeout).
     WORKER_TIMEOUT = timedelta(seconds=600)
+    WORKER_TIMEOUT_FACTOR = 5
+    WORKER_TIMEOUT_MARGIN = timedelta(seconds=60)
     # How often we check for stale workers.
     WORKER_TIMEOUT_CHECK_TIME = timedelta(seconds=300)
 
+    # A job is a straggler if it has been running for more than
+    # STRAGGLER_FACTOR times the STRAGGLER_PERCENTILE of the costs of
+    # similar jobs, and at least for STRAGGLER_MIN_TIME; we check for
+    # them every STRAGGLER_CHECK_TIME.
+    STRAGGLER_PERCENTILE = 0.9
+    STRAGGLER_FACTOR = 2
+    STRAGGLER_MIN_TIME = timedelta(seconds=30)
+    STRAGGLER_CHECK_TIME = timedelta(seconds=10)
+
     # How often we check if a worker is connected.
     WORKER_CONNECTION_CHECK_TIME = timedelta(seconds=10)
 
-    # How often we check if we can assign a job to a worker.
+    # How often we ask the workers their capabilities (and speed
+    # index) again.
+    WORKER_CAPABILITIES_CHECK_TIME = timedelta(seconds=300)
+
+    # How often we check if we can assign a job to a worker, and how
+    # many jobs of a lane we skip at most in each check because no
+    # available worker can do them.
     CHECK_DISPATCH_TIME = timedelta(seconds=2)
+    DISPATCH_LOOKAHEAD = 20
+
+    # How many jobs at the top of each queue can have their files
+    # prefetched by busy workers (see prefetch_jobs).
+    PREFETCH_MAX_JOBS = 10
 
     # How often we look for submission not compiled/evaluated.
     JOBS_NOT_DONE_CHECK_TIME = timedelta(seconds=117)
+    # How many of these searches (including the first) look at all
+    # submissions, and not only at the new ones.
+    JOBS_NOT_DONE_FULL_CHECK_EVERY = 10
+
+    # How often we queue the jobs of the next chunk of the submissions
+    # to rejudge, how big the chunks are, and how many rejudge jobs
+    # can be in the queue before we stop adding them.
+    REJUDGE_STEP_TIME = timedelta(seconds=1)
+    REJUDGE_CHUNK_SIZE = 100
+    REJUDGE_MAX_QUEUED = 500
 
     def __init__(self, shard, contest_id):
         logger.initialize(ServiceCoord("EvaluationService", shard))
@@ -639,8 +1841,81 @@ class EvaluationService(Service):
 
         self.contest_id = contest_id
 
-        self.queue = JobQueue()
+        # Jobs are queued in two lanes, one for submissions and one
+        # for user tests, each served preferably by its own workers.
+        self.queue = JobQueue(fair_share=config.fair_share_queue,
+                              cost_weight=config.shortest_job_first_weight)
+        self.test_queue = JobQueue(
+            fair_share=config.fair_share_queue,
+            cost_weight=config.shortest_job_first_weight)
+        self.lane_queues = {
+            EvaluationService.LANE_SUBMISSIONS: self.queue,
+            EvaluationService.LANE_USER_TESTS: self.test_queue}
+        # The workers each lane cannot use, unless borrowing.
+        test_shards = set(config.user_test_workers)
+        all_shards = set(xrange(get_service_shards("Worker")))
+        self.lane_excluded_shards = {
+            EvaluationService.LANE_SUBMISSIONS: test_shards,
+            EvaluationService.LANE_USER_TESTS:
+            all_shards - test_shards if test_shards else set()}
+        # How long (in seconds) the last jobs of each lane waited
+        # before being dispatched.
+        self.lane_waits = dict((lane, deque(maxlen=100))
+                               for lane in self.lane_queues)
         self.pool = WorkerPool(self)
+
+        # Expected costs of the jobs, used to order the queue and to
+        # decide when a job is lost.
+        self.costs = JobCostEstimator()
+        self.costs.load(contest_id)
+
+        # The data of the tasks needed by their jobs, by task id (see
+        # get_task_description).
+        self.task_descriptions = {}
+
+        # Highest ids of the submissions and user tests seen by the
+        # last search of jobs not done, and how many searches ago we
+        # looked at all of them (the first search does).
+        self.submission_high_water_mark = 0
+        self.user_test_high_water_mark = 0
+        self.searches_since_full_search = \
+            EvaluationService.JOBS_NOT_DONE_FULL_CHECK_EVERY
+
+        # We recover the jobs we had to do before being restarted;
+        # they are checked against the DB only when they are
+        # dispatched, so that we can start immediately.
+        journal_path = None
+        if config.job_journal:
+            mkdir(config.data_dir)
+            journal_path = os.path.join(
+                config.data_dir,
+                "es-jobs-%d-%d.journal" % (shard, contest_id))
+        self.journal = JobJournal(journal_path)
+        self.unverified_jobs = set()
+        for priority, timestamp, job in self.journal.load():
+            self.get_queue(job).push(job, priority, timestamp)
+            self.unverified_jobs.add(job)
+        if len(self.unverified_jobs) > 0:
+            logger.info("Recovered %d jobs from the journal." %
+                        len(self.unverified_jobs))
+
+        # Evaluations currently split amongst many workers, indexed by
+        # submission id. The values are dictionaries with the slots
+        # of the workers still evaluating a chunk ('workers') and the
+        # job collecting the results of the finished chunks ('job').
+        self.split_evaluations = {}
+
+        # Submissions of a rejudge, already invalidated, whose jobs
+        # are still to be queued, as pairs (submission_id, level) and
+        # as a set of ids, and the number of submissions of the
+        # current rejudge.
+        self.rejudge_queue = deque()
+        self.rejudge_pending = set()
+        self.rejudge_total = 0
+
+        # Submissions in the queue whose compilation we already looked
+        # for in the compilation cache, without success.
+        self.compilation_cache_misses = set()
         self.scoring_service = self.connect_to(
             ServiceCoord("ScoringService", 0))
 
@@ -660,56 +1935,122 @@ class EvaluationService(Service):
                          EvaluationService.WORKER_CONNECTION_CHECK_TIME
                          .total_seconds(),
                          immediately=False)
+        self.add_timeout(self.check_workers_capabilities, None,
+                         EvaluationService.WORKER_CAPABILITIES_CHECK_TIME
+                         .total_seconds(),
+                         immediately=False)
+        if config.speculative_dispatch:
+            self.add_timeout(self.check_stragglers, None,
+                             EvaluationService.STRAGGLER_CHECK_TIME
+                             .total_seconds(),
+                             immediately=False)
+        # If we recovered the jobs, the first search can wait.
         self.add_timeout(self.search_jobs_not_done, None,
                          EvaluationService.JOBS_NOT_DONE_CHECK_TIME
                          .total_seconds(),
-                         immediately=True)
+                         immediately=len(self.unverified_jobs) == 0)
 
     def search_jobs_not_done(self):
         """Look in the database for submissions that have not been
         compiled or evaluated for no good reasons. Put the missing job
         in the queue.
 
+        Only the rows created since the previous search (i.e., with an
+        id above the high-water mark) are considered, except every
+        JOBS_NOT_DONE_FULL_CHECK_EVERY searches, when we look at all
+        of them (ids may become visible out of order, and jobs may get
+        lost). In both cases, the partial indexes on the rows still to
+        be compiled or evaluated make the queries cheap. In the full
+        searches we also check that the tasks we know have not been
+        modified (see check_task_descriptions).
+
         """
+        full_search = self.searches_since_full_search >= \
+            EvaluationService.JOBS_NOT_DONE_FULL_CHECK_EVERY
+        if full_search:
+            self.searches_since_full_search = 0
+            min_submission_id = 0
+            min_user_test_id = 0
+        else:
+            min_submission_id = self.submission_high_water_mark
+            min_user_test_id = self.user_test_high_water_mark
+        self.searches_since_full_search += 1
+
         new_jobs = 0
         with SessionGen(commit=False) as session:
-            contest = session.query(Contest).\
-                      filter_by(id=self.contest_id).first()
+            # We read the marks before searching, so that rows created
+            # meanwhile are seen again in the next search.
+            submission_mark = session.query(func.max(Submission.id))\
+                .scalar() or 0
+            user_test_mark = session.query(func.max(UserTest.id))\
+                .scalar() or 0
+
+            if full_search:
+                self.check_task_descriptions(session)
 
             # Only adding submission not compiled/evaluated that have
             # not yet reached the limit of tries.
-            for submission in contest.get_submissions():
-                if to_compile(submission):
-                    if self.push_in_queue(
-                        (EvaluationService.JOB_TYPE_COMPILATION,
-                         submission.id),
-                        EvaluationService.JOB_PRIORITY_HIGH,
-                        submission.timestamp):
-                        new_jobs += 1
-                elif to_evaluate(submission):
-                    if self.push_in_queue(
-                        (EvaluationService.JOB_TYPE_EVALUATION,
-                         submission.id),
-                        EvaluationService.JOB_PRIORITY_MEDIUM,
-                        submission.timestamp):
-                        new_jobs += 1
+            submissions = session.query(Submission.id,
+                                        Submission.timestamp,
+                                        Submission.user_id,
+                                        Submission.task_id)\
+                .join(Submission.task)\
+                .filter(Task.contest_id == self.contest_id)\
+                .filter(Submission.id > min_submission_id)
+            # The submissions of a rejudge are queued by rejudge_step.
+            for submission_id, timestamp, user_id, task_id in \
+                    filter_to_compile(submissions):
+                if submission_id in self.rejudge_pending:
+                    continue
+                if self.push_in_queue(
+                    (EvaluationService.JOB_TYPE_COMPILATION,
+                     submission_id),
+                    EvaluationService.JOB_PRIORITY_HIGH,
+                    timestamp, user_id, task_id):
+                    new_jobs += 1
+            for submission_id, timestamp, user_id, task_id in \
+                    filter_to_evaluate(submissions):
+                if submission_id in self.rejudge_pending:
+                    continue
+                if self.push_in_queue(
+                    (EvaluationService.JOB_TYPE_EVALUATION,
+                     submission_id),
+                    EvaluationService.JOB_PRIORITY_MEDIUM,
+                    timestamp, user_id, task_id):
+                    new_jobs += 1
 
             # The same for user tests
-            for user_test in contest.get_user_tests():
-                if user_test_to_compile(user_test):
-                    if self.push_in_queue(
-                        (EvaluationService.JOB_TYPE_TEST_COMPILATION,
-                         user_test.id),
-                        EvaluationService.JOB_PRIORITY_HIGH,
-                        user_test.timestamp):
-                        new_jobs += 1
-                elif user_test_to_evaluate(user_test):
-                    if self.push_in_queue(
-                        (EvaluationService.JOB_TYPE_TEST_EVALUATION,
-                         user_test.id),
-                        EvaluationService.JOB_PRIORITY_MEDIUM,
-                        user_test.timestamp):
-                        new_jobs += 1
+            user_tests = session.query(UserTest.id,
+                                       UserTest.timestamp,
+                                       UserTest.user_id,
+                                       UserTest.task_id)\
+                .join(UserTest.user)\
+                .filter(User.contest_id == self.contest_id)\
+                .filter(UserTest.id > min_user_test_id)
+            for user_test_id, timestamp, user_id, task_id in user_tests\
+                    .filter(UserTest.compilation_outcome == None)\
+                    .filter(UserTest.compilation_tries <
+                            EvaluationService.MAX_TEST_COMPILATION_TRIES):
+                if self.push_in_queue(
+                    (EvaluationService.JOB_TYPE_TEST_COMPILATION,
+                     user_test_id),
+                    EvaluationService.JOB_PRIORITY_HIGH,
+                    timestamp, user_id, task_id):
+                    new_jobs += 1
+            for user_test_id, timestamp, user_id, task_id in user_tests\
+                    .filter(UserTest.compilation_outcome == "ok")\
+                    .filter(UserTest.evaluation_outcome == None)\
+                    .filter(UserTest.evaluation_tries <
+                            EvaluationService.MAX_TEST_EVALUATION_TRIES):
+                if self.push_in_queue(
+                    (EvaluationService.JOB_TYPE_TEST_EVALUATION,
+                     user_test_id),
+                    EvaluationService.JOB_PRIORITY_MEDIUM,
+                    timestamp, user_id, task_id):
+                    new_jobs += 1
+
+        self.submission_high_water_mark = submission_mark
+        self.user_test_high_water_mark = user_test_mark
 
         if new_jobs > 0:
             logger.info("Found %s submissions or user tests with "
@@ -718,39 +2059,387 @@ class EvaluationService(Service):
         # Run forever.
         return True
 
+    def get_lane(self, job):
+        """Return the lane of a job.
+
+        job (job): the job.
+
+        return (string): LANE_SUBMISSIONS or LANE_USER_TESTS.
+
+        """
+        if job[0] in [EvaluationService.JOB_TYPE_TEST_COMPILATION,
+                      EvaluationService.JOB_TYPE_TEST_EVALUATION]:
+            return EvaluationService.LANE_USER_TESTS
+        return EvaluationService.LANE_SUBMISSIONS
+
+    def get_queue(self, job):
+        """Return the queue of the lane of a job.
+
+        job (job): the job.
+
+        return (JobQueue): the queue.
+
+        """
+        return self.lane_queues[self.get_lane(job)]
+
     def dispatch_jobs(self):
         """Check if there are pending jobs, and tries to distribute as
-        many of them to the available workers.
+        many of them to the available workers: first each lane to its
+        own workers, then, if config.lane_borrowing is true, to the
+        idle workers of the other lane.
 
         """
-        pending = self.queue.length()
+        pending = sum(queue.length() for queue in self.lane_queues.values())
         if pending > 0:
             logger.info("%s jobs still pending." % pending)
-        while self.dispatch_one_job():
-            pass
+        self.dispatch_lanes(self.lane_excluded_shards)
+        if config.lane_borrowing and len(config.user_test_workers) > 0:
+            self.dispatch_lanes(dict((lane, ())
+                                     for lane in self.lane_queues))
+        if config.prefetch_jobs:
+            self.prefetch_jobs()
 
         # We want this to run forever.
         return True
 
-    def dispatch_one_job(self):
-        """Try to dispatch exactly one job, if it exists, to one
-        available worker, if it exists.
+    def prefetch_jobs(self):
+        """Reserve busy slots for the jobs at the top of the queues,
+        so that their workers download the files of the jobs while
+        they finish the current ones.
+
+        """
+        self.pool.clean_reservations(
+            lambda job: any(job in queue
+                            for queue in self.lane_queues.itervalues()))
+        for lane, queue in self.lane_queues.iteritems():
+            for priority, timestamp, job in \
+                    queue.peek(EvaluationService.PREFETCH_MAX_JOBS):
+                if self.pool.is_job_reserved(job):
+                    continue
+                if not self.pool.reserve_worker(
+                        job, self.lane_excluded_shards[lane]):
+                    break
+
+    def dispatch_lanes(self, excluded_shards):
+        """Dispatch as many jobs as possible, taking each time the
+        first job amongst the lanes that can still get a worker.
+
+        A job that no available worker can do (e.g., because of its
+        requirements) is skipped for this round, so that it does not
+        block the ones behind it; we look at most DISPATCH_LOOKAHEAD
+        jobs past the skipped ones of each lane.
+
+        excluded_shards (dict): the workers each lane cannot use.
+
+        """
+        skipped = dict((lane, set()) for lane in self.lane_queues)
+        blocked = set()
+        while True:
+            best = None
+            best_entry = None
+            for lane, queue in self.lane_queues.iteritems():
+                if lane in blocked:
+                    continue
+                entry = None
+                if len(skipped[lane]) < \
+                        EvaluationService.DISPATCH_LOOKAHEAD and \
+                        self.pool.count_available_workers(
+                            excluded_shards[lane]) > 0:
+                    for candidate in queue.peek(len(skipped[lane]) + 1):
+                        if candidate[2] not in skipped[lane]:
+                            entry = candidate
+                            break
+                if entry is None:
+                    blocked.add(lane)
+                    continue
+                if best is None or entry[:2] < best_entry[:2]:
+                    best = lane
+                    best_entry = entry
+            if best is None:
+                return
+            if not self.dispatch_one_job(best, best_entry,
+                                         excluded_shards[best]):
+                skipped[best].add(best_entry[2])
+
+    def dispatch_one_job(self, lane, entry, exclude_shards=()):
+        """Try to dispatch exactly one job of a lane to one available
+        worker, if it exists.
+
+        lane (string): the lane of the job.
+        entry (tuple): the job to dispatch, as (priority, timestamp,
+                       job).
+        exclude_shards (list): workers not to use.
 
         return (bool): True if successfully dispatched, False if some
                        resource was missing.
 
         """
+        queue = self.lane_queues[lane]
+        priority, timestamp, job = entry
+
+        # A job recovered from the journal may have been done in the
+        # meantime.
+        if job in self.unverified_jobs:
+            self.unverified_jobs.discard(job)
+            if not self.job_still_to_do(job):
+                logger.info("Job %s for submission/user test %d recovered "
+                            "from the journal is not needed anymore." %
+                            (job[0], job[1]))
+                queue.extract(job)
+                self.journal.remove(job)
+                return True
+
+        # If the same compilation has already been done, we don't need
+        # a worker.
+        if job[0] == EvaluationService.JOB_TYPE_COMPILATION and \
+                config.compilation_cache and \
+                job[1] not in self.compilation_cache_misses:
+            cached_id = self.find_cached_compilation(job[1])
+            if cached_id is not None:
+                queue.extract(job)
+                self.journal.remove(job)
+                self.compile_from_cache(job[1], cached_id, priority)
+                return True
+            self.compilation_cache_misses.add(job[1])
+
+        if job[0] == EvaluationService.JOB_TYPE_EVALUATION and \
+                config.max_evaluation_chunks > 1:
+            res = self.dispatch_split_evaluation(job, priority, timestamp,
+                                                 exclude_shards)
+        else:
+            res = self.pool.acquire_worker(
+                job, side_data=(priority, timestamp),
+                exclude_shards=exclude_shards) is not None
+        if res:
+            queue.extract(job)
+            self.compilation_cache_misses.discard(job[1])
+            # Rejudges are not meant to be quick.
+            if priority != EvaluationService.JOB_PRIORITY_REJUDGE:
+                self.lane_waits[lane].append(
+                    (make_datetime() - timestamp).total_seconds())
+        return res
+
+    def job_still_to_do(self, job):
+        """Check in the DB if a job still has to be done.
+
+        job (job): the job.
+
+        return (bool): True if the job has to be done.
+
+        """
+        job_type, object_id = job
+        with SessionGen(commit=False) as session:
+            if job_type in [EvaluationService.JOB_TYPE_COMPILATION,
+                            EvaluationService.JOB_TYPE_EVALUATION]:
+                submission = Submission.get_from_id(object_id, session)
+                if submission is None:
+                    return False
+                if job_type == EvaluationService.JOB_TYPE_COMPILATION:
+                    return to_compile(submission)
+                else:
+                    return to_evaluate(submission)
+            else:
+                user_test = UserTest.get_from_id(object_id, session)
+                if user_test is None:
+                    return False
+                if job_type == EvaluationService.JOB_TYPE_TEST_COMPILATION:
+                    return user_test_to_compile(user_test)
+                else:
+                    return user_test_to_evaluate(user_test)
+
+    def find_cached_compilation(self, submission_id):
+        """Look for another submission that has been compiled with the
+        same inputs (sources, language, managers, ...) of the given
+        one.
+
+        submission_id (int): the id of the submission to compile.
+
+        return (int): the id of the submission whose compilation can
+                      be reused, or None.
+
+        """
+        with SessionGen(commit=False) as session:
+            submission = Submission.get_from_id(submission_id, session)
+            if submission is None:
+                return None
+            key = CompilationJob.from_submission(
+                submission, self.get_task_description(
+                    submission.task_id, session)).get_cache_key()
+            cached = session.query(Submission).\
+                filter(Submission.compilation_key == key).\
+                filter(Submission.id != submission_id).first()
+            if cached is None:
+                return None
+            return cached.id
+
+    def compile_from_cache(self, submission_id, cached_id, priority):
+        """Give to a submission the compilation outcome, text and
+        executables of another one with the same inputs, as if it had
+        been compiled.
+
+        submission_id (int): the id of the submission to compile.
+        cached_id (int): the id of the submission already compiled.
+        priority (int): the priority of the compilation job.
+
+        """
+        with SessionGen(commit=False) as session:
+            submission = Submission.get_from_id(submission_id, session)
+            cached = Submission.get_from_id(cached_id, session)
+            if submission is None or cached is None:
+                logger.error("[compile_from_cache] Couldn't find "
+                             "submissions %d or %d in the database." %
+                             (submission_id, cached_id))
+                return
+
+            logger.info("Compilation of submission %d reused for "
+                        "submission %d." % (cached_id, submission_id))
+            submission.compilation_tries += 1
+            submission.compilation_outcome = cached.compilation_outcome
+            submission.compilation_text = cached.compilation_text
+            submission.compilation_shard = cached.compilation_shard
+            submission.compilation_sandbox = cached.compilation_sandbox
+            submission.compilation_key = cached.compilation_key
+            for executable in cached.executables.itervalues():
+                executable = Executable(executable.filename,
+                                        executable.digest)
+                submission.executables[executable.filename] = executable
+                session.add(executable)
+
+            self.compilation_ended(
+                submission,
+                rejudge=priority == EvaluationService.JOB_PRIORITY_REJUDGE)
+            session.commit()
+
+    def dispatch_split_evaluation(self, job, priority, timestamp,
+                                  exclude_shards=()):
+        """Try to dispatch an evaluation job splitting its testcases
+        in chunks, each one assigned to a different available slot,
+        preferably of different workers. If only one slot is
+        available, or the task has too few testcases, the job is
+        dispatched as a whole.
+
+        job (job): the evaluation job to dispatch.
+        priority (int): the priority of the job.
+        timestamp (datetime): the timestamp of the job.
+        exclude_shards (list): workers not to use.
+
+        return (bool): True if successfully dispatched, False if no
+                       worker was available.
+
+        """
+        available = self.pool.count_available_workers(exclude_shards)
+        if available == 0:
+            return False
+
+        chunks = 1
+        if available > 1:
+            with SessionGen(commit=False) as session:
+                submission = Submission.get_from_id(job[1], session)
+                if submission is not None:
+                    description = self.get_task_description(
+                        submission.task_id, session)
+                    testcases_num = len(description['testcases'])
+                    available = self.pool.count_available_workers(
+                        exclude_shards, self.pool.get_requirements(
+                            job[0], submission.language,
+                            description['memory_limit']))
+                    chunks = min(available,
+                                 config.max_evaluation_chunks,
+                                 testcases_num //
+                                 max(config.min_testcases_per_chunk, 1))
+
+        if chunks <= 1:
+            return self.pool.acquire_worker(
+                job, side_data=(priority, timestamp),
+                exclude_shards=exclude_shards) is not None
+
+        split = {"workers": set(), "job": None}
+        self.split_evaluations[job[1]] = split
+        for i in xrange(chunks):
+            testcase_subset = range(i * testcases_num // chunks,
+                                    (i + 1) * testcases_num // chunks)
+            # We use another slot of a worker already evaluating a
+            # chunk only if there is no other choice.
+            slot = self.pool.acquire_worker(
+                job, side_data=(priority, timestamp),
+                testcase_subset=testcase_subset,
+                exclude_shards=set(exclude_shards) |
+                set(shard for shard, _ in split["workers"]))
+            if slot is None:
+                slot = self.pool.acquire_worker(
+                    job, side_data=(priority, timestamp),
+                    testcase_subset=testcase_subset,
+                    exclude_shards=exclude_shards)
+            if slot is None:
+                # Should not happen, as we counted the available
+                # workers just before; anyway, we drop what we did
+                # and try again later.
+                logger.error("Couldn't acquire worker for chunk %d of "
+                             "the evaluation of submission %d." %
+                             (i, job[1]))
+                self.abort_split_evaluation(job)
+                return False
+            split["workers"].add(slot)
+
+        logger.info("Evaluation of submission %d split in %d chunks." %
+                    (job[1], chunks))
+        return True
+
+    def abort_split_evaluation(self, job):
+        """If job is an evaluation split in chunks, forget about it
+        and ignore the chunks still assigned to the workers, so that
+        the job can be queued again as a whole.
+
+        job (job): the job to abort.
+
+        """
+        if job[0] != EvaluationService.JOB_TYPE_EVALUATION or \
+                job[1] not in self.split_evaluations:
+            return
+        del self.split_evaluations[job[1]]
         try:
-            priority, timestamp, job = self.queue.top()
+            self.pool.ignore_job(job)
         except LookupError:
-            return False
+            pass  # Ok, no other chunk was still running.
 
-        res = self.pool.acquire_worker(job, side_data=(priority, timestamp))
-        if res is not None:
-            self.queue.pop()
-            return True
+    def split_evaluation_chunk_ended(self, submission_id, slot,
+                                     job_success, job):
+        """Collect the results of a chunk of a split evaluation.
+
+        submission_id (int): the id of the submission.
+        slot (tuple): the slot (shard, slot) of the worker that
+                      evaluated the chunk.
+        job_success (bool): whether the chunk was successful.
+        job (EvaluationJob): the job returned by the worker.
+
+        return (bool, bool, EvaluationJob): whether all chunks have
+            ended; if so, whether the whole evaluation was successful
+            and a job containing the evaluations of all testcases.
+
+        """
+        split = self.split_evaluations[submission_id]
+        split["workers"].discard(slot)
+
+        # If one chunk failed, the whole evaluation will be done again,
+        # so there is no point in waiting for the others.
+        if not job_success:
+            self.abort_split_evaluation(
+                (EvaluationService.JOB_TYPE_EVALUATION, submission_id))
+            return True, False, None
+
+        # We remember which worker evaluated each testcase.
+        for info in job.evaluations.itervalues():
+            info['shard'] = job.shard
+        if split["job"] is None:
+            split["job"] = job
         else:
-            return False
+            split["job"].evaluations.update(job.evaluations)
+
+        if len(split["workers"]) > 0:
+            return False, None, None
+
+        del self.split_evaluations[submission_id]
+        return True, True, split["job"]
 
     @rpc_method
     def submissions_status(self):
@@ -775,48 +2464,87 @@ class EvaluationService(Service):
             "max_evaluations": 0,
             "invalid": 0}
         with SessionGen(commit=False) as session:
-            contest = session.query(Contest).\
-                      filter_by(id=self.contest_id).first()
-            for submission in contest.get_submissions():
-                if submission.compilation_outcome == "fail":
-                    stats["compilation_fail"] += 1
-                elif submission.compilation_outcome is None:
-                    if submission.compilation_tries >= \
-                           EvaluationService.MAX_COMPILATION_TRIES:
-                        stats["max_compilations"] += 1
+            # We let the DB count the submissions for each combination
+            # of the fields that determine the status.
+            max_compilations = (Submission.compilation_tries >=
+                                EvaluationService.MAX_COMPILATION_TRIES)
+            evaluated = Submission.evaluation_outcome != None
+            max_evaluations = (Submission.evaluation_tries >=
+                               EvaluationService.MAX_EVALUATION_TRIES)
+            scored = Submission.score != None
+            groups = session.query(Submission.compilation_outcome,
+                                   max_compilations, evaluated,
+                                   max_evaluations, scored,
+                                   func.count(Submission.id))\
+                .join(Submission.task)\
+                .filter(Task.contest_id == self.contest_id)\
+                .group_by(Submission.compilation_outcome,
+                          max_compilations, evaluated,
+                          max_evaluations, scored)
+            for compilation_outcome, is_max_compilations, is_evaluated, \
+                    is_max_evaluations, is_scored, count in groups:
+                if compilation_outcome == "fail":
+                    stats["compilation_fail"] += count
+                elif compilation_outcome is None:
+                    if is_max_compilations:
+                        stats["max_compilations"] += count
                     else:
-                        stats["compiling"] += 1
-                elif submission.compilation_outcome == "ok":
-                    if submission.evaluated():
-                        if submission.scored():
-                            stats["scored"] += 1
+                        stats["compiling"] += count
+                elif compilation_outcome == "ok":
+                    if is_evaluated:
+                        if is_scored:
+                            stats["scored"] += count
                         else:
-                            stats["evaluated"] += 1
+                            stats["evaluated"] += count
                     else:
-                        if submission.evaluation_tries >= \
-                               EvaluationService.MAX_EVALUATION_TRIES:
-                            stats["max_evaluations"] += 1
+                        if is_max_evaluations:
+                            stats["max_evaluations"] += count
                         else:
-                            stats["evaluating"] += 1
+                            stats["evaluating"] += count
                 else:
                     # Should not happen.
-                    stats["invalid"] += 1
+                    stats["invalid"] += count
         return stats
 
     @rpc_method
     def queue_status(self):
         """Returns a list whose elements are the jobs currently in the
-        queue (see Queue.get_status).
+        queues of all lanes (see Queue.get_status).
 
         returns (list): the list with the queued elements.
 
         """
-        return self.queue.get_status()
+        return self.queue.get_status() + self.test_queue.get_status()
+
+    @rpc_method
+    def lanes_status(self):
+        """Returns a dictionary (indexed by lane) with the number of
+        jobs in the queue of each lane ('queued'), and the seconds
+        since submission waited by the oldest of them ('oldest_wait')
+        and, on average, by the last ones dispatched
+        ('average_wait'), or None if there are none.
+
+        returns (dict): the dict with the lanes information.
+
+        """
+        now = make_datetime()
+        result = {}
+        for lane, queue in self.lane_queues.iteritems():
+            oldest = queue.oldest_timestamp()
+            waits = self.lane_waits[lane]
+            result[lane] = {
+                'queued': queue.length(),
+                'oldest_wait': (now - oldest).total_seconds()
+                if oldest is not None else None,
+                'average_wait': sum(waits) / len(waits)
+                if len(waits) > 0 else None}
+        return result
 
     @rpc_method
     def workers_status(self):
-        """Returns a dictionary (indexed by shard number) whose values
-        are the information about the corresponding worker. See
+        """Returns a dictionary (indexed by shard number, or by
+        "shard/slot" if workers have many slots) whose values are the
+        information about the corresponding worker. See
         WorkerPool.get_status for more details.
 
         returns (dict): the dict with the workers information.
@@ -831,12 +2559,67 @@ class EvaluationService(Service):
         """
         lost_jobs = self.pool.check_timeouts()
         for priority, timestamp, job in lost_jobs:
+            self.abort_split_evaluation(job)
+            # A job that hangs its worker every time must not take
+            # down all of them, so a timeout counts as a failed try.
+            if not self.count_lost_try(job):
+                self.journal.remove(job)
+                continue
             logger.info("Job %s for submission/user test %d put again "
                         "in the queue because of timeout worker."
                         % (job[0], job[1]))
             self.push_in_queue(job, priority, timestamp)
         return True
 
+    def count_lost_try(self, job):
+        """Count a try of a job that has been lost, as for a job that
+        failed.
+
+        job (job): the job.
+
+        return (bool): True if the job can be tried again.
+
+        """
+        job_type, object_id = job
+        with SessionGen(commit=True) as session:
+            if job_type in [EvaluationService.JOB_TYPE_COMPILATION,
+                            EvaluationService.JOB_TYPE_EVALUATION]:
+                obj = Submission.get_from_id(object_id, session)
+                name = "submission"
+            else:
+                obj = UserTest.get_from_id(object_id, session)
+                name = "user test"
+            if obj is None:
+                logger.error("[count_lost_try] Couldn't find %s %d in "
+                             "the database." % (name, object_id))
+                return False
+
+            if job_type in [EvaluationService.JOB_TYPE_COMPILATION,
+                            EvaluationService.JOB_TYPE_TEST_COMPILATION]:
+                obj.compilation_tries += 1
+                tries = obj.compilation_tries
+                action = "compilation"
+            else:
+                obj.evaluation_tries += 1
+                tries = obj.evaluation_tries
+                action = "evaluation"
+            max_tries = {
+                EvaluationService.JOB_TYPE_COMPILATION:
+                EvaluationService.MAX_COMPILATION_TRIES,
+                EvaluationService.JOB_TYPE_EVALUATION:
+                EvaluationService.MAX_EVALUATION_TRIES,
+                EvaluationService.JOB_TYPE_TEST_COMPILATION:
+                EvaluationService.MAX_TEST_COMPILATION_TRIES,
+                EvaluationService.JOB_TYPE_TEST_EVALUATION:
+                EvaluationService.MAX_TEST_EVALUATION_TRIES}[job_type]
+
+            if tries > max_tries:
+                logger.error("Maximum tries reached for the %s of %s %d. "
+                             "I will not try again." %
+                             (action, name, object_id))
+                return False
+        return True
+
     def check_workers_connection(self):
         """We ask WorkerPool for the unconnected workers, and we put
         again their jobs in the queue.
@@ -847,9 +2630,48 @@ class EvaluationService(Service):
             logger.info("Job %s for submission/user test %s put again "
                         "in the queue because of disconnected worker."
                         % (job[0], job[1]))
+            self.abort_split_evaluation(job)
             self.push_in_queue(job, priority, timestamp)
         return True
 
+    def check_workers_capabilities(self):
+        """We ask the workers their capabilities again, to notice
+        when their speed index changes.
+
+        """
+        self.pool.refresh_capabilities()
+        return True
+
+    def check_stragglers(self):
+        """We ask WorkerPool for the jobs that are taking much longer
+        than similar ones, and, if there is nothing else to do, we
+        assign a copy of them to another worker. The first result
+        that arrives is kept, and the other copy is ignored (see
+        action_finished). The copy goes only to the workers of the
+        lane of the job.
+
+        """
+        if not self.queue.empty() or not self.test_queue.empty():
+            return True
+        for slot, job, side_data, active_for in self.pool.get_stragglers():
+            # The chunks of a split evaluation are already spread.
+            if job[0] == EvaluationService.JOB_TYPE_EVALUATION and \
+                    job[1] in self.split_evaluations:
+                continue
+            exclude_shards = \
+                set(self.lane_excluded_shards[self.get_lane(job)])
+            exclude_shards.add(slot[0])
+            new_slot = self.pool.acquire_worker(
+                job, side_data=side_data, exclude_shards=exclude_shards)
+            if new_slot is None:
+                break
+            logger.warning("Job %s for submission/user test %d running "
+                           "on worker %s (slot %s) for %s, dispatched "
+                           "again to worker %s (slot %s)." %
+                           (job[0], job[1], slot[0], slot[1], active_for,
+                            new_slot[0], new_slot[1]))
+        return True
+
     def submission_busy(self, submission_id):
         """Check if the submission has a related job in the queue or
         assigned to a worker.
@@ -866,7 +2688,8 @@ class EvaluationService(Service):
         """
         jobs = [(EvaluationService.JOB_TYPE_TEST_COMPILATION, user_test_id),
                 (EvaluationService.JOB_TYPE_TEST_EVALUATION, user_test_id)]
-        return any([job in self.queue or job in self.pool for job in jobs])
+        return any([job in self.test_queue or job in self.pool
+                    for job in jobs])
 
     def job_busy(self, job):
         """Check the entity (submission or user test) related to a job
@@ -882,11 +2705,19 @@ class EvaluationService(Service):
         else:
             raise Exception("Wrong job type %s" % (job[0]))
 
-    def push_in_queue(self, job, priority, timestamp):
+    def push_in_queue(self, job, priority, timestamp, user_id=None,
+                      task_id=None):
         """Push a job in the job queue if the submission is not
         already in the queue or assigned to a worker.
 
         job (job): a pair (job_type, submission_id) to push.
+        priority (int): the priority of the job.
+        timestamp (datetime): the timestamp of the job.
+        user_id (int): the id of the user of the submission (used in
+                       fair-share mode), or None if unknown.
+        task_id (int): the id of the task of the submission (used to
+                       estimate the cost of the job), or None if
+                       unknown.
 
         return (bool): True if pushed, False if not.
 
@@ -894,7 +2725,10 @@ class EvaluationService(Service):
         if self.job_busy(job):
             return False
         else:
-            self.queue.push(job, priority, timestamp)
+            self.get_queue(job).push(
+                job, priority, timestamp, user_id,
+                self.costs.estimate(job[0], task_id))
+            self.journal.add(job, priority, timestamp)
             return True
 
     @rpc_callback
@@ -902,11 +2736,15 @@ class EvaluationService(Service):
         """Callback from a worker, to signal that is finished some
         action (compilation or evaluation).
 
-        data (dict): a dictionary that describes a Job instance.
+        data (dict): a dictionary that describes a Job instance, or,
+                     for a fused job, a dictionary with the
+                     compilation job ('compilation') and the
+                     evaluation job ('evaluation', None if not
+                     performed).
         plus (tuple): the tuple (job_type,
                                  object_id,
                                  side_data=(priority, timestamp),
-                                 shard_of_worker)
+                                 (shard_of_worker, slot))
 
         """
         # TODO - The next two comments are in the wrong place and
@@ -916,12 +2754,21 @@ class EvaluationService(Service):
         # replied with an error), but if the pool wants to disable the
         # worker, it's because it already assigned its job to someone
         # else, so we discard the data from the worker.
-        job_type, object_id, side_data, shard = plus
+        job_type, object_id, side_data, slot = plus
+
+        ignored = self.pool.release_worker(slot)
+
+        # If the slot is reserved for a job, it has its files by now,
+        # so we do not wait for the next dispatch to assign it.
+        if self.pool.is_reserved(slot):
+            self.dispatch_jobs()
 
         # If worker was ignored, do nothing.
-        if self.pool.release_worker(shard):
+        if ignored:
             return
 
+        job = None
+        evaluation_job = None
         job_success = True
         if error is not None:
             logger.error("Received error from Worker: `%s'." % error)
@@ -929,22 +2776,66 @@ class EvaluationService(Service):
 
         else:
             try:
+                if data['type'] == 'fused':
+                    if data['evaluation'] is not None:
+                        evaluation_job = Job.import_from_dict_with_type(
+                            data['evaluation'])
+                    data = data['compilation']
                 job = Job.import_from_dict_with_type(data)
+                for job_ in [job, evaluation_job]:
+                    if job_ is not None and job_.task_version is not None:
+                        self.check_task_version(job_.task_id,
+                                                job_.task_version)
+                        job_.set_task_description(
+                            self.get_task_description(job_.task_id))
             except:
                 logger.error("[action_finished] Couldn't build Job for data"
                              " %s." % (data))
                 job_success = False
 
             else:
+                # Now the worker has in its cache the files of the job.
+                digests = job.get_input_digests()
+                if isinstance(job, CompilationJob):
+                    digests += [executable.digest for executable
+                                in job.executables.itervalues()]
+                if evaluation_job is not None:
+                    digests += evaluation_job.get_input_digests()
+                self.pool.add_cached_files(slot[0], digests)
+
                 if not job.success:
-                    logger.error("Worker %s signaled action "
-                                 "not successful." % shard)
+                    logger.error("Worker %s (slot %s) signaled action "
+                                 "not successful." % slot)
                     job_success = False
 
-        _, timestamp = side_data
+        priority, timestamp = side_data
+        rejudge = priority == EvaluationService.JOB_PRIORITY_REJUDGE
+
+        # If the evaluation was split in chunks, we write the results
+        # only when all of them have ended.
+        if job_type == EvaluationService.JOB_TYPE_EVALUATION and \
+                object_id in self.split_evaluations:
+            ended, job_success, job = self.split_evaluation_chunk_ended(
+                object_id, slot, job_success, job)
+            if not ended:
+                logger.info("Chunk of the evaluation of submission %s "
+                            "completed." % object_id)
+                return
+
+        # If the job has been dispatched again because it was too
+        # slow, the first successful result wins and the other copy
+        # is ignored; a failure is dropped while the other copy may
+        # still succeed.
+        if (job_type, object_id) in self.pool:
+            if not job_success:
+                logger.info("Action %s for submission %s failed, waiting "
+                            "for the other copy." % (job_type, object_id))
+                return
+            self.pool.ignore_job((job_type, object_id))
 
         logger.info("Action %s for submission %s completed. Success: %s." %
                     (job_type, object_id, job_success))
+        self.journal.remove((job_type, object_id))
 
         # We get the submission from DB and update it.
         with SessionGen(commit=False) as session:
@@ -960,17 +2851,34 @@ class EvaluationService(Service):
                 submission.compilation_tries += 1
 
                 if job_success:
+                    self.costs.record(job_type, submission.task_id, job)
                     submission.compilation_outcome = 'ok' \
                         if job.compilation_success else 'fail'
                     submission.compilation_text = job.text
                     submission.compilation_shard = job.shard
                     submission.compilation_sandbox = ":".join(job.sandboxes)
+                    # Only deterministic outcomes are reused.
+                    submission.compilation_key = job.get_cache_key() \
+                        if job.is_cacheable() else None
                     for executable in job.executables.itervalues():
                         submission.executables[executable.filename] = \
                             executable
                         session.add(executable)
 
-                self.compilation_ended(submission)
+                # A fused job also brings the evaluation, so we go on
+                # as if it was an evaluation that ended.
+                if evaluation_job is not None and \
+                        submission.compilation_outcome == "ok":
+                    submission.evaluation_tries += 1
+                    if evaluation_job.success:
+                        self.costs.record(
+                            EvaluationService.JOB_TYPE_EVALUATION,
+                            submission.task_id, evaluation_job)
+                        self.store_evaluations(submission, evaluation_job,
+                                               session)
+                    self.evaluation_ended(submission, rejudge)
+                else:
+                    self.compilation_ended(submission, rejudge)
 
             elif job_type == EvaluationService.JOB_TYPE_EVALUATION:
                 submission = Submission.get_from_id(object_id, session)
@@ -983,23 +2891,10 @@ class EvaluationService(Service):
                 submission.evaluation_tries += 1
 
                 if job_success:
-                    submission.evaluation_outcome = "ok"
-                    for test_number, info in job.evaluations.iteritems():
-                        evaluation = Evaluation(
-                            num=int(test_number),
-                            text=info['text'],
-                            outcome=info['outcome'],
-                            memory_used=info['plus'].get('memory_used', None),
-                            execution_time=info['plus']
-                            .get('execution_time', None),
-                            execution_wall_clock_time=info['plus']
-                            .get('execution_wall_clock_time', None),
-                            evaluation_shard=job.shard,
-                            evaluation_sandbox=":".join(info['sandboxes']),
-                            submission=submission)
-                        session.add(evaluation)
-
-                self.evaluation_ended(submission)
+                    self.costs.record(job_type, submission.task_id, job)
+                    self.store_evaluations(submission, job, session)
+
+                self.evaluation_ended(submission, rejudge)
 
             elif job_type == EvaluationService.JOB_TYPE_TEST_COMPILATION:
                 user_test = UserTest.get_from_id(object_id, session)
@@ -1012,6 +2907,7 @@ class EvaluationService(Service):
                 user_test.compilation_tries += 1
 
                 if job_success:
+                    self.costs.record(job_type, user_test.task_id, job)
                     user_test.compilation_outcome = 'ok' \
                         if job.compilation_success else 'fail'
                     user_test.compilation_text = job.text
@@ -1024,7 +2920,20 @@ class EvaluationService(Service):
                             ut_executable
                         session.add(ut_executable)
 
-                self.user_test_compilation_ended(user_test)
+                # A fused job also brings the evaluation, so we go on
+                # as if it was an evaluation that ended.
+                if evaluation_job is not None and \
+                        user_test.compilation_outcome == "ok":
+                    user_test.evaluation_tries += 1
+                    if evaluation_job.success:
+                        self.costs.record(
+                            EvaluationService.JOB_TYPE_TEST_EVALUATION,
+                            user_test.task_id, evaluation_job)
+                        self.store_user_test_evaluation(user_test,
+                                                        evaluation_job)
+                    self.user_test_evaluation_ended(user_test)
+                else:
+                    self.user_test_compilation_ended(user_test)
 
             elif job_type == EvaluationService.JOB_TYPE_TEST_EVALUATION:
                 user_test = UserTest.get_from_id(object_id, session)
@@ -1037,24 +2946,9 @@ class EvaluationService(Service):
                 user_test.evaluation_tries += 1
 
                 if job_success:
-                    try:
-                        [evaluation] = job.evaluations.values()
-                    except ValueError:
-                        logger.error("[action_finished] I expected the job "
-                                     "for a user test to contain a single "
-                                     "evaluation, while instead it has %d."
-                                     % (len(job.evaluations.values())))
+                    self.costs.record(job_type, user_test.task_id, job)
+                    if not self.store_user_test_evaluation(user_test, job):
                         return
-                    user_test.evaluation_outcome = 'ok'
-                    user_test.evaluation_shard = job.shard
-                    user_test.output = evaluation['output']
-                    user_test.evaluation_text = evaluation['text']
-                    user_test.evaluation_sandbox = \
-                        ":".join(evaluation['sandboxes'])
-                    user_test.memory_used = evaluation['plus']. \
-                        get('memory_used', None),
-                    user_test.execution_time = evaluation['plus'] \
-                        .get('execution_time', None),
 
                 self.user_test_evaluation_ended(user_test)
 
@@ -1064,7 +2958,248 @@ class EvaluationService(Service):
 
             session.commit()
 
-    def compilation_ended(self, submission):
+    @rpc_method
+    def testcase_evaluated(self, shard, slot, job_key, test_number,
+                           evaluated, total, evaluation=None):
+        """RPC called by a worker as soon as it evaluates a testcase
+        of a job (see config.evaluation_progress). The job is alive,
+        and, if it is the evaluation of a submission, we store the
+        result straight away, so that it is not lost if the worker
+        dies and contestants see how far the evaluation is.
+
+        shard (int): the shard of the worker.
+        slot (int): the slot of the worker doing the job.
+        job_key (list): the job, as [job_type, object_id].
+        test_number (int): the index of the testcase.
+        evaluated (int): the number of testcases of the job evaluated
+                         so far.
+        total (int): the number of testcases of the job.
+        evaluation (dict): the evaluation of the testcase, in the
+                           format of EvaluationJob.evaluations, or
+                           None for user tests.
+
+        """
+        job_type, object_id = job_key
+        if not self.pool.record_progress((shard, slot),
+                                         (job_type, object_id),
+                                         evaluated, total):
+            return
+        if evaluation is None or \
+                job_type != EvaluationService.JOB_TYPE_EVALUATION:
+            return
+
+        with SessionGen(commit=False) as session:
+            submission = Submission.get_from_id(object_id, session)
+            if submission is None or submission.evaluated():
+                return
+            # Another copy of the job (see check_stragglers) may have
+            # already sent the same testcase.
+            if any(stored.num == test_number
+                   for stored in submission.evaluations):
+                return
+            session.add(self.build_evaluation(submission, test_number,
+                                              evaluation, shard))
+            session.commit()
+
+    def store_evaluations(self, submission, job, session):
+        """Write in the database the results of a successful
+        evaluation of a submission.
+
+        submission (Submission): the submission.
+        job (EvaluationJob): the job, as returned by the worker.
+        session (Session): the session to use.
+
+        """
+        submission.evaluation_outcome = "ok"
+        # Some testcases may have been stored already, as the worker
+        # evaluated them (see testcase_evaluated).
+        stored = set(evaluation.num for evaluation in submission.evaluations)
+        for test_number, info in job.evaluations.iteritems():
+            if int(test_number) in stored:
+                continue
+            session.add(self.build_evaluation(
+                submission, int(test_number), info,
+                info.get('shard', job.shard)))
+
+    def build_evaluation(self, submission, test_number, info, shard):
+        """Build the Evaluation of a testcase of a submission.
+
+        submission (Submission): the submission.
+        test_number (int): the index of the testcase.
+        info (dict): the evaluation of the testcase, in the format of
+                     EvaluationJob.evaluations.
+        shard (int): the worker that evaluated the testcase.
+
+        return (Evaluation): the evaluation.
+
+        """
+        return Evaluation(
+            num=test_number,
+            text=info['text'],
+            outcome=info['outcome'],
+            memory_used=info['plus'].get('memory_used', None),
+            execution_time=info['plus']
+            .get('execution_time', None),
+            execution_wall_clock_time=info['plus']
+            .get('execution_wall_clock_time', None),
+            evaluation_shard=shard,
+            evaluation_sandbox=":".join(info['sandboxes']),
+            worker_speed_index=info.get('speed_index'),
+            submission=submission)
+
+    def store_user_test_evaluation(self, user_test, job):
+        """Write in the database the results of a successful
+        evaluation of a user test.
+
+        user_test (UserTest): the user test.
+        job (EvaluationJob): the job, as returned by the worker.
+
+        return (bool): False if the job is malformed.
+
+        """
+        try:
+            [evaluation] = job.evaluations.values()
+        except ValueError:
+            logger.error("[action_finished] I expected the job "
+                         "for a user test to contain a single "
+                         "evaluation, while instead it has %d."
+                         % (len(job.evaluations.values())))
+            return False
+        user_test.evaluation_outcome = 'ok'
+        user_test.evaluation_shard = job.shard
+        user_test.output = evaluation['output']
+        user_test.evaluation_text = evaluation['text']
+        user_test.evaluation_sandbox = \
+            ":".join(evaluation['sandboxes'])
+        user_test.memory_used = evaluation['plus']. \
+            get('memory_used', None),
+        user_test.execution_time = evaluation['plus'] \
+            .get('execution_time', None),
+        return True
+
+    @rpc_callback
+    def precache_finished(self, data, plus, error=None):
+        """Callback from a worker, to signal that it finished
+        precaching the files of the contest.
+
+        data (dict): the size of each file in the cache of the
+                     worker, indexed by digest.
+        plus (int): the shard of the worker.
+
+        """
+        if error is not None:
+            logger.warning("Worker %s failed to precache files: `%s'." %
+                           (plus, error))
+            return
+        self.pool.set_cached_files(plus, data)
+
+    @rpc_callback
+    def prefetch_finished(self, data, plus, error=None):
+        """Callback from a worker, to signal that it downloaded the
+        files of a job it is reserved for.
+
+        data (list): the digests of the files downloaded.
+        plus (int): the shard of the worker.
+
+        """
+        if error is not None:
+            logger.warning("Worker %s failed to prefetch files: `%s'." %
+                           (plus, error))
+            return
+        self.pool.add_cached_files(plus, data)
+
+    def get_task_description(self, task_id, session=None):
+        """Return the data of a task needed by its jobs (see
+        describe_task), from our cache or, the first time, from the
+        database.
+
+        task_id (int): the id of the task.
+        session (Session): the session to use, or None to use a new
+                           one.
+
+        return (dict): the data of the task.
+
+        raise: KeyError if the task does not exist.
+
+        """
+        if task_id not in self.task_descriptions:
+            if session is None:
+                with SessionGen(commit=False) as session:
+                    return self.get_task_description(task_id, session)
+            task = Task.get_from_id(task_id, session)
+            if task is None:
+                raise KeyError("Task %s not found." % task_id)
+            self.task_descriptions[task_id] = describe_task(task)
+        return self.task_descriptions[task_id]
+
+    def check_task_version(self, task_id, version):
+        """Forget what we know about a task if a worker used another
+        version of it: the worker reads the task from the database
+        when the version in the job is not the current one, so this
+        means that the task has been modified without telling us
+        (e.g., by an importer).
+
+        task_id (int): the id of the task.
+        version (string): the version used by the worker.
+
+        """
+        description = self.task_descriptions.get(task_id)
+        if description is not None and description['version'] != version:
+            logger.info("Task %s changed, reading it again." % task_id)
+            self.task_changed(task_id)
+
+    def check_task_descriptions(self, session):
+        """Read again from the database the tasks we know, and replace
+        the data of the ones that have been modified without telling
+        us (e.g., by an importer); the workers read them again when
+        they receive the jobs with the new version.
+
+        session (Session): the session to use.
+
+        """
+        for task_id in self.task_descriptions.keys():
+            task = Task.get_from_id(task_id, session)
+            if task is None:
+                self.task_changed(task_id)
+                continue
+            description = describe_task(task)
+            if description['version'] != \
+                    self.task_descriptions[task_id]['version']:
+                logger.info("Task %s changed, using its new version." %
+                            task_id)
+                self.task_descriptions[task_id] = description
+
+    @rpc_method
+    def task_changed(self, task_id=None):
+        """Forget what we know about a task, because it has been
+        modified. Who modifies a task should call this, otherwise we
+        notice it only at the next full search of the jobs not done
+        (see check_task_descriptions).
+
+        task_id (int): the id of the task, or None for all of them.
+
+        """
+        if task_id is None:
+            self.task_descriptions.clear()
+        else:
+            self.task_descriptions.pop(task_id, None)
+
+    @rpc_callback
+    def capabilities_received(self, data, plus, error=None):
+        """Callback from a worker, to tell us what it can do.
+
+        data (dict): the capabilities of the worker (see
+                     Worker.get_capabilities).
+        plus (int): the shard of the worker.
+
+        """
+        if error is not None:
+            logger.warning("Worker %s failed to report its capabilities: "
+                           "`%s'." % (plus, error))
+            return
+        self.pool.set_capabilities(plus, data)
+
+    def compilation_ended(self, submission, rejudge=False):
         """Actions to be performed when we have a submission that has
         ended compilation . In particular: we queue evaluation if
         compilation was ok, we inform ScoringService if the
@@ -1072,14 +3207,23 @@ class EvaluationService(Service):
         requeue the compilation if there was an error in CMS.
 
         submission (Submission): the submission.
+        rejudge (bool): whether the compilation was part of a
+                        rejudge, so that the next jobs keep its
+                        priority.
 
         """
         # Compilation was ok, so we evaluate.
         if submission.compilation_outcome == "ok":
             self.push_in_queue((EvaluationService.JOB_TYPE_EVALUATION,
                                 submission.id),
-                               EvaluationService.JOB_PRIORITY_MEDIUM,
-                               submission.timestamp)
+                               EvaluationService.JOB_PRIORITY_REJUDGE
+                               if rejudge else
+                               self.boost_priority(
+                                   submission,
+                                   EvaluationService.JOB_PRIORITY_MEDIUM),
+                               submission.timestamp,
+                               submission.user_id,
+                               submission.task_id)
         # If instead submission failed compilation, we don't evaluate,
         # but we inform ScoringService of the new submission. We need
         # to commit before so it has up to date information.
@@ -1100,19 +3244,25 @@ class EvaluationService(Service):
                 # compilations that are probably failing again.
                 self.push_in_queue((EvaluationService.JOB_TYPE_COMPILATION,
                                     submission.id),
+                                   EvaluationService.JOB_PRIORITY_REJUDGE
+                                   if rejudge else
                                    EvaluationService.JOB_PRIORITY_MEDIUM,
-                                   submission.timestamp)
+                                   submission.timestamp,
+                                   submission.user_id,
+                                   submission.task_id)
         # Otherwise, error.
         else:
             logger.error("Compilation outcome %r not recognized." %
                          submission.compilation_outcome)
 
-    def evaluation_ended(self, submission):
+    def evaluation_ended(self, submission, rejudge=False):
         """Actions to be performed when we have a submission that has
         been evaluated. In particular: we inform ScoringService on
         success, we requeue on failure.
 
         submission (Submission): the submission.
+        rejudge (bool): whether the evaluation was part of a rejudge,
+                        so that it is requeued with the same priority.
 
         """
         # Evaluation successful, we inform ScoringService so it can
@@ -1133,8 +3283,12 @@ class EvaluationService(Service):
             # evaluations that are probably failing again.
             self.push_in_queue((EvaluationService.JOB_TYPE_EVALUATION,
                                 submission.id),
+                               EvaluationService.JOB_PRIORITY_REJUDGE
+                               if rejudge else
                                EvaluationService.JOB_PRIORITY_LOW,
-                               submission.timestamp)
+                               submission.timestamp,
+                               submission.user_id,
+                               submission.task_id)
 
     def user_test_compilation_ended(self, user_test):
         """Actions to be performed when we have a user test that has
@@ -1149,7 +3303,9 @@ class EvaluationService(Service):
             self.push_in_queue((EvaluationService.JOB_TYPE_TEST_EVALUATION,
                                 user_test.id),
                                EvaluationService.JOB_PRIORITY_MEDIUM,
-                               user_test.timestamp)
+                               user_test.timestamp,
+                               user_test.user_id,
+                               user_test.task_id)
         # If instead user test failed compilation, we don't evaluatate
         elif user_test.compilation_outcome == 'fail':
             logger.info("User test %d did not compile. Not going "
@@ -1168,7 +3324,9 @@ class EvaluationService(Service):
                                     JOB_TYPE_TEST_COMPILATION,
                                     user_test.id),
                                    EvaluationService.JOB_PRIORITY_MEDIUM,
-                                   user_test.timestamp)
+                                   user_test.timestamp,
+                                   user_test.user_id,
+                                   user_test.task_id)
 
     def user_test_evaluation_ended(self, user_test):
         """Actions to be performed when we have a user test that has
@@ -1190,7 +3348,32 @@ class EvaluationService(Service):
                 self.push_in_queue((EvaluationService.JOB_TYPE_TEST_EVALUATION,
                                     user_test.id),
                                    EvaluationService.JOB_PRIORITY_LOW,
-                                   user_test.timestamp)
+                                   user_test.timestamp,
+                                   user_test.user_id,
+                                   user_test.task_id)
+
+    def boost_priority(self, submission, priority):
+        """Return the priority to give to a job of a submission: if
+        enabled, the first submission of a user on a task gets a
+        higher one, to give a quick feedback.
+
+        submission (Submission): the submission of the job.
+        priority (int): the usual priority of the job.
+
+        return (int): the priority to use.
+
+        """
+        if not config.first_submission_boost:
+            return priority
+        previous = submission.sa_session\
+            .query(func.count(Submission.id))\
+            .filter(Submission.user_id == submission.user_id)\
+            .filter(Submission.task_id == submission.task_id)\
+            .filter(Submission.id < submission.id).scalar()
+        if previous == 0:
+            return max(priority - 1,
+                       EvaluationService.JOB_PRIORITY_EXTRA_HIGH)
+        return priority
 
     @rpc_method
     def new_submission(self, submission_id):
@@ -1213,8 +3396,12 @@ class EvaluationService(Service):
             if to_compile(submission):
                 self.push_in_queue((EvaluationService.JOB_TYPE_COMPILATION,
                                     submission_id),
-                                   EvaluationService.JOB_PRIORITY_HIGH,
-                                   submission.timestamp)
+                                   self.boost_priority(
+                                       submission,
+                                       EvaluationService.JOB_PRIORITY_HIGH),
+                                   submission.timestamp,
+                                   submission.user_id,
+                                   submission.task_id)
 
     @rpc_method
     def new_user_test(self, user_test_id):
@@ -1239,7 +3426,9 @@ class EvaluationService(Service):
                                     JOB_TYPE_TEST_COMPILATION,
                                     user_test_id),
                                    EvaluationService.JOB_PRIORITY_HIGH,
-                                   user_test.timestamp)
+                                   user_test.timestamp,
+                                   user_test.user_id,
+                                   user_test.task_id)
 
     @rpc_method
     def invalidate_submission(self,
@@ -1258,6 +3447,13 @@ class EvaluationService(Service):
         currently enqueued are deleted, and the one already assigned
         to the workers are ignored. New appropriate jobs are enqueued.
 
+        The data are always cleared immediately. The jobs of a single
+        submission are queued immediately too; the ones of many
+        submissions are a rejudge, queued in chunks in the background
+        (see rejudge_step) with the lowest priority. Since the data
+        are already cleared, if we are restarted in the middle of a
+        rejudge the search for the jobs not done finds the rest.
+
         submission_id (int): id of the submission to invalidate, or
                              None.
         user_id (int): id of the user we want to invalidate, or None.
@@ -1271,6 +3467,10 @@ class EvaluationService(Service):
             logger.error(err_msg)
             raise ValueError(err_msg)
 
+        # Probably the task has been changed, so we read it again.
+        if submission_id is None and user_id is None:
+            self.task_changed(task_id)
+
         submission_ids = get_submissions(
             self.contest_id,
             submission_id, user_id, task_id)
@@ -1280,6 +3480,65 @@ class EvaluationService(Service):
         if len(submission_ids) == 0:
             return
 
+        self.invalidate_submissions(submission_ids, level)
+
+        if submission_id is not None:
+            self.queue_invalidated_submissions(submission_ids, level)
+            return
+
+        # If the previous rejudge is over, we start counting again.
+        if len(self.rejudge_queue) == 0:
+            if self.queue.count_priority(
+                EvaluationService.JOB_PRIORITY_REJUDGE) == 0:
+                self.rejudge_total = 0
+            self.add_timeout(self.rejudge_step, None,
+                             EvaluationService.REJUDGE_STEP_TIME
+                             .total_seconds(),
+                             immediately=True)
+        self.rejudge_queue.extend((queued_id, level)
+                                  for queued_id in submission_ids)
+        self.rejudge_pending.update(submission_ids)
+        self.rejudge_total += len(submission_ids)
+
+    def rejudge_step(self):
+        """Queue the jobs of the next chunk of the submissions to
+        rejudge, unless there are already enough rejudge jobs in the
+        queue.
+
+        return (bool): True if there are other submissions whose jobs
+                       are to be queued.
+
+        """
+        if self.queue.count_priority(
+            EvaluationService.JOB_PRIORITY_REJUDGE) >= \
+            EvaluationService.REJUDGE_MAX_QUEUED:
+            return True
+
+        chunks = {"compilation": [], "evaluation": []}
+        for _ in xrange(min(EvaluationService.REJUDGE_CHUNK_SIZE,
+                            len(self.rejudge_queue))):
+            submission_id, level = self.rejudge_queue.popleft()
+            self.rejudge_pending.discard(submission_id)
+            chunks[level].append(submission_id)
+        for level, submission_ids in chunks.iteritems():
+            if len(submission_ids) > 0:
+                self.queue_invalidated_submissions(submission_ids, level,
+                                                   rejudge=True)
+
+        if len(self.rejudge_queue) == 0:
+            logger.info("All the jobs of the %d submissions to rejudge "
+                        "have been queued." % self.rejudge_total)
+            return False
+        return True
+
+    def invalidate_submissions(self, submission_ids, level):
+        """Invalidate some submissions with set-based queries, and
+        forget their jobs in the queue and in the pool.
+
+        submission_ids ([int]): the ids of the submissions.
+        level (string): 'compilation' or 'evaluation'.
+
+        """
         for submission_id in submission_ids:
             jobs = [(EvaluationService.JOB_TYPE_COMPILATION, submission_id),
                     (EvaluationService.JOB_TYPE_EVALUATION, submission_id)]
@@ -1292,29 +3551,62 @@ class EvaluationService(Service):
                     self.pool.ignore_job(job)
                 except LookupError:
                     pass  # Ok, the job wasn't in the pool.
+                self.journal.remove(job)
+                self.unverified_jobs.discard(job)
+            self.split_evaluations.pop(submission_id, None)
+            self.compilation_cache_misses.discard(submission_id)
 
-        # We invalidate the appropriate data and queue the jobs to
-        # recompute those data.
         with SessionGen(commit=True) as session:
-            for submission_id in submission_ids:
-                submission = Submission.get_from_id(submission_id, session)
-
-                if level == "compilation":
-                    submission.invalidate_compilation()
-                    if to_compile(submission):
-                        self.push_in_queue(
-                            (EvaluationService.JOB_TYPE_COMPILATION,
-                             submission_id),
-                            EvaluationService.JOB_PRIORITY_HIGH,
-                            submission.timestamp)
-                elif level == "evaluation":
-                    submission.invalidate_evaluation()
-                    if to_evaluate(submission):
-                        self.push_in_queue(
-                            (EvaluationService.JOB_TYPE_EVALUATION,
-                             submission_id),
-                            EvaluationService.JOB_PRIORITY_MEDIUM,
-                            submission.timestamp)
+            Submission.bulk_invalidate(session, submission_ids, level)
+
+    def queue_invalidated_submissions(self, submission_ids, level,
+                                      rejudge=False):
+        """Queue the jobs to recompute the data of some invalidated
+        submissions.
+
+        submission_ids ([int]): the ids of the submissions.
+        level (string): 'compilation' or 'evaluation'.
+        rejudge (bool): whether to queue the jobs with the rejudge
+                        priority instead of the usual one.
+
+        """
+        if level == "compilation":
+            job_type = EvaluationService.JOB_TYPE_COMPILATION
+            priority = EvaluationService.JOB_PRIORITY_HIGH
+            filter_to_do = filter_to_compile
+        else:
+            job_type = EvaluationService.JOB_TYPE_EVALUATION
+            priority = EvaluationService.JOB_PRIORITY_MEDIUM
+            filter_to_do = filter_to_evaluate
+        if rejudge:
+            priority = EvaluationService.JOB_PRIORITY_REJUDGE
+
+        with SessionGen(commit=False) as session:
+            submissions = filter_to_do(
+                session.query(Submission.id,
+                              Submission.timestamp,
+                              Submission.user_id,
+                              Submission.task_id)
+                .filter(Submission.id.in_(submission_ids)))
+            for submission_id, timestamp, user_id, task_id in submissions:
+                self.push_in_queue((job_type, submission_id),
+                                   priority, timestamp, user_id, task_id)
+
+    @rpc_method
+    def rejudge_status(self):
+        """Returns the progress of the current rejudge.
+
+        return (dict): the number of submissions to rejudge
+                       ('total'), of the ones whose jobs are still to
+                       be queued ('to_invalidate'), and of the rejudge
+                       jobs in the queue ('queued').
+
+        """
+        return {
+            "total": self.rejudge_total,
+            "to_invalidate": len(self.rejudge_queue),
+            "queued": self.queue.count_priority(
+                EvaluationService.JOB_PRIORITY_REJUDGE)}
 
 
 def main():
@@ -309,6 +309,9 @@ class ScoringService(Service):
     # How often we check for logs to be sent to LogServer
     FORWARD_LOG_TIME = 1.0
 
+    # How many submissions we invalidate with a single query.
+    INVALIDATE_CHUNK_SIZE = 500
+
     def __init__(self, shard, contest_id):
         logger.initialize(ServiceCoord("ScoringService", shard))
         Service.__init__(self, shard, custom_logger=logger)
@@ -789,17 +792,24 @@ class ScoringService(Service):
         if len(submission_ids) == 0:
             return
 
+        # If the submission is not evaluated, it does not have a score
+        # to invalidate, and, when evaluated, ScoringService will be
+        # prompted to score it. So in that case we do not have to do
+        # anything. We invalidate the others in chunks, without
+        # loading them.
         new_submission_ids = []
         with SessionGen(commit=True) as session:
-            for submission_id in submission_ids:
-                submission = Submission.get_from_id(submission_id, session)
-                # If the submission is not evaluated, it does not have
-                # a score to invalidate, and, when evaluated,
-                # ScoringService will be prompted to score it. So in
-                # that case we do not have to do anything.
-                if submission.evaluated():
-                    submission.invalidate_score()
-                    new_submission_ids.append(submission_id)
+            for i in xrange(0, len(submission_ids),
+                            ScoringService.INVALIDATE_CHUNK_SIZE):
+                chunk = submission_ids[
+                    i:i + ScoringService.INVALIDATE_CHUNK_SIZE]
+                evaluated_ids = [x.id for x in session
+                                 .query(Submission.id)
+                                 .filter(Submission.id.in_(chunk))
+                                 .filter(Submission.evaluation_outcome
+                                         != None)]
+                Submission.bulk_invalidate(session, evaluated_ids, "score")
+                new_submission_ids += evaluated_ids
 
         old_s = len(self.submission_ids_to_score)
         old_t = len(self.submission_ids_to_token)
@@ -19,17 +19,21 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
 import threading
 import traceback
+from collections import deque
 
-from cms import default_argument_parser, logger
+from cms import config, default_argument_parser, logger
 from cms.async import ServiceCoord
 from cms.async.AsyncLibrary import Service, rpc_method, rpc_threaded
-from cms.db.FileCacher import FileCacher
-from cms.db.SQLAlchemyAll import SessionGen, Contest
-from cms.grading import JobException
+from cms.db.FileCacher import FileCacher, MemoryTier
+from cms.db.SQLAlchemyAll import SessionGen, Contest, Submission, Task
+from cms.grading import JobException, get_compilation_command
+from cms.grading.Calibration import run_calibration, get_speed_index
+from cms.grading.Sandbox import PROVISIONING_METHODS, check_box_cpus
 from cms.grading.tasktypes import get_task_type
-from cms.grading.Job import Job
+from cms.grading.Job import Job, EvaluationJob, describe_task
 
 
 class Worker(Service):
@@ -43,29 +47,198 @@ class Worker(Service):
     JOB_TYPE_COMPILATION = "compile"
     JOB_TYPE_EVALUATION = "evaluate"
 
+    # How often (in seconds) we send to ES the testcases evaluated.
+    PROGRESS_REPORT_TIME = 0.5
+
     def __init__(self, shard):
         logger.initialize(ServiceCoord("Worker", shard))
         Service.__init__(self, shard, custom_logger=logger)
         self.file_cacher = FileCacher(self)
+        if config.sandbox_provisioning not in PROVISIONING_METHODS:
+            logger.warning("Unknown sandbox provisioning method `%s', "
+                           "files will be copied." %
+                           config.sandbox_provisioning)
+        if config.memory_cache_size > 0:
+            self.file_cacher.memory_tier = MemoryTier(
+                os.path.join(config.memory_cache_dir,
+                             "fs-cache-Worker-%d" % shard),
+                config.memory_cache_size * 2 ** 20)
 
-        self.task_type = None
-        self.work_lock = threading.Lock()
+        # Each slot can execute a job at the same time as the others,
+        # in its own sandboxes, which must not share their CPUs.
+        self.slots = max(config.worker_slots, 1)
+        check_box_cpus(self._my_coord)
+        self.task_types = [None] * self.slots
+        self.work_locks = [threading.Lock() for _ in xrange(self.slots)]
         self.session = None
 
+        # The data of the tasks needed by their jobs, by task id (see
+        # fill_task_description). They are read again when ES sends a
+        # job with another version of the task, as it checks them
+        # (see EvaluationService.check_task_descriptions).
+        self.task_descriptions = {}
+        self.task_descriptions_lock = threading.Lock()
+
+        # We tell ES the testcases we evaluate as soon as they end.
+        # The jobs run in other threads, while the connection to ES
+        # can be used only by the main loop, so the reports are
+        # queued and sent from there.
+        self.evaluation_service = None
+        self.progress_reports = deque()
+        self.progress_reports_lock = threading.Lock()
+        if config.evaluation_progress:
+            self.evaluation_service = self.connect_to(
+                ServiceCoord("EvaluationService", 0))
+            self.add_timeout(self.send_progress_reports, None,
+                             Worker.PROGRESS_REPORT_TIME,
+                             immediately=False)
+
+        # The times of the calibration benchmarks and the speed index
+        # computed from them, when known.
+        self.calibration = None
+        self.speed_index = None
+        # Held for the whole calibration, so that jobs arriving in the
+        # meantime wait for their slots instead of being refused.
+        self.calibration_lock = threading.Lock()
+        self.calibrating = False
+        if config.worker_calibration:
+            self.add_timeout(self.calibrate, None,
+                             max(config.worker_calibration_interval, 1),
+                             immediately=True)
+
+    def calibrate(self):
+        """Start the calibration benchmarks in another thread, if the
+        worker is not doing anything, and reschedule them if so
+        configured.
+
+        """
+        threading.Thread(target=self.run_calibration).start()
+        return config.worker_calibration_interval > 0
+
+    def run_calibration(self):
+        """Run the calibration benchmarks, holding all the slots so
+        that no job disturbs the measures (or is disturbed).
+
+        """
+        with self.calibration_lock:
+            self.calibrating = True
+            acquired = []
+            try:
+                for lock in self.work_locks:
+                    if not lock.acquire(False):
+                        logger.info("Worker busy, calibration postponed.")
+                        return
+                    acquired.append(lock)
+                logger.info("Starting calibration.")
+                try:
+                    times = run_calibration(self.file_cacher)
+                except Exception:
+                    logger.error("Calibration failed.\n%s" %
+                                 traceback.format_exc())
+                    return
+                if times is not None:
+                    self.calibration = times
+                    self.speed_index = get_speed_index(times)
+                    logger.info("Calibration finished, speed index "
+                                "%.3f %s." % (self.speed_index, times))
+            finally:
+                for lock in acquired:
+                    lock.release()
+                self.calibrating = False
+
     @rpc_method
-    def ignore_job(self):
+    def ignore_job(self, slot=None):
         """RPC that inform the worker that its result for the current
         action will be discarded. The worker will try to return as
         soon as possible even if this means that the result are
         inconsistent.
 
+        slot (int): the slot whose job is to be ignored, or None for
+                    all of them.
+
         """
         # We inform the task_type to quit as soon as possible.
         logger.info("Trying to interrupt job as requested.")
+        if slot is None:
+            slots = xrange(self.slots)
+        else:
+            slots = [slot]
+        for slot in slots:
+            try:
+                self.task_types[slot].ignore_job = True
+            except (AttributeError, IndexError):
+                pass  # Job concluded right under our nose, that's ok too.
+
+    @rpc_method
+    def get_capabilities(self):
+        """RPC to ask the worker what it is able to do, so that ES can
+        route to it only the jobs it can execute.
+
+        return (dict): the languages the worker can compile
+                       ('languages'), its CPU model ('cpu_model'), its
+                       hardware class ('hardware_class', the CPU model
+                       unless configured), its relative speed
+                       ('speed', None if not calibrated yet), the
+                       times of the calibration benchmarks
+                       ('calibration'), its memory in MiB
+                       ('memory', None if unknown) and its number of
+                       slots ('slots').
+
+        """
+        languages = []
+        for language in Submission.LANGUAGES:
+            compiler = get_compilation_command(language, ["source"],
+                                               "executable")[0]
+            if os.path.exists(compiler):
+                languages.append(language)
+
+        cpu_model = None
+        memory = None
         try:
-            self.task_type.ignore_job = True
-        except AttributeError:
-            pass  # Job concluded right under our nose, that's ok too.
+            with open("/proc/cpuinfo") as cpuinfo:
+                for line in cpuinfo:
+                    if line.startswith("model name"):
+                        cpu_model = line.split(":", 1)[1].strip()
+                        break
+            with open("/proc/meminfo") as meminfo:
+                for line in meminfo:
+                    if line.startswith("MemTotal:"):
+                        memory = int(line.split()[1]) // 1024
+                        break
+        except IOError:
+            pass  # Not on Linux, we just don't know.
+
+        return {"languages": languages,
+                "cpu_model": cpu_model,
+                "hardware_class": config.worker_hardware_class or cpu_model,
+                "speed": self.speed_index,
+                "calibration": self.calibration,
+                "memory": memory,
+                "slots": self.slots}
+
+    @rpc_method
+    @rpc_threaded
+    def prefetch_files(self, digests):
+        """RPC to ask the worker to download in its cache the files
+        of the job it will receive next, while it finishes the current
+        one.
+
+        digests (list): the digests of the files.
+
+        return (list): the digests of the files now in the cache.
+
+        """
+        fetched = []
+        for digest in digests:
+            try:
+                self.file_cacher.get_file(digest)
+            except Exception:
+                logger.warning("Couldn't prefetch file %s.\n%s" %
+                               (digest, traceback.format_exc()))
+            else:
+                fetched.append(digest)
+        logger.info("Prefetched %d files." % len(fetched))
+        return fetched
 
     # FIXME - rpc_threaded is disable because it makes the call fail:
     # we should investigate on this
@@ -76,6 +249,9 @@ class Worker(Service):
 
         contest_id (int): the id of the contest
 
+        return (dict): the size of each file in the cache of the
+                       worker, indexed by digest.
+
         """
         # Lock is not needed if the admins correctly placed cache and
         # temp directories in the same filesystem. This is what
@@ -87,44 +263,256 @@ class Worker(Service):
             for digest in contest.enumerate_files(skip_submissions=True,
                                                   skip_user_tests=True):
                 self.file_cacher.get_file(digest)
+
+            # The testcases are the files we use the most, so they go
+            # in memory first.
+            if self.file_cacher.memory_tier is not None:
+                for task in contest.tasks:
+                    for testcase in task.testcases:
+                        self.file_cacher.preload(testcase.input)
+                        self.file_cacher.preload(testcase.output)
+                logger.info("Memory tier of the cache: %s." %
+                            self.file_cacher.memory_tier.get_status())
         logger.info("Precaching finished.")
+        return self.file_cacher.list_cache()
+
+    @rpc_method
+    def memory_cache_status(self):
+        """RPC to ask the worker the statistics of the memory tier of
+        its cache.
+
+        return (dict): the statistics (see MemoryTier.get_status), or
+                       None if the worker has no memory tier.
+
+        """
+        if self.file_cacher.memory_tier is None:
+            return None
+        return self.file_cacher.memory_tier.get_status()
 
     @rpc_method
     @rpc_threaded
-    def execute_job(self, job_dict):
+    def execute_job(self, job_dict, slot=0, job_key=None):
+        """RPC to ask the worker to execute a job in one of its slots.
+
+        job_dict (dict): the job to execute, as exported by Job.
+        slot (int): the slot that has to execute the job.
+        job_key (list): how ES identifies the job, to be sent back
+                        with the testcases evaluated (see
+                        report_testcase).
+
+        return (dict): the job, filled with the results.
+
+        """
         job = Job.import_from_dict_with_type(job_dict)
 
-        if self.work_lock.acquire(False):
+        self.acquire_slot(job, slot)
+        try:
+            self.fill_task_description(job)
+            self.run_job(job, slot, job_key)
+            return job.export_to_dict()
+        finally:
+            self.work_locks[slot].release()
 
-            try:
-                logger.operation = "job '%s'" % (job.info)
-                logger.info("Request received")
-                job.shard = self.shard
+    @rpc_method
+    @rpc_threaded
+    def execute_fused_job(self, compilation_job_dict, evaluation_job_dict,
+                          slot=0, job_key=None):
+        """RPC to ask the worker to compile and, if the compilation
+        succeeds, to evaluate straight away in the same slot, with the
+        executables just compiled (that are already in our cache).
 
-                self.task_type = get_task_type(job, self.file_cacher)
-                self.task_type.execute_job()
-                logger.info("Request finished.")
+        compilation_job_dict (dict): the compilation job to execute,
+                                     as exported by Job.
+        evaluation_job_dict (dict): the evaluation job to execute
+                                    after it, without executables.
+        slot (int): the slot that has to execute the jobs.
+        job_key (list): how ES identifies the job, to be sent back
+                        with the testcases evaluated (see
+                        report_testcase).
 
-                return job.export_to_dict()
+        return (dict): the compilation job ('compilation') and the
+                       evaluation job ('evaluation', None if it was
+                       not performed), filled with the results.
 
-            except:
-                err_msg = "Worker failed on operation `%s'" % logger.operation
-                logger.error("%s\n%s" % (err_msg, traceback.format_exc()))
-                raise JobException(err_msg)
+        """
+        compilation_job = Job.import_from_dict_with_type(
+            compilation_job_dict)
+        evaluation_job = Job.import_from_dict_with_type(evaluation_job_dict)
 
-            finally:
-                self.task_type = None
-                self.session = None
-                logger.operation = ""
-                self.work_lock.release()
+        self.acquire_slot(compilation_job, slot)
+        try:
+            self.fill_task_description(compilation_job)
+            self.fill_task_description(evaluation_job)
+            self.run_job(compilation_job, slot)
+            evaluation_dict = None
+            if compilation_job.success and \
+                    compilation_job.compilation_success:
+                evaluation_job.executables = \
+                    dict(compilation_job.executables)
+                self.run_job(evaluation_job, slot, job_key)
+                evaluation_dict = evaluation_job.export_to_dict()
+            return {'type': 'fused',
+                    'compilation': compilation_job.export_to_dict(),
+                    'evaluation': evaluation_dict}
+        finally:
+            self.work_locks[slot].release()
 
-        else:
+    def acquire_slot(self, job, slot):
+        """Take a slot to execute a job, if it exists and it is not
+        doing anything else.
+
+        job (Job): the job to execute.
+        slot (int): the slot.
+
+        raise: JobException if the slot cannot be taken.
+
+        """
+        if not 0 <= slot < self.slots:
+            err_msg = "Request '%s' received, " \
+                "but declined because of invalid slot %s" % \
+                (job.info, slot)
+            logger.warning(err_msg)
+            raise JobException(err_msg)
+
+        acquired = self.work_locks[slot].acquire(False)
+        if not acquired:
+            # The slot may be held by the calibration, that is short:
+            # we wait for it to end rather than refusing the job (that
+            # ES would count as a failed try).
+            if self.calibrating:
+                logger.info("Request '%s' waiting for the calibration "
+                            "to end." % job.info)
+                with self.calibration_lock:
+                    pass
+            acquired = self.work_locks[slot].acquire(False)
+        if not acquired:
             err_msg = "Request '%s' received, " \
                 "but declined because of acquired lock" % \
                 (job.info)
             logger.warning(err_msg)
             raise JobException(err_msg)
 
+    def fill_task_description(self, job):
+        """If the job refers to the data of its task instead of
+        carrying them, fill it with them, taking them from our cache
+        or, the first time we see that version of the task, from the
+        database.
+
+        job (Job): the job.
+
+        raise: JobException if the task does not exist.
+
+        """
+        if job.task_version is None:
+            return
+        with self.task_descriptions_lock:
+            description = self.task_descriptions.get(job.task_id)
+        if description is None or description['version'] != job.task_version:
+            with SessionGen(commit=False) as session:
+                task = Task.get_from_id(job.task_id, session)
+                if task is None:
+                    err_msg = "Task %s of job '%s' not found." % \
+                        (job.task_id, job.info)
+                    logger.error(err_msg)
+                    raise JobException(err_msg)
+                description = describe_task(task)
+            if description['version'] != job.task_version:
+                # The result carries the current version, so that ES
+                # notices and reads the task again.
+                logger.warning("Task %s changed since ES read it, using "
+                               "the current version." % job.task_id)
+            with self.task_descriptions_lock:
+                self.task_descriptions[job.task_id] = description
+        job.set_task_description(description)
+
+    def run_job(self, job, slot, job_key=None):
+        """Execute a job in a slot already taken, filling it with the
+        results.
+
+        job (Job): the job to execute.
+        slot (int): the slot.
+        job_key (list): how ES identifies the job, or None not to
+                        report the testcases evaluated.
+
+        raise: JobException if the job fails.
+
+        """
+        try:
+            logger.operation = "job '%s'" % (job.info)
+            logger.info("Request received in slot %d" % slot)
+            job.shard = self.shard
+
+            task_type = get_task_type(job, self.file_cacher)
+            task_type.worker_slot = slot
+            if isinstance(job, EvaluationJob) and job_key is not None \
+                    and self.evaluation_service is not None:
+                task_type.testcase_callback = \
+                    lambda test_number: self.report_testcase(
+                        job, slot, job_key, test_number)
+            self.task_types[slot] = task_type
+            task_type.execute_job()
+            logger.info("Request finished.")
+
+            # We record how fast we were when we evaluated, for later
+            # audits (not for outcomes reused from the cache, which
+            # have no sandbox).
+            if isinstance(job, EvaluationJob):
+                for evaluation in job.evaluations.itervalues():
+                    if evaluation['sandboxes'] != []:
+                        evaluation['speed_index'] = self.speed_index
+
+        except:
+            err_msg = "Worker failed on operation `%s'" % job.info
+            logger.error("%s\n%s" % (err_msg, traceback.format_exc()))
+            raise JobException(err_msg)
+
+        finally:
+            self.task_types[slot] = None
+            logger.operation = ""
+
+    def report_testcase(self, job, slot, job_key, test_number):
+        """Queue the report to ES that the evaluation of a testcase
+        ended, with its outcome (except for user tests, whose output
+        can be large and is useless before the end).
+
+        job (EvaluationJob): the job being executed.
+        slot (int): the slot executing it.
+        job_key (list): how ES identifies the job.
+        test_number (int): the index of the testcase.
+
+        """
+        evaluation = None
+        if not job.get_output:
+            evaluation = dict(job.evaluations[test_number])
+            if evaluation['sandboxes'] != []:
+                evaluation['speed_index'] = self.speed_index
+        if job.testcase_subset is not None:
+            total = len(job.testcase_subset)
+        else:
+            total = len(job.testcases)
+        with self.progress_reports_lock:
+            self.progress_reports.append({
+                "shard": self.shard,
+                "slot": slot,
+                "job_key": job_key,
+                "test_number": test_number,
+                "evaluation": evaluation,
+                "evaluated": len(job.evaluations),
+                "total": total})
+
+    def send_progress_reports(self):
+        """Send to ES the reports queued by report_testcase.
+
+        return (bool): True, to be called again.
+
+        """
+        with self.progress_reports_lock:
+            reports = list(self.progress_reports)
+            self.progress_reports.clear()
+        for report in reports:
+            self.evaluation_service.testcase_evaluated(**report)
+        return True
+
 
 def main():
     """Parse arguments and launch service.
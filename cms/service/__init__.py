@@ -20,7 +20,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from cms import logger
-from cms.db.SQLAlchemyAll import SessionGen, Contest, Submission, Task, User
+from cms.db.SQLAlchemyAll import SessionGen, Submission, Task
 
 
 def get_submissions(contest_id,
@@ -50,19 +50,17 @@ def get_submissions(contest_id,
     submission_ids = []
     if submission_id is not None:
         submission_ids = [submission_id]
-    elif user_id is not None:
-        with SessionGen(commit=False) as session:
-            user = User.get_from_id(user_id, session)
-            submission_ids = [x.id for x in user.submissions]
-    elif task_id is not None:
-        with SessionGen(commit=False) as session:
-            submissions = session.query(Submission)\
-                .join(Task).filter(Task.id == task_id)
-            submission_ids = [x.id for x in submissions]
     else:
+        # We only need the ids, so we do not load the submissions.
         with SessionGen(commit=False) as session:
-            contest = session.query(Contest).\
-                filter_by(id=contest_id).first()
-            submission_ids = [x.id for x in contest.get_submissions()]
+            query = session.query(Submission.id)
+            if user_id is not None:
+                query = query.filter(Submission.user_id == user_id)
+            elif task_id is not None:
+                query = query.filter(Submission.task_id == task_id)
+            else:
+                query = query.join(Submission.task)\
+                    .filter(Task.contest_id == contest_id)
+            submission_ids = [x.id for x in query]
 
     return submission_ids
@@ -0,0 +1,129 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+# Programming contest management system
+# Copyright © 2010-2012 Giovanni Mascellani <mascellani@poisson.phc.unipi.it>
+# Copyright © 2010-2012 Stefano Maggiolo <s.maggiolo@gmail.com>
+# Copyright © 2010-2012 Matteo Boscariol <boscarim@hotmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark of the methods to put the files of the cache of a
+Worker in its sandboxes (see config.sandbox_provisioning).
+
+The files are put in a cache and in directories like the ones of the
+sandboxes, as given by config.cache_dir and config.temp_dir, without
+running isolate.
+
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from cms import config
+from cms.db.FileCacher import FileCacher
+from cms.grading.Sandbox import PROVISIONING_METHODS, provision_file
+
+
+def create_files(file_cacher, size, number):
+    """Put some files of random content in the cache.
+
+    file_cacher (FileCacher): the file cacher to use.
+    size (int): the size of each file, in bytes.
+    number (int): the number of files.
+
+    return (list): the digests of the files.
+
+    """
+    digests = []
+    for unused_i in xrange(number):
+        temp_fd, temp_path = tempfile.mkstemp(dir=config.temp_dir)
+        with os.fdopen(temp_fd, "wb") as temp_file:
+            written = 0
+            while written < size:
+                chunk = os.urandom(min(FileCacher.CHUNK_SIZE,
+                                       size - written))
+                temp_file.write(chunk)
+                written += len(chunk)
+        digests.append(file_cacher.put_file(path=temp_path))
+        os.remove(temp_path)
+    return digests
+
+
+def benchmark(file_cacher, digests, method, rounds):
+    """Put all the files in a new directory, for some rounds, with a
+    provisioning method.
+
+    file_cacher (FileCacher): the file cacher with the files.
+    digests (list): the files to provision.
+    method (string): the provisioning method.
+    rounds (int): the number of times to provision all the files.
+
+    return (float, set): the average time of a round, in seconds, and
+                         the methods actually used.
+
+    """
+    used = set()
+    elapsed = 0.0
+    for unused_i in xrange(rounds):
+        box = tempfile.mkdtemp(dir=config.temp_dir)
+        start = time.time()
+        for idx, digest in enumerate(digests):
+            used.add(provision_file(file_cacher.get_cached_path(digest),
+                                    os.path.join(box, "input%d.txt" % idx),
+                                    method))
+        elapsed += time.time() - start
+        shutil.rmtree(box)
+    return elapsed / rounds, used
+
+
+def main():
+    """Parse arguments and run the benchmark.
+
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark of the provisioning of the files of "
+        "the sandboxes.")
+    parser.add_argument("-s", "--size", action="store", type=int,
+                        default=100, help="size of each file in MB")
+    parser.add_argument("-n", "--files", action="store", type=int,
+                        default=10, help="number of files")
+    parser.add_argument("-r", "--rounds", action="store", type=int,
+                        default=5, help="number of rounds for each method")
+    args = parser.parse_args()
+
+    storage = tempfile.mkdtemp(dir=config.temp_dir)
+    file_cacher = FileCacher(path=storage)
+    try:
+        print "Creating %d files of %d MB..." % (args.files, args.size)
+        digests = create_files(file_cacher, args.size * 2 ** 20,
+                               args.files)
+        total = args.files * args.size
+        for method in PROVISIONING_METHODS:
+            elapsed, used = benchmark(file_cacher, digests, method,
+                                      args.rounds)
+            print "%-10s %8.3f s per round, %10.1f MB/s (used: %s)" % (
+                method, elapsed, total / max(elapsed, 1e-6),
+                ", ".join(sorted(used)))
+    finally:
+        file_cacher.purge_cache()
+        shutil.rmtree(file_cacher.base_dir)
+        shutil.rmtree(storage)
+
+
+if __name__ == "__main__":
+    main()
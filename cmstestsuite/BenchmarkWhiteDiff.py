@@ -0,0 +1,133 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+# Programming contest management system
+# Copyright © 2010-2012 Giovanni Mascellani <mascellani@poisson.phc.unipi.it>
+# Copyright © 2010-2012 Stefano Maggiolo <s.maggiolo@gmail.com>
+# Copyright © 2010-2012 Matteo Boscariol <boscarim@hotmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark of white_diff on large generated outputs, against the
+line by line comparison it replaced (that is also used to check that
+both give the same results).
+
+"""
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from cms import config
+from cms.grading import WHITES, white_diff, white_diff_canonicalize
+
+
+def line_by_line_white_diff(output, res):
+    """The previous implementation of white_diff, reading the files
+    line by line.
+
+    output (file): the first file to compare.
+    res (file): the second file to compare.
+    return (bool): True if the two file are equal for white_diff.
+
+    """
+    while True:
+        lout = output.readline()
+        lres = res.readline()
+        if lres == '' and lout == '':
+            return True
+        elif lres == '' or lout == '':
+            if lout.strip(WHITES) != '' or lres.strip(WHITES) != '':
+                return False
+        elif white_diff_canonicalize(lout) != white_diff_canonicalize(lres):
+            return False
+
+
+def generate(path, tokens, per_line, variant):
+    """Write an output of random numbers, the same for the same
+    number of tokens, with different whitespaces or contents.
+
+    path (string): where to write the output.
+    tokens (int): the number of tokens.
+    per_line (int): the number of tokens on each line.
+    variant (string): "reference", "identical", "whitespaces" (other
+                      whitespaces and trailing empty lines) or "last"
+                      (the last token differs).
+
+    """
+    rand = random.Random(42)
+    with open(path, "wb") as out:
+        for line_start in xrange(0, tokens, per_line):
+            line = [str(rand.randint(0, 10 ** 9))
+                    for unused_i in xrange(min(per_line,
+                                               tokens - line_start))]
+            if variant == "last" and line_start + per_line >= tokens:
+                line[-1] += "0"
+            if variant == "whitespaces":
+                out.write("  " + " \t ".join(line) + " \r\n")
+            else:
+                out.write(" ".join(line) + "\n")
+        if variant == "whitespaces":
+            out.write("\n \n")
+
+
+def main():
+    """Parse arguments and run the benchmark.
+
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark of white_diff.")
+    parser.add_argument("-t", "--tokens", action="store", type=int,
+                        default=10 ** 7, help="number of tokens")
+    parser.add_argument("-l", "--per-line", action="store", type=int,
+                        default=10, help="number of tokens on each line")
+    parser.add_argument("-s", "--skip-old", action="store_true",
+                        help="do not run the previous implementation")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(dir=config.temp_dir)
+    try:
+        print "Generating outputs of %d tokens..." % args.tokens
+        paths = {}
+        for variant in ["reference", "identical", "whitespaces", "last"]:
+            paths[variant] = os.path.join(directory, variant)
+            generate(paths[variant], args.tokens, args.per_line, variant)
+
+        implementations = [("white_diff", white_diff)]
+        if not args.skip_old:
+            implementations.append(("line by line",
+                                    line_by_line_white_diff))
+        for variant in ["identical", "whitespaces", "last"]:
+            results = set()
+            for name, function in implementations:
+                with open(paths[variant], "rb") as output:
+                    with open(paths["reference"], "rb") as res:
+                        start = time.time()
+                        result = function(output, res)
+                        elapsed = time.time() - start
+                results.add(result)
+                print "%-12s %-14s %8.3f s (%s)" % (
+                    variant, name, elapsed,
+                    "equal" if result else "different")
+            if len(results) > 1:
+                print "ERROR: the implementations disagree."
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
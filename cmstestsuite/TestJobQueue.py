@@ -0,0 +1,167 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+# Programming contest management system
+# Copyright © 2010-2012 Giovanni Mascellani <mascellani@poisson.phc.unipi.it>
+# Copyright © 2010-2012 Stefano Maggiolo <s.maggiolo@gmail.com>
+# Copyright © 2010-2012 Matteo Boscariol <boscarim@hotmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the order in which JobQueue serves the jobs.
+
+Run with: python -m cmstestsuite.TestJobQueue
+
+"""
+
+import unittest
+from datetime import datetime, timedelta
+
+from cms.service.EvaluationService import JobQueue
+
+
+def job(idx):
+    """Return a job for the tests.
+
+    idx (int): the id of the submission of the job.
+
+    return (job): an evaluation job.
+
+    """
+    return ("evaluate", idx)
+
+
+def timestamp(seconds):
+    """Return a timestamp for the tests.
+
+    seconds (int): seconds after an arbitrary instant.
+
+    return (datetime): the timestamp.
+
+    """
+    return datetime(2013, 1, 1) + timedelta(seconds=seconds)
+
+
+def pop_all(queue):
+    """Empty a queue.
+
+    queue (JobQueue): the queue.
+
+    return (list): the ids of the submissions of the jobs, in the
+                   order they have been served.
+
+    """
+    served = []
+    while not queue.empty():
+        served.append(queue.pop()[2][1])
+    return served
+
+
+class TestJobQueue(unittest.TestCase):
+    """Tests for JobQueue without fair-share.
+
+    """
+    def test_priority_then_timestamp(self):
+        queue = JobQueue()
+        queue.push(job(1), 2, timestamp(1))
+        queue.push(job(2), 1, timestamp(3))
+        queue.push(job(3), 2, timestamp(0))
+        queue.push(job(4), 1, timestamp(2))
+        self.assertEqual(pop_all(queue), [4, 2, 3, 1])
+
+    def test_users_ignored(self):
+        queue = JobQueue()
+        for idx in xrange(3):
+            queue.push(job(idx), 1, timestamp(idx), user=1)
+        queue.push(job(3), 1, timestamp(3), user=2)
+        self.assertEqual(pop_all(queue), [0, 1, 2, 3])
+
+    def test_remove_and_extract(self):
+        queue = JobQueue()
+        for idx in xrange(5):
+            queue.push(job(idx), 1, timestamp(idx))
+        queue.remove(job(0))
+        self.assertEqual(queue.extract(job(3)), (1, timestamp(3), job(3)))
+        self.assertFalse(job(3) in queue)
+        self.assertRaises(KeyError, queue.remove, job(3))
+        self.assertEqual(pop_all(queue), [1, 2, 4])
+
+    def test_cost_weight(self):
+        queue = JobQueue(cost_weight=1.0)
+        queue.push(job(1), 1, timestamp(0), cost=100.0)
+        queue.push(job(2), 1, timestamp(10), cost=1.0)
+        queue.push(job(3), 1, timestamp(200), cost=1.0)
+        # The long job goes after the short one arrived later, but
+        # before the ones arrived much later.
+        self.assertEqual(pop_all(queue), [2, 1, 3])
+
+
+class TestFairShareJobQueue(unittest.TestCase):
+    """Tests for JobQueue in fair-share mode.
+
+    """
+    def test_round_robin(self):
+        queue = JobQueue(fair_share=True)
+        for idx in xrange(3):
+            queue.push(job(idx), 1, timestamp(idx), user=1)
+        queue.push(job(10), 1, timestamp(10), user=2)
+        queue.push(job(11), 1, timestamp(11), user=2)
+        queue.push(job(20), 1, timestamp(20), user=3)
+        self.assertEqual(pop_all(queue), [0, 10, 20, 1, 11, 2])
+
+    def test_priority_first(self):
+        queue = JobQueue(fair_share=True)
+        queue.push(job(0), 2, timestamp(0), user=1)
+        queue.push(job(1), 2, timestamp(1), user=2)
+        queue.push(job(2), 1, timestamp(2), user=1)
+        queue.push(job(3), 1, timestamp(3), user=1)
+        self.assertEqual(pop_all(queue), [2, 3, 0, 1])
+
+    def test_late_user(self):
+        # A user arriving when the first rounds have been served
+        # starts from the round being served, not from the first.
+        queue = JobQueue(fair_share=True)
+        for idx in xrange(4):
+            queue.push(job(idx), 1, timestamp(idx), user=1)
+        self.assertEqual(queue.pop()[2], job(0))
+        self.assertEqual(queue.pop()[2], job(1))
+        queue.push(job(10), 1, timestamp(10), user=2)
+        queue.push(job(11), 1, timestamp(11), user=2)
+        self.assertEqual(pop_all(queue), [10, 2, 11, 3])
+
+    def test_unknown_user(self):
+        queue = JobQueue(fair_share=True)
+        queue.push(job(0), 1, timestamp(0), user=1)
+        queue.push(job(1), 1, timestamp(1), user=1)
+        queue.push(job(2), 1, timestamp(2))
+        self.assertEqual(pop_all(queue), [0, 2, 1])
+
+    def test_extract_advances_round(self):
+        queue = JobQueue(fair_share=True)
+        for idx in xrange(3):
+            queue.push(job(idx), 1, timestamp(idx), user=1)
+        queue.extract(job(2))
+        queue.push(job(10), 1, timestamp(10), user=2)
+        self.assertEqual(pop_all(queue), [0, 1, 10])
+
+
+def main():
+    """Run the tests.
+
+    """
+    unittest.main(module="cmstestsuite.TestJobQueue")
+
+
+if __name__ == "__main__":
+    main()
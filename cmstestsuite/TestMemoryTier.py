@@ -0,0 +1,188 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+# Programming contest management system
+# Copyright © 2010-2012 Giovanni Mascellani <mascellani@poisson.phc.unipi.it>
+# Copyright © 2010-2012 Stefano Maggiolo <s.maggiolo@gmail.com>
+# Copyright © 2010-2012 Matteo Boscariol <boscarim@hotmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the memory tier of the cache of the FileCacher.
+
+Run with: python -m cmstestsuite.TestMemoryTier
+
+"""
+
+import importlib
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from cms.db.FileCacher import MemoryTier
+
+# The module itself, as cms.db.FileCacher is also the name of the
+# class in the package cms.db.
+FileCacherModule = importlib.import_module("cms.db.FileCacher")
+
+
+class TestMemoryTier(unittest.TestCase):
+    """Tests for MemoryTier, with files in a temporary directory
+    playing the role of the cache.
+
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.tier = MemoryTier(os.path.join(self.directory, "tier"), 100)
+        self.copyfile = FileCacherModule.shutil.copyfile
+
+    def tearDown(self):
+        FileCacherModule.shutil.copyfile = self.copyfile
+        shutil.rmtree(self.directory)
+
+    def cache_file(self, digest, size):
+        """Create a file of the cache.
+
+        digest (string): the name of the file.
+        size (int): the size of the file.
+
+        return (string): the path of the file.
+
+        """
+        path = os.path.join(self.directory, digest)
+        with open(path, "wb") as file_:
+            file_.write(digest[0] * size)
+        return path
+
+    def get(self, digest, size=40):
+        """Get a file from the tier, creating it in the cache.
+
+        digest (string): the name of the file.
+        size (int): the size of the file.
+
+        return (string): the path of the file in the tier.
+
+        """
+        return self.tier.get_path(digest, self.cache_file(digest, size))
+
+    def in_tier(self, digest):
+        """Tell if a file is in the directory of the tier.
+
+        digest (string): the name of the file.
+
+        return (bool): True if the file is there.
+
+        """
+        return os.path.exists(os.path.join(self.tier.path, digest))
+
+    def test_copy(self):
+        path = self.get("a", 10)
+        self.assertEqual(path, os.path.join(self.tier.path, "a"))
+        with open(path, "rb") as file_:
+            self.assertEqual(file_.read(), "a" * 10)
+        self.assertEqual(self.get("a", 10), path)
+        status = self.tier.get_status()
+        self.assertEqual((status["hits"], status["misses"],
+                          status["files"], status["size"]),
+                         (1, 1, 1, 10))
+
+    def test_least_recently_used_evicted(self):
+        self.get("a")
+        self.get("b")
+        # Now "b" is the least recently used.
+        self.get("a")
+        self.get("c")
+        self.assertTrue(self.in_tier("a"))
+        self.assertFalse(self.in_tier("b"))
+        self.assertTrue(self.in_tier("c"))
+        status = self.tier.get_status()
+        self.assertEqual((status["evictions"], status["size"]), (1, 80))
+
+    def test_many_evicted(self):
+        for digest in "abc":
+            self.get(digest, 30)
+        self.get("d", 90)
+        for digest in "abc":
+            self.assertFalse(self.in_tier(digest))
+        self.assertTrue(self.in_tier("d"))
+        self.assertEqual(self.tier.get_status()["evictions"], 3)
+
+    def test_too_large(self):
+        self.get("a")
+        self.assertEqual(self.get("b", 101), None)
+        self.assertFalse(self.in_tier("b"))
+        self.assertTrue(self.in_tier("a"))
+
+    def test_not_counted(self):
+        path = self.cache_file("a", 10)
+        self.tier.get_path("a", path, count=False)
+        self.tier.get_path("a", path, count=False)
+        status = self.tier.get_status()
+        self.assertEqual((status["hits"], status["misses"],
+                          status["files"]), (0, 0, 1))
+
+    def test_discard(self):
+        self.get("a")
+        self.tier.discard("a")
+        self.tier.discard("b")
+        self.assertFalse(self.in_tier("a"))
+        status = self.tier.get_status()
+        self.assertEqual((status["files"], status["size"]), (0, 0))
+
+    def test_hit_during_copy(self):
+        self.get("a")
+        hits = []
+
+        def copyfile(source, dest):
+            # Another thread asks for a file in the tier meanwhile.
+            thread = threading.Thread(
+                target=lambda: hits.append(self.get("a")))
+            thread.start()
+            thread.join(5)
+            self.copyfile(source, dest)
+        FileCacherModule.shutil.copyfile = copyfile
+
+        self.get("b")
+        self.assertEqual(hits, [os.path.join(self.tier.path, "a")])
+        self.assertTrue(self.in_tier("b"))
+
+    def test_failed_copy(self):
+        def copyfile(source, dest):
+            raise IOError("No space left on device")
+        FileCacherModule.shutil.copyfile = copyfile
+        self.assertRaises(IOError, self.get, "a")
+        self.assertEqual(self.tier.get_status()["size"], 0)
+
+        FileCacherModule.shutil.copyfile = self.copyfile
+        self.get("a")
+        self.assertTrue(self.in_tier("a"))
+
+    def test_emptied_on_creation(self):
+        self.get("a")
+        tier = MemoryTier(self.tier.path, 100)
+        self.assertFalse(self.in_tier("a"))
+        self.assertEqual(tier.get_status()["files"], 0)
+
+
+def main():
+    """Run the tests.
+
+    """
+    unittest.main(module="cmstestsuite.TestMemoryTier")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+# Programming contest management system
+# Copyright © 2010-2012 Giovanni Mascellani <mascellani@poisson.phc.unipi.it>
+# Copyright © 2010-2012 Stefano Maggiolo <s.maggiolo@gmail.com>
+# Copyright © 2010-2012 Matteo Boscariol <boscarim@hotmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the pool of sandboxes and for the provisioning of their
+files. They do not need isolate: the sandboxes do not initialize nor
+clean up their boxes.
+
+Run with: python -m cmstestsuite.TestSandbox
+
+"""
+
+import errno
+import importlib
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from cms.grading.Sandbox import Sandbox, SandboxPool, provision_file
+
+# The module itself, as cms.grading.Sandbox is also the name of the
+# class in the package cms.grading.
+SandboxModule = importlib.import_module("cms.grading.Sandbox")
+
+
+class FakeSandbox(Sandbox):
+    """A sandbox whose box is not really initialized or cleaned up
+    by isolate, but that keeps track of the box generations as a real
+    one does.
+
+    """
+    def __init__(self, file_cacher=None, temp_dir=None, slot=0, lane=0):
+        self.file_cacher = file_cacher
+        self.box_id = SandboxModule.get_box_id(file_cacher, slot, lane)
+        self.inner_temp_dir = "/tmp"
+        self.outer_temp_dir = tempfile.mkdtemp(dir=temp_dir)
+        self.path = self.outer_temp_dir + self.inner_temp_dir
+        os.mkdir(self.path)
+        self.log = None
+        self.exec_num = -1
+        self.reset_parameters()
+        self.generation = Sandbox.new_box_generation(self.box_id)
+
+    def delete(self):
+        Sandbox.new_box_generation(self.box_id)
+        shutil.rmtree(self.outer_temp_dir)
+
+
+class TestSandboxPool(unittest.TestCase):
+    """Tests for SandboxPool.
+
+    """
+    def setUp(self):
+        # The pool creates the sandboxes it does not have.
+        SandboxModule.Sandbox = FakeSandbox
+        self.pool = SandboxPool()
+
+    def tearDown(self):
+        SandboxModule.Sandbox = Sandbox
+
+    def test_reuse(self):
+        sandbox = self.pool.borrow(slot=0)
+        with open(os.path.join(sandbox.path, "output.txt"), "w") as file_:
+            file_.write("1\n")
+        sandbox.exec_num = 3
+        self.pool.give_back(sandbox)
+
+        self.assertTrue(self.pool.borrow(slot=0) is sandbox)
+        self.assertEqual(os.listdir(sandbox.path), [])
+        self.assertEqual(sandbox.exec_num, -1)
+        sandbox.delete()
+
+    def test_boxes(self):
+        sandbox = self.pool.borrow(slot=0)
+        self.pool.give_back(sandbox)
+        other = self.pool.borrow(slot=1)
+        self.assertFalse(other is sandbox)
+        self.assertNotEqual(other.box_id, sandbox.box_id)
+        self.assertTrue(self.pool.borrow(slot=0) is sandbox)
+        for box in [sandbox, other]:
+            box.delete()
+
+    def test_dirty_box(self):
+        sandbox = self.pool.borrow(slot=0)
+        self.pool.give_back(sandbox)
+        # Another sandbox initializes the same box.
+        other = FakeSandbox(slot=0)
+        self.assertFalse(sandbox.is_clean())
+
+        new = self.pool.borrow(slot=0)
+        self.assertFalse(new is sandbox)
+        self.assertTrue(new.is_clean())
+        self.assertFalse(os.path.exists(sandbox.outer_temp_dir))
+        # The new sandbox owns the box now.
+        self.assertFalse(other.is_clean())
+        for box in [new, other]:
+            shutil.rmtree(box.outer_temp_dir)
+
+    def test_deleted_directory(self):
+        sandbox = self.pool.borrow(slot=0)
+        shutil.rmtree(sandbox.path)
+        self.assertFalse(sandbox.is_clean())
+        self.pool.give_back(sandbox)
+        self.assertFalse(os.path.exists(sandbox.outer_temp_dir))
+        new = self.pool.borrow(slot=0)
+        self.assertFalse(new is sandbox)
+        new.delete()
+
+    def test_one_for_each_box(self):
+        first = FakeSandbox(slot=0)
+        self.pool.give_back(first)
+        # A sandbox for a box already in the pool is deleted.
+        second = FakeSandbox(slot=0)
+        self.pool.give_back(second)
+        self.assertFalse(os.path.exists(second.outer_temp_dir))
+        shutil.rmtree(first.outer_temp_dir)
+
+
+class TestProvisionFile(unittest.TestCase):
+    """Tests for provision_file.
+
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.source = os.path.join(self.directory, "source")
+        with open(self.source, "wb") as file_:
+            file_.write("content\n")
+        self.dest = os.path.join(self.directory, "dest")
+        self.link = os.link
+        self.ioctl = SandboxModule.fcntl.ioctl
+
+    def tearDown(self):
+        os.link = self.link
+        SandboxModule.fcntl.ioctl = self.ioctl
+        shutil.rmtree(self.directory)
+
+    def check_dest(self, executable=False):
+        """Check the content and the permissions of the new file.
+
+        executable (bool): whether the file must be executable.
+
+        """
+        with open(self.dest, "rb") as file_:
+            self.assertEqual(file_.read(), "content\n")
+        mode = os.stat(self.dest).st_mode
+        self.assertTrue(mode & stat.S_IROTH)
+        self.assertEqual(bool(mode & stat.S_IXOTH), executable)
+        self.assertFalse(mode & (stat.S_IWGRP | stat.S_IWOTH))
+
+    def test_copy(self):
+        self.assertEqual(provision_file(self.source, self.dest, "copy"),
+                         "copy")
+        self.check_dest()
+        self.assertNotEqual(os.stat(self.source).st_ino,
+                            os.stat(self.dest).st_ino)
+
+    def test_copy_executable(self):
+        provision_file(self.source, self.dest, "copy", executable=True)
+        self.check_dest(executable=True)
+
+    def test_unknown_method(self):
+        self.assertEqual(provision_file(self.source, self.dest, "other"),
+                         "copy")
+        self.check_dest()
+
+    def test_hardlink(self):
+        self.assertEqual(provision_file(self.source, self.dest, "hardlink",
+                                        executable=True), "hardlink")
+        self.check_dest(executable=True)
+        self.assertEqual(os.stat(self.source).st_ino,
+                         os.stat(self.dest).st_ino)
+        # Nobody (but root) can modify the shared file.
+        self.assertFalse(os.stat(self.source).st_mode & stat.S_IWUSR)
+
+    def test_hardlink_keeps_executable(self):
+        # A file linked elsewhere as an executable stays executable.
+        provision_file(self.source, self.dest, "hardlink", executable=True)
+        other = os.path.join(self.directory, "other")
+        provision_file(self.source, other, "hardlink")
+        self.assertTrue(os.stat(other).st_mode & stat.S_IXOTH)
+
+    def test_hardlink_fallback(self):
+        def fail(source, dest):
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+        os.link = fail
+        self.assertEqual(provision_file(self.source, self.dest, "hardlink"),
+                         "copy")
+        self.check_dest()
+
+    def test_reflink(self):
+        # Whether it works depends on the file system.
+        self.assertTrue(provision_file(self.source, self.dest, "reflink")
+                        in ["reflink", "copy"])
+        self.check_dest()
+
+    def test_reflink_fallback(self):
+        def fail(fd, request, arg):
+            raise IOError(errno.EOPNOTSUPP, "Operation not supported")
+        SandboxModule.fcntl.ioctl = fail
+        self.assertEqual(provision_file(self.source, self.dest, "reflink"),
+                         "copy")
+        self.check_dest()
+
+
+def main():
+    """Run the tests.
+
+    """
+    unittest.main(module="cmstestsuite.TestSandbox")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+# Programming contest management system
+# Copyright © 2010-2012 Giovanni Mascellani <mascellani@poisson.phc.unipi.it>
+# Copyright © 2010-2012 Stefano Maggiolo <s.maggiolo@gmail.com>
+# Copyright © 2010-2012 Matteo Boscariol <boscarim@hotmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for white_diff, against the line by line comparison it
+replaced.
+
+Run with: python -m cmstestsuite.TestWhiteDiff
+
+"""
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+import cms.grading
+from cms.grading import white_diff
+from cmstestsuite.BenchmarkWhiteDiff import line_by_line_white_diff
+
+
+class TestWhiteDiff(unittest.TestCase):
+    """Tests for white_diff, on files and on file-like objects.
+
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.chunk_size = cms.grading.WHITE_DIFF_CHUNK_SIZE
+
+    def tearDown(self):
+        cms.grading.WHITE_DIFF_CHUNK_SIZE = self.chunk_size
+        shutil.rmtree(self.directory)
+
+    def compare(self, output, res):
+        """Compare two contents with white_diff, both as files and as
+        strings, checking that it agrees with the line by line
+        comparison.
+
+        output (string): the first content.
+        res (string): the second content.
+
+        return (bool): the result of white_diff.
+
+        """
+        paths = []
+        for idx, content in enumerate([output, res]):
+            paths.append(os.path.join(self.directory, "file%d" % idx))
+            with open(paths[-1], "wb") as file_:
+                file_.write(content)
+        with open(paths[0], "rb") as output_file:
+            with open(paths[1], "rb") as res_file:
+                result = white_diff(output_file, res_file)
+        self.assertEqual(white_diff(StringIO(output), StringIO(res)),
+                         result)
+        self.assertEqual(line_by_line_white_diff(StringIO(output),
+                                                 StringIO(res)),
+                         result, "white_diff(%r, %r)" % (output, res))
+        return result
+
+    def test_equal(self):
+        self.assertTrue(self.compare("", ""))
+        self.assertTrue(self.compare("1 2\n3\n", "1 2\n3\n"))
+
+    def test_whitespaces(self):
+        self.assertTrue(self.compare("1 2\n3\n", "  1\t 2 \r\n3"))
+        self.assertTrue(self.compare("1 2\n3\n", "1 2\n3\n\n \n\t\n"))
+        self.assertTrue(self.compare("", "\n\n"))
+        self.assertTrue(self.compare("1 2\n", " 1  2  \n"))
+
+    def test_different(self):
+        self.assertFalse(self.compare("1 2\n3\n", "1 2\n4\n"))
+        self.assertFalse(self.compare("1 2\n3\n", "1 2 3\n"))
+        self.assertFalse(self.compare("1 2\n3\n", "12\n3\n"))
+        self.assertFalse(self.compare("1\n\n2\n", "1\n2\n"))
+        self.assertFalse(self.compare("1\n", ""))
+        self.assertFalse(self.compare("1\n", "\n1\n"))
+
+    def test_small_chunks(self):
+        # Pieces and comparisons spanning many lines or splitting
+        # them, as it happens for large files.
+        cms.grading.WHITE_DIFF_CHUNK_SIZE = 3
+        self.assertTrue(self.compare("10 20 30\n40\n\n50\n",
+                                     "10  20 30 \n 40\n\n50\n\n\n"))
+        self.assertFalse(self.compare("10 20 30\n40\n\n50\n",
+                                      "10 20 30\n40\n50\n"))
+        self.assertFalse(self.compare("10 20 30\n40\n\n50\n",
+                                      "10 20 30\n40\n\n51\n"))
+
+    def test_random(self):
+        rand = random.Random(42)
+        for chunk_size in [self.chunk_size, 1, 5]:
+            cms.grading.WHITE_DIFF_CHUNK_SIZE = chunk_size
+            for unused_i in xrange(300):
+                output = "".join(rand.choice("ab \t\r\n")
+                                 for unused_j in xrange(rand.randint(0, 12)))
+                res = "".join(rand.choice("a \n")
+                              for unused_j in xrange(rand.randint(0, 12)))
+                self.compare(output, res)
+                self.compare(output, output.replace(" ", "\t"))
+
+
+def main():
+    """Run the tests.
+
+    """
+    unittest.main(module="cmstestsuite.TestWhiteDiff")
+
+
+if __name__ == "__main__":
+    main()
@@ -816,6 +816,11 @@ cg_enter(void)
       cg_write(CG_MEMORY, "?memory.memsw.limit_in_bytes", "%lld\n", (long long) cg_memory_limit << 10);
     }
 
+  // The box can be run many times between --init and --cleanup, so
+  // the peak memory usage must not include the previous runs.
+  cg_write(CG_MEMORY, "?memory.max_usage_in_bytes", "0\n");
+  cg_write(CG_MEMORY, "?memory.memsw.max_usage_in_bytes", "0\n");
+
   if (cg_timing)
     cg_write(CG_CPUACCT, "cpuacct.usage", "0\n");
 }
@@ -118,6 +118,13 @@ def do_setup():
                   "cmsReplayContest=cmstestsuite.ReplayContest:main",
                   "cmsAdaptContest=cmstestsuite.AdaptContest:main",
                   "cmsTestFileCacher=cmstestsuite.TestFileCacher:main",
+                  "cmsTestSandbox=cmstestsuite.TestSandbox:main",
+                  "cmsTestMemoryTier=cmstestsuite.TestMemoryTier:main",
+                  "cmsTestJobQueue=cmstestsuite.TestJobQueue:main",
+                  "cmsTestWhiteDiff=cmstestsuite.TestWhiteDiff:main",
+                  "cmsBenchmarkProvisioning="
+                  "cmstestsuite.BenchmarkProvisioning:main",
+                  "cmsBenchmarkWhiteDiff=cmstestsuite.BenchmarkWhiteDiff:main",
 
                   "cmsAddUser=cmscontrib.AddUser:main",
                   "cmsRemoveUser=cmscontrib.RemoveUser:main",